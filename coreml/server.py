@@ -1,7 +1,8 @@
 from dotenv import load_dotenv
 import os
 import sys
-from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Header
+from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Header, Query
+from fastapi.responses import JSONResponse
 import uvicorn
 import numpy as np
 import cv2
@@ -9,6 +10,9 @@ import asyncio
 from pydantic import BaseModel
 from rapidocr_onnxruntime import RapidOCR
 import utils.clip as clip
+from utils.batcher import MicroBatcher
+from utils.ocr_format import LAYOUTS, box_columns, round2
+from utils.upload import upload_size, upload_buffer, image_dimensions
 
 on_linux = sys.platform.startswith('linux')
 
@@ -16,6 +20,9 @@ load_dotenv()
 app = FastAPI()
 api_auth_key = os.getenv("API_AUTH_KEY")
 model_prefix = os.getenv("MODEL_PREFIX")
+env_clip_batch_size = int(os.getenv("CLIP_BATCH_SIZE", "8")) # 并发的/clip/img请求合并推理的最大batch，设为1则逐张推理
+env_clip_batch_wait_ms = float(os.getenv("CLIP_BATCH_WAIT_MS", "5")) # 合并batch时等待后续请求的最长时间(毫秒)
+env_max_upload_mb = float(os.getenv("MAX_UPLOAD_MB", "100")) # 单个上传文件的大小上限(MB)，超过时在接收或解码前返回413，0为不限制
 
 inactive_task = None
 rapid_ocr = None
@@ -23,6 +30,13 @@ clip_img_model = None
 clip_txt_model = None
 
 
+def process_image_batch(images):
+    return clip.process_images(images, clip_img_model)
+
+
+clip_img_batcher = MicroBatcher(process_image_batch, max_batch_size=env_clip_batch_size, max_wait_ms=env_clip_batch_wait_ms)
+
+
 class ClipTxtRequest(BaseModel):
     text: str
 
@@ -61,6 +75,27 @@ async def check_activity(request, call_next):
     return response
 
 
+# 单文件上传的接口，按请求头的Content-Length提前拒绝过大的上传
+upload_paths = ("/ocr", "/clip/img")
+upload_form_overhead = 64 * 1024 # multipart表单中文件以外的部分(边界、字段头、其他参数)的大小余量
+
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    # 此时请求体还未接收，直接返回413，不再解析表单和写入临时文件
+    if env_max_upload_mb > 0 and request.url.path in upload_paths:
+        length = request.headers.get("content-length", "")
+        if length.isdigit() and int(length) > env_max_upload_mb * 1024 * 1024 + upload_form_overhead:
+            return JSONResponse(status_code=413, content={'detail': f"File too large, max {env_max_upload_mb:g}MB"})
+    return await call_next(request)
+
+
+def check_upload(file):
+    # 表单解析后、读取和解码前检查文件大小，覆盖没有Content-Length的分块上传
+    if env_max_upload_mb > 0 and upload_size(file) > env_max_upload_mb * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"File too large, max {env_max_upload_mb:g}MB")
+
+
 async def verify_header(api_key: str = Header(...)):
     # 在这里编写验证逻辑，例如检查 api_key 是否有效
     if api_key != api_auth_key:
@@ -68,27 +103,16 @@ async def verify_header(api_key: str = Header(...)):
     return api_key
 
 
-def to_fixed(num):
-    return str(round(num, 2))
-
-
-def trans_result(result):
-    texts = []
-    scores = []
-    boxes = []
-    if result is None:
-        return {'texts': texts, 'scores': scores, 'boxes': boxes}
-    for res_i in result:
-        dt_box = res_i[0]
-        box = {
-            'x': to_fixed(dt_box[0][0]),
-            'y': to_fixed(dt_box[0][1]),
-            'width': to_fixed(dt_box[1][0] - dt_box[0][0]),
-            'height': to_fixed(dt_box[2][1] - dt_box[0][1])
-        }
-        boxes.append(box)
-        texts.append(res_i[1])
-        scores.append(float(f"{res_i[2]:.3f}"))
+def trans_result(result, layout='default'):
+    if not result:
+        result = []
+    texts = [res_i[1] for res_i in result]
+    scores = [float(f"{res_i[2]:.3f}") for res_i in result]
+    # 所有文本框的坐标一次计算，str(round(v, 2)) 与旧版 to_fixed 的输出一致
+    x, y, width, height = (round2(column).tolist() for column in box_columns([res_i[0] for res_i in result]))
+    if layout == 'compact':
+        return {'texts': texts, 'scores': scores, 'boxes': {'x': x, 'y': y, 'width': width, 'height': height}}
+    boxes = [{'x': str(a), 'y': str(b), 'width': str(c), 'height': str(d)} for a, b, c, d in zip(x, y, width, height)]
     return {'texts': texts, 'scores': scores, 'boxes': boxes}
 
 
@@ -102,6 +126,14 @@ async def check_req(api_key: str = Depends(verify_header)):
     return {'result': 'pass'}
 
 
+@app.post("/status")
+async def status_req(api_key: str = Depends(verify_header)):
+    return {
+        'result': 'pass',
+        'clip_img_batcher': clip_img_batcher.stats(),
+    }
+
+
 @app.post("/restart")
 async def check_req(api_key: str = Depends(verify_header)):
     # 客户端可调用，触发重启进程来释放内存
@@ -109,9 +141,17 @@ async def check_req(api_key: str = Depends(verify_header)):
 
 
 @app.post("/ocr")
-async def process_image(file: UploadFile = File(...), api_key: str = Depends(verify_header)):
+async def process_image(file: UploadFile = File(...), layout: str = Query(LAYOUTS[0]), api_key: str = Depends(verify_header)):
+    if layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported layout, available: {', '.join(LAYOUTS)}")
+    check_upload(file)
+    size = image_dimensions(file)
+    if size is not None and max(size) > 10000:
+        # 只解析图片头部的宽高，超出范围的图片不再解码
+        return {'result': [], 'msg': 'height or width out of range'}
     load_ocr_model()
-    image_bytes = await file.read()
+    # 直接使用表单解析时保存的内容(内存缓冲区或临时文件的内存映射)，不再读取复制一份
+    image_bytes = upload_buffer(file)
     try:
         nparr = np.frombuffer(image_bytes, np.uint8)
         img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
@@ -119,7 +159,7 @@ async def process_image(file: UploadFile = File(...), api_key: str = Depends(ver
         if width > 10000 or height > 10000:
             return {'result': [], 'msg': 'height or width out of range'}
         _result = rapid_ocr(img)
-        result = trans_result(_result[0])
+        result = trans_result(_result[0], layout)
         del img
         del _result
         return {'result': result}
@@ -130,12 +170,15 @@ async def process_image(file: UploadFile = File(...), api_key: str = Depends(ver
 
 @app.post("/clip/img")
 async def clip_process_image(file: UploadFile = File(...), api_key: str = Depends(verify_header)):
+    check_upload(file)
     load_clip_img_model(model_prefix)
-    image_bytes = await file.read()
+    image_bytes = upload_buffer(file)
     try:
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        result = await predict(clip.process_image, img, clip_img_model)
+        img = clip.decode_image(image_bytes)
+        if img is None:
+            # 解码失败的图片不进入batch，避免影响同一batch内的其他请求
+            return {'result': [], 'msg': 'image decode failed'}
+        result = await clip_img_batcher.submit(img)
         return {'result': ["{:.16f}".format(vec) for vec in result]}
     except Exception as e:
         print(e)
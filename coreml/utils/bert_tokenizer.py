@@ -19,10 +19,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import collections
+import array
+import mmap
 import re
+import struct
+import sys
 import unicodedata
+import zlib
 import six
+from collections.abc import Mapping
 from functools import lru_cache
 import os
 
@@ -30,6 +35,11 @@ import os
 def default_vocab():
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), "vocab.txt")
 
+# 单个词的WordPiece切分结果缓存数量，搜索词、标签中的词大量重复
+WORDPIECE_CACHE_SIZE = 65536
+# 字符分类表最多缓存的字符数，避免大量不同的罕见字符占用过多内存
+CHAR_TABLE_MAX_SIZE = 65536
+
 def validate_case_matches_checkpoint(do_lower_case, init_checkpoint):
     """Checks whether the casing config is consistent with the checkpoint name."""
 
@@ -123,19 +133,142 @@ def printable_text(text):
         raise ValueError("Not running on Python2 or Python 3?")
 
 
-def load_vocab(vocab_file):
-    """Loads a vocabulary file into a dictionary."""
-    vocab = collections.OrderedDict()
-    index = 0
+def read_vocab_tokens(vocab_file):
+    """Reads a vocabulary file, one token per line, into a list of tokens in id order."""
     with open(vocab_file, "r", encoding="utf-8") as reader:
+        lines = reader.read().split("\n")
+    # 文件以换行结尾时最后是一个空字符串，不是词表中的一行
+    if lines and not lines[-1]:
+        lines.pop()
+    return [token.strip() for token in lines]
+
+
+def read_vocab_file(vocab_file):
+    """Parses a vocabulary file into a token -> index dictionary."""
+    return {token: index for index, token in enumerate(read_vocab_tokens(vocab_file))}
+
+
+def vocab_cache_path(vocab_file):
+    # 与 .pyc 一样放在 __pycache__ 目录下，不会提交到代码仓库
+    folder, name = os.path.split(os.path.abspath(vocab_file))
+    return os.path.join(folder, "__pycache__", name + ".map")
+
+
+class MappedVocab(Mapping):
+    """A read-only token -> index mapping served from a memory-mapped file.
+
+    Opening it only maps the file, nothing is parsed, so it takes well under a
+    millisecond, and every process that opens the same file shares its pages.
+    Layout (little endian): a header, N+1 uint32 offsets of the tokens in id
+    order, a power-of-two open addressing table of int32 ids keyed by the
+    crc32 of the UTF-8 token, then the concatenated UTF-8 tokens.
+    """
+
+    MAGIC = b"MTVOCAB1"
+    HEADER = struct.Struct("<8sIIQQ")  # magic, 词数, 哈希表大小, 词表文件大小, 词表文件修改时间
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, table_size, self.source_size, self.source_mtime = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC:
+            raise ValueError("not a vocab map file: %s" % path)
+        view = memoryview(self.map)
+        offsets_start = self.HEADER.size
+        table_start = offsets_start + (self.count + 1) * 4
+        self.blob_start = table_start + table_size * 4
+        self.offsets = view[offsets_start:table_start].cast("I")
+        self.table = view[table_start:self.blob_start].cast("i")
+        self.mask = table_size - 1
+
+    @classmethod
+    def build(cls, path, tokens, source_size, source_mtime):
+        """Writes tokens (in id order, without duplicates) to a map file at path."""
+        encoded = [token.encode("utf-8") for token in tokens]
+        table_size = 1
+        while table_size < len(encoded) * 2:
+            table_size *= 2
+        table = array.array("i", [-1]) * table_size
+        for index, data in enumerate(encoded):
+            slot = zlib.crc32(data) & (table_size - 1)
+            while table[slot] >= 0:
+                slot = (slot + 1) & (table_size - 1)
+            table[slot] = index
+        offsets = array.array("I", [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        if sys.byteorder != "little":
+            table.byteswap()
+            offsets.byteswap()
+        with open(path, "wb") as writer:
+            writer.write(cls.HEADER.pack(cls.MAGIC, len(encoded), table_size, source_size, source_mtime))
+            writer.write(offsets.tobytes())
+            writer.write(table.tobytes())
+            writer.write(b"".join(encoded))
+
+    def _token_bytes(self, index):
+        return self.map[self.blob_start + self.offsets[index]:self.blob_start + self.offsets[index + 1]]
+
+    def _find(self, token):
+        if not isinstance(token, str):
+            return -1
+        # 词表中只有合法的UTF-8，含单独代理字符的输入按原样编码后不会匹配到任何词
+        data = token.encode("utf-8", "surrogatepass")
+        slot = zlib.crc32(data) & self.mask
         while True:
-            token = convert_to_unicode(reader.readline())
-            if not token:
-                break
-            token = token.strip()
-            vocab[token] = index
-            index += 1
-    return vocab
+            index = self.table[slot]
+            if index < 0 or self._token_bytes(index) == data:
+                return index
+            slot = (slot + 1) & self.mask
+
+    def __getitem__(self, token):
+        index = self._find(token)
+        if index < 0:
+            raise KeyError(token)
+        return index
+
+    def __contains__(self, token):
+        return self._find(token) >= 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self._token_bytes(index).decode("utf-8")
+
+
+def load_vocab(vocab_file):
+    """Loads a vocabulary file into a token -> index mapping.
+
+    The vocabulary is compiled once into a MappedVocab file under __pycache__
+    next to vocab_file, rebuilt when the vocabulary file's size or mtime
+    changes. Falls back to a plain dictionary when the map file cannot be
+    written or the vocabulary contains duplicate tokens.
+    """
+    stat = os.stat(vocab_file)
+    cache_path = vocab_cache_path(vocab_file)
+    try:
+        vocab = MappedVocab(cache_path)
+        if (vocab.source_size, vocab.source_mtime) == (stat.st_size, stat.st_mtime_ns):
+            return vocab
+    except (OSError, ValueError, struct.error):
+        pass
+
+    tokens = read_vocab_tokens(vocab_file)
+    vocab = {token: index for index, token in enumerate(tokens)}
+    if len(vocab) != len(tokens):
+        return vocab
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # 先写临时文件再替换，多个进程同时启动时不会读到写了一半的文件
+        tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        MappedVocab.build(tmp_path, tokens, stat.st_size, stat.st_mtime_ns)
+        os.replace(tmp_path, cache_path)
+        return MappedVocab(cache_path)
+    except (OSError, ValueError) as e:
+        print(f"vocab map not saved: {e}")
+        return vocab
 
 
 def convert_by_vocab(vocab, items):
@@ -168,20 +301,29 @@ class FullTokenizer(object):
 
     def __init__(self, vocab_file=default_vocab(), do_lower_case=True):
         self.vocab = load_vocab(vocab_file)
-        self.inv_vocab = {v: k for k, v in self.vocab.items()}
+        self._inv_vocab = None
+        # MappedVocab 每次查找都要编码和计算哈希，常用词的id缓存在字典里
+        self.token_id = lru_cache(maxsize=WORDPIECE_CACHE_SIZE)(self.vocab.__getitem__)
         self.basic_tokenizer = BasicTokenizer(do_lower_case=do_lower_case)
         self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab)
 
+    @property
+    def inv_vocab(self):
+        # 只有把id转换回token时才用到，首次使用时再生成
+        if self._inv_vocab is None:
+            self._inv_vocab = {v: k for k, v in self.vocab.items()}
+        return self._inv_vocab
+
     def tokenize(self, text):
         split_tokens = []
         for token in self.basic_tokenizer.tokenize(text):
-            for sub_token in self.wordpiece_tokenizer.tokenize(token):
-                split_tokens.append(sub_token)
+            # BasicTokenizer 输出的词不含空白，直接按单个词切分
+            split_tokens.extend(self.wordpiece_tokenizer.tokenize_word(token))
 
         return split_tokens
 
     def convert_tokens_to_ids(self, tokens):
-        return convert_by_vocab(self.vocab, tokens)
+        return [self.token_id(token) for token in tokens]
 
     def convert_ids_to_tokens(self, ids):
         return convert_by_vocab(self.inv_vocab, ids)
@@ -243,60 +385,30 @@ class BasicTokenizer(object):
         # words in the English Wikipedia.).
         text = self._tokenize_chinese_chars(text)
 
-        orig_tokens = whitespace_tokenize(text)
-        split_tokens = []
-        for token in orig_tokens:
-            if self.do_lower_case:
-                token = token.lower()
-                token = self._run_strip_accents(token)
-            split_tokens.extend(self._run_split_on_punc(token))
-
-        output_tokens = whitespace_tokenize(" ".join(split_tokens))
+        if self.do_lower_case:
+            # 整段文本一次转小写、去除重音，空白两侧的字符互不影响，结果与逐个词处理相同
+            text = self._run_strip_accents(text.lower())
+        output_tokens = self._run_split_on_punc(text)
         return output_tokens
 
     def _run_strip_accents(self, text):
         """Strips accents from a piece of text."""
+        if text.isascii():
+            # ASCII字符NFD分解后不变，也没有组合附加符号
+            return text
         text = unicodedata.normalize("NFD", text)
-        output = []
-        for char in text:
-            cat = unicodedata.category(char)
-            if cat == "Mn":
-                continue
-            output.append(char)
-        return "".join(output)
+        return text.translate(_accent_table)
 
     def _run_split_on_punc(self, text):
-        """Splits punctuation on a piece of text."""
-        chars = list(text)
-        i = 0
-        start_new_word = True
-        output = []
-        while i < len(chars):
-            char = chars[i]
-            if _is_punctuation(char):
-                output.append([char])
-                start_new_word = True
-            else:
-                if start_new_word:
-                    output.append([])
-                start_new_word = False
-                output[-1].append(char)
-            i += 1
-
-        return ["".join(x) for x in output]
+        """Splits punctuation and whitespace on a piece of text."""
+        # 标点前后加空格再按空白切分，结果与逐个字符切分标点相同
+        return text.translate(_punctuation_table).split()
 
     def _tokenize_chinese_chars(self, text):
         """Adds whitespace around any CJK character."""
-        output = []
-        for char in text:
-            cp = ord(char)
-            if self._is_chinese_char(cp):
-                output.append(" ")
-                output.append(char)
-                output.append(" ")
-            else:
-                output.append(char)
-        return "".join(output)
+        if text.isascii():
+            return text
+        return text.translate(_chinese_table)
 
     def _is_chinese_char(self, cp):
         """Checks whether CP is the codepoint of a CJK character."""
@@ -308,30 +420,11 @@ class BasicTokenizer(object):
         # as is Japanese Hiragana and Katakana. Those alphabets are used to write
         # space-separated words, so they are not treated specially and handled
         # like the all of the other languages.
-        if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
-            (cp >= 0x3400 and cp <= 0x4DBF) or  #
-            (cp >= 0x20000 and cp <= 0x2A6DF) or  #
-            (cp >= 0x2A700 and cp <= 0x2B73F) or  #
-            (cp >= 0x2B740 and cp <= 0x2B81F) or  #
-            (cp >= 0x2B820 and cp <= 0x2CEAF) or
-            (cp >= 0xF900 and cp <= 0xFAFF) or  #
-                (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
-            return True
-
-        return False
+        return _is_chinese_char(cp)
 
     def _clean_text(self, text):
         """Performs invalid character removal and whitespace cleanup on text."""
-        output = []
-        for char in text:
-            cp = ord(char)
-            if cp == 0 or cp == 0xfffd or _is_control(char):
-                continue
-            if _is_whitespace(char):
-                output.append(" ")
-            else:
-                output.append(char)
-        return "".join(output)
+        return text.translate(_clean_table)
 
 
 class WordpieceTokenizer(object):
@@ -341,6 +434,8 @@ class WordpieceTokenizer(object):
         self.vocab = vocab
         self.unk_token = unk_token
         self.max_input_chars_per_word = max_input_chars_per_word
+        # 每个实例单独缓存，返回tuple，避免调用方修改缓存内容
+        self.tokenize_word = lru_cache(maxsize=WORDPIECE_CACHE_SIZE)(self._tokenize_word)
 
     def tokenize(self, text):
         """Tokenizes a piece of text into its word pieces.
@@ -364,37 +459,34 @@ class WordpieceTokenizer(object):
 
         output_tokens = []
         for token in whitespace_tokenize(text):
-            chars = list(token)
-            if len(chars) > self.max_input_chars_per_word:
-                output_tokens.append(self.unk_token)
-                continue
-
-            is_bad = False
-            start = 0
-            sub_tokens = []
-            while start < len(chars):
-                end = len(chars)
-                cur_substr = None
-                while start < end:
-                    substr = "".join(chars[start:end])
-                    if start > 0:
-                        substr = "##" + substr
-                    if substr in self.vocab:
-                        cur_substr = substr
-                        break
-                    end -= 1
-                if cur_substr is None:
-                    is_bad = True
-                    break
-                sub_tokens.append(cur_substr)
-                start = end
-
-            if is_bad:
-                output_tokens.append(self.unk_token)
-            else:
-                output_tokens.extend(sub_tokens)
+            output_tokens.extend(self.tokenize_word(token))
         return output_tokens
 
+    def _tokenize_word(self, token):
+        """Splits a single whitespace-free token, returns a tuple of word pieces."""
+        if len(token) > self.max_input_chars_per_word:
+            return (self.unk_token,)
+
+        vocab = self.vocab
+        start = 0
+        sub_tokens = []
+        while start < len(token):
+            end = len(token)
+            cur_substr = None
+            while start < end:
+                substr = token[start:end]
+                if start > 0:
+                    substr = "##" + substr
+                if substr in vocab:
+                    cur_substr = substr
+                    break
+                end -= 1
+            if cur_substr is None:
+                return (self.unk_token,)
+            sub_tokens.append(cur_substr)
+            start = end
+        return tuple(sub_tokens)
+
 
 def _is_whitespace(char):
     """Checks whether `chars` is a whitespace character."""
@@ -420,6 +512,21 @@ def _is_control(char):
     return False
 
 
+def _is_chinese_char(cp):
+    """Checks whether CP is the codepoint of a CJK character."""
+    if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
+        (cp >= 0x3400 and cp <= 0x4DBF) or  #
+        (cp >= 0x20000 and cp <= 0x2A6DF) or  #
+        (cp >= 0x2A700 and cp <= 0x2B73F) or  #
+        (cp >= 0x2B740 and cp <= 0x2B81F) or  #
+        (cp >= 0x2B820 and cp <= 0x2CEAF) or
+        (cp >= 0xF900 and cp <= 0xFAFF) or  #
+            (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
+        return True
+
+    return False
+
+
 def _is_punctuation(char):
     """Checks whether `chars` is a punctuation character."""
     cp = ord(char)
@@ -434,3 +541,50 @@ def _is_punctuation(char):
     if cat.startswith("P"):
         return True
     return False
+
+
+class _CharTable(dict):
+    """A ``str.translate`` table that classifies each code point on first use.
+
+    ``func`` maps a character to the translate value: the code point itself to
+    keep it, None to drop it, or a replacement string. ASCII is filled up front.
+    """
+
+    def __init__(self, func):
+        super(_CharTable, self).__init__()
+        self.func = func
+        for cp in range(128):
+            self[cp] = func(chr(cp))
+
+    def __missing__(self, cp):
+        value = self.func(chr(cp))
+        if len(self) < CHAR_TABLE_MAX_SIZE:
+            self[cp] = value
+        return value
+
+
+def _clean_value(char):
+    cp = ord(char)
+    if cp == 0 or cp == 0xfffd or _is_control(char):
+        return None
+    if _is_whitespace(char):
+        return " "
+    return cp
+
+
+def _chinese_value(char):
+    return " %s " % char if _is_chinese_char(ord(char)) else ord(char)
+
+
+def _accent_value(char):
+    return None if unicodedata.category(char) == "Mn" else ord(char)
+
+
+def _punctuation_value(char):
+    return " %s " % char if _is_punctuation(char) else ord(char)
+
+
+_clean_table = _CharTable(_clean_value)
+_chinese_table = _CharTable(_chinese_value)
+_accent_table = _CharTable(_accent_value)
+_punctuation_table = _CharTable(_punctuation_value)
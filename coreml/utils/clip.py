@@ -1,6 +1,8 @@
 import os
 import sys
+import itertools
 import numpy as np
+import cv2
 from PIL import Image, ImageFile
 from typing import Union, List
 import coremltools
@@ -20,6 +22,13 @@ model_folder_path = current_folder
 _tokenizer = bert.FullTokenizer()
 mean = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
 std = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+# uint8像素值到归一化float32的查表，与 (x / 255.0 - mean) / std 的计算结果完全一致
+normalize_lut = ((np.arange(256, dtype=np.float32)[None, :] / 255.0 - mean[:, None]) / std[:, None]).astype(np.float32)
+env_resize_backend = os.getenv("CLIP_RESIZE_BACKEND", "pil") # 图片缩放方式：pil 与原先结果完全一致；cv2 速度更快，结果有细微差异
+env_jpeg_reduced = os.getenv("CLIP_JPEG_REDUCED", "off") == "on" # JPEG图片按目标尺寸使用1/2、1/4、1/8缩小解码，大图解码更快、占用内存更少，结果有细微差异
+env_txt_dynamic_length = os.getenv("CLIP_TXT_DYNAMIC_LENGTH", "off") == "on" # 文本模型的序列长度可变时，按batch内最长的文本补齐，不再固定补齐到52，短搜索词推理更快，结果有细微差异
+env_txt_length_bucket = int(os.getenv("CLIP_TXT_LENGTH_BUCKET", "8")) # 可变序列长度时按该值的倍数向上取整，减少输入形状的种类
+env_txt_batch_size = int(os.getenv("CLIP_TXT_BATCH_SIZE", "64")) # 批量计算文本特征时每次推理的文本数量
 
 
 def single_image_transform(image, image_size):
@@ -30,17 +39,92 @@ def single_image_transform(image, image_size):
     return image.astype(np.float32)
 
 
-def image_processor(image_batch, image_size=224):
-    transformed_batch = [single_image_transform(img, image_size) for img in image_batch]
-    transformed_batch = np.array(transformed_batch, dtype=np.float32)  # Shape would be (N, H, W, C)
-
-    # Reorder dimensions to (N, C, H, W)
-    transformed_batch = np.transpose(transformed_batch, (0, 3, 1, 2))
-
-    return transformed_batch
-
-
-def tokenize_numpy(texts: Union[str, List[str]], context_length: int = 52) -> np.ndarray:
+def resize_image(image, image_size):
+    """Resizes a decoded HxWx3 uint8 image to image_size x image_size in one step."""
+    if env_resize_backend == "cv2":
+        # INTER_AREA 缩小时会做抗锯齿，结果接近PIL的BICUBIC；放大时使用INTER_CUBIC
+        h, w = image.shape[:2]
+        interpolation = cv2.INTER_AREA if h >= image_size and w >= image_size else cv2.INTER_CUBIC
+        return cv2.resize(image, (image_size, image_size), interpolation=interpolation)
+    return np.asarray(Image.fromarray(image).resize((image_size, image_size), Image.BICUBIC))
+
+
+def preprocess_identity():
+    # 会影响特征结果的预处理选项，拼接到缓存key的模型标识后；默认设置返回空字符串，已有缓存保持有效
+    options = []
+    if env_resize_backend != "pil":
+        options.append(f"resize={env_resize_backend}")
+    if env_jpeg_reduced:
+        options.append("jpeg_reduced")
+    return ":" + ",".join(options) if options else ""
+
+
+def jpeg_size(data):
+    """Reads (width, height) from the SOF marker of a JPEG, or returns None for other formats."""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        # SOF0-SOF15，排除 DHT(C4)、JPG(C8)、DAC(CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+
+reduced_decode_flags = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def decode_image(image_bytes, image_size=224, reduced=None):
+    """Decodes uploaded image bytes for CLIP, returns None when decoding fails.
+
+    With reduced decoding on, JPEGs are decoded through libjpeg DCT scaling at
+    the largest 1/2, 1/4 or 1/8 reduction whose short side still stays at or
+    above image_size; other formats are decoded at full size.
+    """
+    flags = cv2.IMREAD_COLOR
+    if env_jpeg_reduced if reduced is None else reduced:
+        size = jpeg_size(image_bytes)
+        if size is not None:
+            short_side = min(size)
+            for factor, reduced_flags in reduced_decode_flags:
+                if short_side // factor >= image_size:
+                    flags = reduced_flags
+                    break
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+
+def image_processor(image_batch, image_size=224, out=None):
+    """Preprocesses images into a normalized float32 (N, 3, H, W) batch.
+
+    Each image is resized once and written channel by channel into the batch
+    buffer through a uint8 -> float32 lookup table, which gives the same values
+    as single_image_transform without the intermediate full-size copies.
+    """
+    if out is None:
+        out = np.empty((len(image_batch), 3, image_size, image_size), dtype=np.float32)
+    for i, img in enumerate(image_batch):
+        img = np.asarray(img, dtype=np.uint8)
+        if img.ndim != 3 or img.shape[2] != 3:
+            img = np.array(Image.fromarray(img).convert('RGB'))
+        resized = resize_image(img, image_size)
+        # 通道顺序与原先一致：cv2解码得到的通道顺序直接按mean/std的顺序归一化，保证与已有图片特征兼容
+        for c in range(3):
+            np.take(normalize_lut[c], resized[:, :, c], out=out[i, c])
+    return out
+
+
+def tokenize_numpy(texts: Union[str, List[str]], context_length: int = 52, dtype=np.int64) -> np.ndarray:
     """
     Returns the tokenized representation of given input string(s)
     Parameters
@@ -49,27 +133,51 @@ def tokenize_numpy(texts: Union[str, List[str]], context_length: int = 52) -> np
         An input string or a list of input strings to tokenize
     context_length : int
         The context length to use; all baseline models use 52 as the context length
+    dtype : numpy integer type of the result
     Returns
     -------
     A two-dimensional numpy array containing the resulting tokens, shape = [number of input strings, context_length]
     """
     if isinstance(texts, str):
         texts = [texts]
+    return pack_token_ids([token_ids(text, context_length) for text in texts], context_length, dtype=dtype)
 
-    all_tokens = []
-    for text in texts:
-        all_tokens.append([_tokenizer.vocab['[CLS]']] + _tokenizer.convert_tokens_to_ids(_tokenizer.tokenize(text))[
-                                                        :context_length - 2] + [_tokenizer.vocab['[SEP]']])
 
-    result = np.zeros((len(all_tokens), context_length), dtype=np.int64)
+def token_ids(text, context_length=52):
+    """Token ids of one text wrapped in [CLS] ... [SEP], truncated to context_length."""
+    ids = _tokenizer.convert_tokens_to_ids(_tokenizer.tokenize(text))[:context_length - 2]
+    return [_tokenizer.token_id('[CLS]')] + ids + [_tokenizer.token_id('[SEP]')]
 
-    for i, tokens in enumerate(all_tokens):
-        assert len(tokens) <= context_length
-        result[i, :len(tokens)] = np.array(tokens)
 
+def pack_token_ids(rows, context_length=52, dynamic=False, dtype=np.int64):
+    """Writes rows of token ids into one preallocated, zero padded (N, L) array.
+
+    L is context_length, or with dynamic the longest row rounded up to a
+    multiple of CLIP_TXT_LENGTH_BUCKET, capped at context_length.
+    """
+    lengths = np.fromiter((len(row) for row in rows), dtype=np.intp, count=len(rows))
+    width = context_length
+    if dynamic and len(rows):
+        bucket = max(1, env_txt_length_bucket)
+        width = min(context_length, -(-int(lengths.max()) // bucket) * bucket)
+    assert not len(rows) or lengths.max() <= width
+    result = np.zeros((len(rows), width), dtype=dtype)
+    if len(rows) <= 8:
+        # 行数很少时逐行写入更快，单个搜索词走这里
+        for i, row in enumerate(rows):
+            result[i, :len(row)] = row
+        return result
+    # 掩码按行优先顺序选中每行的前len个位置，与所有token依次拼接的顺序一致，一次写入
+    result[np.arange(width) < lengths[:, None]] = np.fromiter(itertools.chain.from_iterable(rows), dtype=dtype,
+                                                                count=int(lengths.sum()))
     return result
 
 
+def txt_identity():
+    # 开启可变序列长度后特征有细微差异，拼接到缓存key的模型标识后；默认设置返回空字符串
+    return f":dynamic_length={env_txt_length_bucket}" if env_txt_dynamic_length else ""
+
+
 def load_img_model(model_prefix):
     img_coreml_model_path = join_path(model_folder_path, f"{model_prefix}.image.mlpackage/Data/com.apple.CoreML/model.mlmodel")
     model = coremltools.models.MLModel(img_coreml_model_path)
@@ -85,11 +193,15 @@ def load_img_model(model_prefix):
 
 
 def process_image(img, img_model):
-    inputs = image_processor([img], image_size=image_width)
-    input = inputs[0:1, :, :, :]
-    input_data = {'image': input}
-    image_feature = img_model.predict(input_data)["image_features"][0].tolist()
-    return image_feature
+    return process_images([img], img_model)[0]
+
+
+def process_images(imgs, img_model):
+    inputs = image_processor(imgs, image_size=image_width)
+    # 转换出的CoreML模型输入固定为 [1, 3, H, W]，使用批量预测接口一次提交
+    input_data = [{'image': inputs[i:i + 1]} for i in range(len(inputs))]
+    outputs = img_model.predict(input_data)
+    return [output["image_features"][0].tolist() for output in outputs]
 
 
 def load_txt_model(model_prefix):
@@ -99,7 +211,7 @@ def load_txt_model(model_prefix):
 
 
 def process_txt(txt, text_model):
-    input = tokenize_numpy([txt], 52).astype(np.int32)
+    input = tokenize_numpy([txt], 52, dtype=np.int32)
     input_data = {'text': input}
     embeddings = text_model.predict(input_data)["text_features"][0].tolist()
     return embeddings
@@ -1,12 +1,15 @@
 from dotenv import load_dotenv
 import os
 import sys
-from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Header
-from fastapi.responses import HTMLResponse
+from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Header, Query
+from fastapi.responses import HTMLResponse, JSONResponse
 import uvicorn
 import numpy as np
 import cv2
 import asyncio
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 # from paddleocr import PaddleOCR
 import torch
 from PIL import Image, ImageFile
@@ -14,6 +17,11 @@ from io import BytesIO
 from pydantic import BaseModel
 from rapidocr import EngineType, LangDet, LangRec, ModelType, OCRVersion, RapidOCR # Paddle的cuda镜像太大，改用torch，RapidOCR支持torch
 import cn_clip.clip as clip
+from cn_clip.clip.model import convert_weights
+from clip_precision import load_fp32_model, set_clip_precision, clip_autocast, precision_samples, check_clip_precision
+from embedding_format import JSON_FORMATS, negotiate_format, embedding_response
+from ocr_format import LAYOUTS, compact_result, ocr_layout
+from upload import ArchiveLimitError, upload_size, image_dimensions, is_archive, read_archive
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 on_linux = sys.platform.startswith('linux')
@@ -66,16 +74,32 @@ def get_ocr_version(value: str) -> OCRVersion:
 
 
 clip_model_name = os.getenv("CLIP_MODEL")
+env_clip_batch_max_files = int(os.getenv("CLIP_BATCH_MAX_FILES", "64")) # /clip/img/batch 单次请求最多处理的图片数
+env_max_upload_mb = float(os.getenv("MAX_UPLOAD_MB", "100")) # 单个上传文件的大小上限(MB)，超过时在接收或解码前返回413，0为不限制
+env_clip_device = os.getenv("CLIP_DEVICE", "auto") # CLIP推理设备：auto 有可用GPU时使用cuda，否则使用cpu；也可指定 cuda、cuda:1、cpu
+env_clip_precision = os.getenv("CLIP_PRECISION", "auto") # CLIP推理精度：auto 与cn_clip默认一致(GPU为fp16，CPU为fp32)；fp32；fp16；bf16 (权重fp32，bf16 autocast)
+env_clip_precision_check = os.getenv("CLIP_PRECISION_CHECK", "on") == "on" # 加载模型时用样本对比fp16/bf16与fp32的特征，余弦相似度过低则回退到fp32
+env_clip_precision_min_cosine = float(os.getenv("CLIP_PRECISION_MIN_COSINE", "0.999")) # 精度检查允许的最小余弦相似度
+env_jpeg_reduced = os.getenv("CLIP_JPEG_REDUCED", "off") == "on" # JPEG图片按模型输入尺寸使用1/2、1/4、1/8缩小解码，大图解码更快、占用内存更少，结果有细微差异
 
 
 ocr_model = None
 clip_processor = None
 clip_model = None
+clip_input_resolution = 224
+clip_precision = None
+clip_precision_report = None
 
 restart_task = None
 restart_lock = asyncio.Lock()
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
+if env_clip_device != "auto":
+    device = env_clip_device
+
+# CLIP推理的专用线程，GPU计算都在这个线程内按请求顺序执行，不阻塞事件循环；图片解码和预处理在默认线程池内并行执行
+clip_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clip")
+clip_pinned_buffer = None
 
 class ClipTxtRequest(BaseModel):
     text: str
@@ -106,11 +130,65 @@ def load_ocr_model():
 def load_clip_model():
     global clip_processor
     global clip_model
+    global clip_input_resolution
+    global device
     if clip_processor is None:
-        model, preprocess = clip.load_from_name(clip_model_name, device=device)
+        # 先在CPU上加载fp32权重，作为精度检查的基准，再移动到推理设备
+        model, preprocess = load_fp32_model(clip_model_name)
         model.eval()
-        clip_model = model
+        if device != "cpu":
+            try:
+                model.to(device)
+            except Exception as e:
+                # GPU不可用（驱动异常、显存不足等）时回退到CPU推理
+                print(f"load clip model on {device} failed, fallback to cpu: {e}")
+                model.to("cpu")
+                device = "cpu"
         clip_processor = preprocess
+        clip_input_resolution = getattr(model.visual, 'input_resolution', 224)
+        clip_model = setup_clip_precision(model)
+
+def setup_clip_precision(model):
+    """Applies CLIP_PRECISION to the fp32 model, returns the model used for inference."""
+    global clip_precision
+    global clip_precision_report
+    precision = env_clip_precision
+    if precision == "auto":
+        # 与cn_clip默认一致：GPU上转换为fp16权重，CPU上保持fp32
+        if device == "cpu":
+            clip_precision = "fp32"
+            return model
+        convert_weights(model)
+        clip_precision = "fp16"
+        return model
+    if precision not in ("fp32", "fp16", "bf16"):
+        print(f"unsupported CLIP_PRECISION {precision}, use fp32")
+        precision = "fp32"
+    if precision == "fp32" or not env_clip_precision_check:
+        clip_precision = precision
+        return set_clip_precision(model, precision)
+    try:
+        # fp16 会就地转换权重，复制一份与fp32基准对比；bf16 只在推理时autocast，直接与自身对比
+        candidate = set_clip_precision(copy.deepcopy(model), precision) if precision == "fp16" else model
+        images, texts = precision_samples(clip_processor, clip.tokenize, clip_input_resolution)
+        clip_precision_report = check_clip_precision(model, candidate, device, precision, images, texts,
+                                                     env_clip_precision_min_cosine)
+        print(f"clip precision check: {clip_precision_report}")
+        if clip_precision_report['passed']:
+            clip_precision = precision
+            return candidate
+        print(f"clip {precision} cosine below {env_clip_precision_min_cosine}, fallback to fp32")
+    except Exception as e:
+        print(f"clip {precision} check failed, fallback to fp32: {e}")
+    clip_precision = "fp32"
+    return model
+
+def open_clip_image(data):
+    image = Image.open(BytesIO(data))
+    if env_jpeg_reduced:
+        # 只对JPEG生效：libjpeg按1/2、1/4、1/8缩小解码，保证宽高不小于模型输入尺寸
+        image.draft('RGB', (clip_input_resolution, clip_input_resolution))
+    return image
 
 @app.on_event("startup")
 async def startup_event():
@@ -144,6 +222,20 @@ async def activity_monitor(request, call_next):
     return response
 
 
+# 单文件上传的接口，按请求头的Content-Length提前拒绝过大的上传
+upload_paths = ("/ocr", "/clip/img")
+upload_form_overhead = 64 * 1024 # multipart表单中文件以外的部分(边界、字段头、其他参数)的大小余量
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    # 此时请求体还未接收，直接返回413，不再解析表单和写入临时文件
+    if env_max_upload_mb > 0 and request.url.path in upload_paths:
+        length = request.headers.get("content-length", "")
+        if length.isdigit() and int(length) > env_max_upload_mb * 1024 * 1024 + upload_form_overhead:
+            return JSONResponse(status_code=413, content={'detail': f"File too large, max {env_max_upload_mb:g}MB"})
+    return await call_next(request)
+
+
 async def verify_header(api_key: str = Header(...)):
     # 在这里编写验证逻辑，例如检查 api_key 是否有效
     if api_key != api_auth_key:
@@ -151,43 +243,49 @@ async def verify_header(api_key: str = Header(...)):
     return api_key
 
 
-def to_fixed(num):
-    return str(round(num, 2))
-
-def convert_rapidocr_to_json(rapidocr_output):
-
+def convert_rapidocr_to_json(rapidocr_output, layout='default'):
     if rapidocr_output.txts is None:
-        return {'texts': [], 'scores': [], 'boxes': []}
-
-    texts = list(rapidocr_output.txts)
-    scores = [f"{score:.2f}" for score in rapidocr_output.scores]
-    boxes_coords = rapidocr_output.boxes
-
-    boxes = []
-    for box in boxes_coords:
-        xs = [point[0] for point in box]
-        ys = [point[1] for point in box]
-
-        x_min, x_max = min(xs), max(xs)
-        y_min, y_max = min(ys), max(ys)
-
-        width = x_max - x_min
-        height = y_max - y_min
-
-        boxes.append({
-            'x': to_fixed(x_min),
-            'y': to_fixed(y_min),
-            'width': to_fixed(width),
-            'height': to_fixed(height)
-        })
-
-    output = {
-        'texts': texts,
-        'scores': scores,
-        'boxes': boxes
-    }
-
-    return output
+        return ocr_layout(compact_result(None, [], []), layout)
+    # RapidOCR 输出float32的文本框，取四个点的外接矩形，按float32舍入，与逐个 round 的结果一致
+    result = compact_result(rapidocr_output.boxes, rapidocr_output.txts, rapidocr_output.scores, bounds=True)
+    return ocr_layout(result, layout)
+
+def check_upload(file):
+    # 表单解析后、读取和解码前检查文件大小，覆盖没有Content-Length的分块上传
+    if env_max_upload_mb > 0 and upload_size(file) > env_max_upload_mb * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"File too large, max {env_max_upload_mb:g}MB")
+
+def to_device(batch):
+    # 先拷贝到复用的锁页内存，再异步拷贝到显存；结果取回CPU时会同步，下一次调用前拷贝一定已完成
+    global clip_pinned_buffer
+    if not device.startswith("cuda"):
+        return batch.to(device)
+    if (clip_pinned_buffer is None or clip_pinned_buffer.shape[0] < batch.shape[0]
+            or clip_pinned_buffer.shape[1:] != batch.shape[1:]):
+        clip_pinned_buffer = torch.empty(batch.shape, dtype=batch.dtype, pin_memory=True)
+    host = clip_pinned_buffer[:batch.shape[0]]
+    host.copy_(batch)
+    return host.to(device, non_blocking=True)
+
+def encode_image_batch(images):
+    with torch.inference_mode(), clip_autocast(device, clip_precision):
+        return clip_model.encode_image(to_device(torch.stack(images))).float().cpu().numpy()
+
+def encode_text_batch(texts):
+    with torch.inference_mode(), clip_autocast(device, clip_precision):
+        return clip_model.encode_text(clip.tokenize(texts).to(device)).float().cpu().numpy()
+
+def preprocess_image(data):
+    return clip_processor(open_clip_image(data))
+
+def preprocess_images(items):
+    images = []
+    for data in items:
+        try:
+            images.append(preprocess_image(data) if data else None)
+        except Exception as e:
+            images.append(e)
+    return images
 
 @app.get("/", response_class=HTMLResponse)
 async def top_info():
@@ -213,7 +311,9 @@ async def check_req(api_key: str = Depends(verify_header)):
         'result': 'pass',
         "title": "mt-photos-ai服务",
         "help": "https://mtmt.tech/docs/advanced/ocr_api",
-        "device": device
+        "device": device,
+        "clip_precision": clip_precision,
+        "clip_precision_check": clip_precision_report
     }
 
 
@@ -230,7 +330,14 @@ async def check_req(api_key: str = Depends(verify_header)):
     return {'result': 'pass'}
 
 @app.post("/ocr")
-async def process_image(file: UploadFile = File(...), api_key: str = Depends(verify_header)):
+async def process_image(file: UploadFile = File(...), layout: str = Query(LAYOUTS[0]), api_key: str = Depends(verify_header)):
+    if layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported layout, available: {', '.join(LAYOUTS)}")
+    check_upload(file)
+    size = image_dimensions(file)
+    if size is not None and max(size) > 10000:
+        # 超出范围的图片不再解码
+        return {'result': [], 'msg': 'height or width out of range'}
     load_ocr_model()
     image_bytes = await file.read()
     try:
@@ -241,7 +348,7 @@ async def process_image(file: UploadFile = File(...), api_key: str = Depends(ver
             return {'result': [], 'msg': 'height or width out of range'}
 
         _result = await predict(ocr_model, img)
-        result = convert_rapidocr_to_json(_result)
+        result = convert_rapidocr_to_json(_result, layout)
         del img
         del _result
         return {'result': result}
@@ -250,27 +357,82 @@ async def process_image(file: UploadFile = File(...), api_key: str = Depends(ver
         return {'result': [], 'msg': str(e)}
 
 @app.post("/clip/img")
-async def clip_process_image(file: UploadFile = File(...), api_key: str = Depends(verify_header)):
+async def clip_process_image(file: UploadFile = File(...), fmt: Optional[str] = Query(None, alias="format"),
+                             accept: Optional[str] = Header(None), api_key: str = Depends(verify_header)):
+    response_format = negotiate_format(fmt, accept)
+    check_upload(file)
     load_clip_model()
     image_bytes = await file.read()
     try:
-        image = clip_processor(Image.open(BytesIO(image_bytes))).unsqueeze(0).to(device)
-        image_features = clip_model.encode_image(image)
-        return {'result': ["{:.16f}".format(vec) for vec in image_features[0]]}
+        image = await predict(preprocess_image, image_bytes)
+        image_features = await clip_predict(encode_image_batch, [image])
+        return embedding_response(image_features[0], response_format)
     except Exception as e:
         print(e)
         return {'result': [], 'msg': str(e)}
 
+@app.post("/clip/img/batch")
+async def clip_process_image_batch(files: List[UploadFile] = File(...), fmt: Optional[str] = Query(None, alias="format"),
+                                   api_key: str = Depends(verify_header)):
+    # 多个特征放在一个json里返回，只支持 JSON_FORMATS
+    response_format = negotiate_format(fmt)
+    if response_format not in JSON_FORMATS:
+        raise HTTPException(status_code=406, detail=f"Unsupported format, available: {', '.join(JSON_FORMATS)}")
+    load_clip_model()
+    items = []
+    for file in files:
+        check_upload(file)
+        if is_archive(file.filename):
+            try:
+                # 先检查包内的文件数和声明的大小，解压后的总大小不超过 MAX_UPLOAD_MB
+                items.extend(await asyncio.get_running_loop().run_in_executor(
+                    None, read_archive, file.file, env_clip_batch_max_files - len(items), int(env_max_upload_mb * 1024 * 1024)))
+            except ArchiveLimitError as e:
+                return {'result': [], 'msg': str(e)}
+            except Exception as e:
+                print(e)
+                items.append((file.filename, None))
+        else:
+            items.append((file.filename, await file.read()))
+        if len(items) > env_clip_batch_max_files:
+            return {'result': [], 'msg': f'too many files, max {env_clip_batch_max_files}'}
+
+    results = [{'name': name, 'result': [], 'msg': 'image decode failed'} for name, _ in items]
+    images = []
+    indexes = []
+    for i, image in enumerate(await predict(preprocess_images, [data for _, data in items])):
+        if image is None:
+            continue
+        if isinstance(image, Exception):
+            results[i]['msg'] = str(image)
+            continue
+        images.append(image)
+        indexes.append(i)
+    if images:
+        try:
+            image_features = await clip_predict(encode_image_batch, images)
+            for i, feature in zip(indexes, image_features):
+                results[i] = {'name': items[i][0], **embedding_response(feature, response_format)}
+        except Exception as e:
+            print(e)
+            for i in indexes:
+                results[i] = {'name': items[i][0], 'result': [], 'msg': str(e)}
+    return {'result': results}
+
 @app.post("/clip/txt")
-async def clip_process_txt(request:ClipTxtRequest, api_key: str = Depends(verify_header)):
+async def clip_process_txt(request:ClipTxtRequest, fmt: Optional[str] = Query(None, alias="format"),
+                           accept: Optional[str] = Header(None), api_key: str = Depends(verify_header)):
+    response_format = negotiate_format(fmt, accept)
     load_clip_model()
-    text = clip.tokenize([request.text]).to(device)
-    text_features = clip_model.encode_text(text)
-    return {'result': ["{:.16f}".format(vec) for vec in text_features[0]]}
+    text_features = await clip_predict(encode_text_batch, [request.text])
+    return embedding_response(text_features[0], response_format)
 
 async def predict(predict_func, inputs):
     return await asyncio.get_running_loop().run_in_executor(None, predict_func, inputs)
 
+async def clip_predict(predict_func, inputs):
+    return await asyncio.get_running_loop().run_in_executor(clip_executor, predict_func, inputs)
+
 
 def restart_program():
     print("restart_program")
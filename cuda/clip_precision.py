@@ -0,0 +1,84 @@
+import time
+from contextlib import nullcontext
+import numpy as np
+import torch
+from PIL import Image
+
+
+def load_fp32_model(name):
+    """Loads a cn_clip model on CPU with fp32 weights, returns (model, preprocess).
+
+    clip.load_from_name converts the model to fp16 before loading the
+    checkpoint, so even its CPU model only holds fp16-rounded weights. Skipping
+    that conversion loads the checkpoint into fp32 parameters in the precision
+    it was saved in, which makes it a real fp32 reference for the precision check.
+    """
+    from cn_clip.clip import utils
+    convert_weights = utils.convert_weights
+    # create_model 在加载checkpoint之前调用 convert_weights，加载期间跳过这一步
+    utils.convert_weights = lambda model: None
+    try:
+        return utils.load_from_name(name, device="cpu")
+    finally:
+        utils.convert_weights = convert_weights
+
+
+def set_clip_precision(model, precision):
+    # fp16 直接转换权重，显存占用减半；bf16 保持fp32权重，推理时使用autocast
+    if precision == "fp16":
+        return model.half()
+    return model.float()
+
+
+def clip_autocast(device, precision):
+    if precision == "bf16":
+        return torch.autocast(device_type=device.split(":")[0], dtype=torch.bfloat16)
+    return nullcontext()
+
+
+def precision_samples(preprocess, tokenize, resolution, count=4):
+    # 固定随机种子生成平滑的样本图片和常见搜索词，每次检查的输入一致
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        small = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+        images.append(preprocess(Image.fromarray(small).resize((resolution, resolution), Image.BICUBIC)))
+    texts = ["一只猫", "海边的日落", "生日蛋糕和蜡烛", "雪山下的湖泊"][:count]
+    return torch.stack(images), tokenize(texts)
+
+
+def run_precision_sample(model, device, precision, images, texts, repeat=3):
+    timings = {}
+    outputs = {}
+    with torch.inference_mode(), clip_autocast(device, precision):
+        for name, func, inputs in (("image", model.encode_image, images), ("text", model.encode_text, texts)):
+            func(inputs)
+            if device.startswith("cuda"):
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                features = func(inputs)
+            if device.startswith("cuda"):
+                torch.cuda.synchronize()
+            timings[name] = (time.perf_counter() - start) / repeat
+            outputs[name] = features.float()
+    return outputs, timings
+
+
+def check_clip_precision(reference, model, device, precision, images, texts, min_cosine=0.999):
+    """Compares the features of ``model`` at ``precision`` with the fp32 ``reference`` on fixed samples.
+
+    Returns the cosine and speedup report. ``reference`` must keep fp32 weights;
+    for bf16 it can be the same model, since only autocast differs.
+    """
+    images = images.to(device)
+    texts = texts.to(device)
+    expected, reference_timings = run_precision_sample(reference, device, "fp32", images, texts)
+    outputs, timings = run_precision_sample(model, device, precision, images, texts)
+    report = {'precision': precision, 'device': device}
+    for name in ("image", "text"):
+        cosine = torch.nn.functional.cosine_similarity(outputs[name], expected[name], dim=-1)
+        report[f'{name}_cosine_min'] = round(cosine.min().item(), 6)
+        report[f'{name}_speedup'] = round(reference_timings[name] / timings[name], 2)
+    report['passed'] = min(report['image_cosine_min'], report['text_cosine_min']) >= min_cosine
+    return report
@@ -0,0 +1,72 @@
+import copy
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+from clip_precision import set_clip_precision, precision_samples, check_clip_precision
+
+
+class TinyClip(torch.nn.Module):
+    # 与cn_clip的CLIP接口一致：encode_image/encode_text，输入转换为权重的精度
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.visual = torch.nn.Conv2d(3, 16, 8, stride=8)
+        self.embedding = torch.nn.Embedding(32, 16)
+        self.projection = torch.nn.Linear(16, 8)
+
+    def encode_image(self, image):
+        x = self.visual(image.type(self.visual.weight.dtype))
+        return self.projection(x.mean(dim=(2, 3)))
+
+    def encode_text(self, text):
+        return self.projection(self.embedding(text).mean(dim=1))
+
+
+def preprocess(image):
+    return torch.from_numpy(np.asarray(image, dtype=np.float32) / 255).permute(2, 0, 1)
+
+
+def tokenize(texts):
+    return torch.tensor([[ord(c) % 32 for c in text[:2]] for text in texts])
+
+
+def samples():
+    return precision_samples(preprocess, tokenize, 32)
+
+
+def test_samples_are_fixed():
+    images, texts = samples()
+    again, _ = samples()
+    assert images.shape == (4, 3, 32, 32)
+    assert texts.shape == (4, 2)
+    assert torch.equal(images, again)
+
+
+def test_fp16_is_compared_with_a_separate_fp32_reference():
+    reference = TinyClip().eval()
+    model = set_clip_precision(copy.deepcopy(reference), "fp16")
+    report = check_clip_precision(reference, model, "cpu", "fp16", *samples(), min_cosine=0.99)
+    assert report['passed']
+    assert report['precision'] == "fp16" and report['device'] == "cpu"
+    assert 0.99 <= report['image_cosine_min'] <= 1.0
+    assert report['image_speedup'] > 0 and report['text_speedup'] > 0
+    assert reference.visual.weight.dtype == torch.float32
+    assert model.visual.weight.dtype == torch.float16
+
+
+def test_bf16_uses_autocast_on_fp32_weights():
+    model = TinyClip().eval()
+    report = check_clip_precision(model, model, "cpu", "bf16", *samples(), min_cosine=0.99)
+    assert report['passed']
+    assert model.visual.weight.dtype == torch.float32
+
+
+def test_fails_below_min_cosine():
+    reference = TinyClip().eval()
+    model = copy.deepcopy(reference)
+    with torch.no_grad():
+        model.projection.weight.neg_()
+    report = check_clip_precision(reference, model, "cpu", "fp16", *samples())
+    assert not report['passed']
+    assert report['image_cosine_min'] < 0
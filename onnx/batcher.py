@@ -0,0 +1,139 @@
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _bucket(n):
+    # 按2的幂分桶: 0, 1, 2, 4, 8, ...
+    bucket = 1
+    while bucket < n:
+        bucket *= 2
+    return bucket if n > 0 else 0
+
+
+def _check_results(results, count):
+    # 结果行数不对时报错，不能按zip截断，否则多出的请求永远等不到结果
+    if len(results) != count:
+        raise RuntimeError(f"batch_func returned {len(results)} results for {count} items")
+    return results
+
+
+class MicroBatcher(object):
+    """Coalesces concurrent requests into batched model calls.
+
+    Items submitted while the worker is busy, or within ``max_wait_ms`` of the
+    first queued item, are merged into one list of at most ``max_batch_size``
+    items and passed to ``batch_func`` in a single call on a dedicated worker
+    thread. ``batch_func`` must return one result per input, in input order.
+
+    ``batch_func`` may also be a coroutine function, for example one that hands
+    the batch to another process. It then runs on the event loop with up to
+    ``concurrency`` batches in flight; items that arrive while all of them are
+    busy are merged into the next batch.
+    """
+
+    def __init__(self, batch_func, max_batch_size=8, max_wait_ms=5, concurrency=1):
+        self.batch_func = batch_func
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.is_async = asyncio.iscoroutinefunction(batch_func)
+        self.concurrency = max(1, int(concurrency)) if self.is_async else 1
+        self.running = set() # 执行中的异步batch，保留引用避免任务被回收
+        # 单线程执行，保证同一时间只有一个推理调用
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batcher")
+        self.queue = None
+        self.worker_task = None
+        self.batch_size_histogram = collections.Counter()
+        self.queue_depth_histogram = collections.Counter()
+        self.max_queue_depth = 0
+        self.total_batches = 0
+        self.total_items = 0
+
+    def _ensure_started(self):
+        if self.worker_task is None or self.worker_task.done():
+            self.queue = asyncio.Queue()
+            self.worker_task = asyncio.get_running_loop().create_task(self._worker())
+
+    async def submit(self, item):
+        """Queues one item and waits for its own row of the batch result."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((item, future))
+        depth = self.queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return await future
+
+    async def run(self, items):
+        """Runs an already assembled batch on the worker thread, bypassing the queue."""
+        self.batch_size_histogram[len(items)] += 1
+        self.total_batches += 1
+        self.total_items += len(items)
+        if self.is_async:
+            return _check_results(await self.batch_func(items), len(items))
+        return _check_results(await asyncio.get_running_loop().run_in_executor(self.executor, self.batch_func, items), len(items))
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            try:
+                if timeout <= 0:
+                    batch.append(self.queue.get_nowait())
+                else:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    async def _worker(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            # 没有空闲的执行名额时不取出新请求，期间到达的请求合并到下一个batch
+            await slots.acquire()
+            batch = await self._collect()
+            self.queue_depth_histogram[_bucket(self.queue.qsize())] += 1
+            self.batch_size_histogram[len(batch)] += 1
+            self.total_batches += 1
+            self.total_items += len(batch)
+            if self.is_async:
+                task = asyncio.get_running_loop().create_task(self._dispatch(batch, slots))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+            else:
+                await self._dispatch(batch, slots)
+
+    async def _dispatch(self, batch, slots):
+        inputs = [item for item, _ in batch]
+        try:
+            if self.is_async:
+                results = await self.batch_func(inputs)
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(self.executor, self.batch_func, inputs)
+            _check_results(results, len(inputs))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            slots.release()
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'concurrency': self.concurrency,
+            'running': len(self.running),
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'max_queue_depth': self.max_queue_depth,
+            'total_batches': self.total_batches,
+            'total_items': self.total_items,
+            'batch_size_histogram': {str(k): v for k, v in sorted(self.batch_size_histogram.items())},
+            'queue_depth_histogram': {str(k): v for k, v in sorted(self.queue_depth_histogram.items())},
+        }
@@ -0,0 +1,47 @@
+"""
+对比 /clip/img、/clip/txt 各返回格式的序列化耗时和数据大小
+
+python benchmark_embedding_format.py --dim 512 --repeat 2000
+"""
+import argparse
+import json
+import time
+import numpy as np
+from embedding_format import FORMATS, embedding_response
+
+
+def payload_bytes(response):
+    if isinstance(response, dict):
+        return json.dumps(response).encode('utf-8')
+    return response.body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    vec = np.random.default_rng(0).standard_normal(args.dim).astype(np.float32)
+    # onnxruntime 后端返回的是 list[float]
+    vec_list = vec.tolist()
+
+    print(f"{'format':<10}{'us/op':>10}{'bytes':>10}{'ratio':>8}")
+    json_size = None
+    for fmt in FORMATS:
+        try:
+            payload_bytes(embedding_response(vec_list, fmt))
+        except Exception as e:
+            print(f"{fmt:<10}skipped: {e}")
+            continue
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            body = payload_bytes(embedding_response(vec_list, fmt))
+        elapsed = (time.perf_counter() - start) / args.repeat * 1e6
+        if json_size is None:
+            json_size = len(body)
+        print(f"{fmt:<10}{elapsed:>10.1f}{len(body):>10}{json_size / len(body):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+对比JPEG完整解码与缩小解码(CLIP_JPEG_REDUCED=on)的耗时、解码后内存占用和特征偏差
+
+python benchmark_jpeg_decode.py                  # 使用随机生成的4800万像素JPEG
+python benchmark_jpeg_decode.py --images /photos  # 使用目录下的JPEG图片，HEIC等格式需先转换为JPEG
+
+utils 目录下存在图片模型时，会输出两种解码方式得到的图片特征的余弦相似度
+"""
+import argparse
+import os
+import time
+import numpy as np
+import cv2
+import clip
+
+
+def load_corpus(folder, count):
+    if not folder:
+        rng = np.random.default_rng(0)
+        corpus = []
+        for i in range(count):
+            img = cv2.GaussianBlur(rng.integers(0, 256, (6000, 8000, 3), dtype=np.uint8), (15, 15), 0)
+            corpus.append((f"random_{i}.jpg", cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()))
+        return corpus
+    corpus = []
+    for name in sorted(os.listdir(folder)):
+        if os.path.splitext(name)[1].lower() not in ('.jpg', '.jpeg'):
+            continue
+        with open(os.path.join(folder, name), 'rb') as f:
+            corpus.append((name, f.read()))
+        if len(corpus) >= count:
+            break
+    return corpus
+
+
+def decode(data, reduced, repeat):
+    img = clip.decode_image(data, clip.IMG_SIZE, reduced=reduced)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        clip.decode_image(data, clip.IMG_SIZE, reduced=reduced)
+    return img, (time.perf_counter() - start) / repeat * 1000
+
+
+def cosine(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default='')
+    parser.add_argument('--count', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.images, args.count)
+    if not corpus:
+        print("no jpeg found")
+        return
+    model = clip.load_img_model(use_dml=False) if os.path.exists(clip.img_onnx_model_path) else None
+
+    full_total = reduced_total = 0.0
+    cosines = []
+    print(f"{'name':<24}{'size':>12}{'full ms':>10}{'full MB':>10}{'reduced':>12}{'ms':>8}{'MB':>8}{'cosine':>10}")
+    for name, data in corpus:
+        full, full_ms = decode(data, False, args.repeat)
+        reduced, reduced_ms = decode(data, True, args.repeat)
+        full_total += full_ms
+        reduced_total += reduced_ms
+        line = (f"{name[:23]:<24}{full.shape[1]:>6}x{full.shape[0]:<5}{full_ms:>10.1f}{full.nbytes / 1048576:>10.1f}"
+                f"{reduced.shape[1]:>6}x{reduced.shape[0]:<5}{reduced_ms:>8.1f}{reduced.nbytes / 1048576:>8.1f}")
+        if model is not None:
+            features = clip.process_images([full, reduced], model)
+            cosines.append(cosine(features[0], features[1]))
+            line += f"{cosines[-1]:>10.6f}"
+        print(line)
+
+    print(f"decode total: full {full_total:.1f} ms, reduced {reduced_total:.1f} ms, speedup {full_total / reduced_total:.2f}x")
+    if cosines:
+        print(f"embedding drift: cosine min {min(cosines):.6f} mean {np.mean(cosines):.6f}")
+
+
+if __name__ == '__main__':
+    main()
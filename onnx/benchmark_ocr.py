@@ -0,0 +1,119 @@
+"""
+对比不同OCR参数组合在各类图片上的检测(det)、方向分类(cls)、识别(rec)各阶段耗时
+
+python benchmark_ocr.py                      # 使用随机生成的截图、小票、照片
+python benchmark_ocr.py --corpus /ocr_corpus  # 每个子目录为一类图片，例如 screenshots、receipts、photos
+python benchmark_ocr.py --profiles default,no_cls,rec_batch_32
+
+texts 列为与 default 参数识别结果相同的文本行比例，用于评估参数对识别质量的影响
+"""
+import argparse
+import os
+import time
+import numpy as np
+import cv2
+from rapidocr_onnxruntime import RapidOCR
+
+# 名称: (RapidOCR初始化参数, 调用参数)，参数与环境变量 OCR_REC_BATCH_NUM、OCR_DET_LIMIT_SIDE_LEN、OCR_MAX_SIDE_LEN、OCR_USE_CLS 对应
+PROFILES = {
+    'default': ({}, {}),
+    'no_cls': ({'use_cls': False}, {'use_cls': False}),
+    'rec_batch_16': ({'rec_batch_num': 16}, {}),
+    'rec_batch_32': ({'rec_batch_num': 32}, {}),
+    'det_limit_960': ({'det_limit_side_len': 960}, {}),
+    'det_limit_480': ({'det_limit_side_len': 480}, {}),
+    'max_side_1280': ({'max_side_len': 1280}, {}),
+    'fast': ({'use_cls': False, 'rec_batch_num': 32, 'max_side_len': 1280}, {'use_cls': False}),
+}
+
+WORDS = ["MT Photos", "Hello World", "2024-11-29", "Total 128.00", "OCR benchmark", "Invoice No. 8812",
+         "Thank you", "12:30 PM", "Settings", "Download", "Battery 85%", "Wi-Fi"]
+
+
+def draw_lines(img, count, scale, thickness, rng):
+    h, w = img.shape[:2]
+    step = max(1, (h - 60) // count)
+    for i in range(count):
+        text = f"{WORDS[rng.integers(len(WORDS))]} {rng.integers(1000)}"
+        cv2.putText(img, text, (int(rng.integers(10, max(11, w // 4))), 50 + i * step), cv2.FONT_HERSHEY_SIMPLEX,
+                    scale, (0, 0, 0), thickness)
+    return img
+
+
+def generated_corpus(count):
+    rng = np.random.default_rng(0)
+    corpus = {'screenshots': [], 'receipts': [], 'photos': []}
+    for _ in range(count):
+        corpus['screenshots'].append(draw_lines(np.full((2400, 1080, 3), 255, np.uint8), 60, 1.2, 2, rng))
+        corpus['receipts'].append(draw_lines(np.full((1800, 600, 3), 245, np.uint8), 45, 0.8, 2, rng))
+        photo = cv2.GaussianBlur(rng.integers(0, 256, (3000, 4000, 3), dtype=np.uint8), (31, 31), 0)
+        corpus['photos'].append(draw_lines(photo, 2, 4, 8, rng))
+    return corpus
+
+
+def load_corpus(folder, count):
+    corpus = {}
+    for category in sorted(os.listdir(folder)):
+        path = os.path.join(folder, category)
+        if not os.path.isdir(path):
+            continue
+        images = []
+        for name in sorted(os.listdir(path)):
+            img = cv2.imread(os.path.join(path, name), cv2.IMREAD_COLOR)
+            if img is not None:
+                images.append(img)
+            if len(images) >= count:
+                break
+        if images:
+            corpus[category] = images
+    return corpus
+
+
+def run_profile(engine, call_options, images):
+    stage = np.zeros(3)
+    total = 0.0
+    results = []
+    for img in images:
+        start = time.perf_counter()
+        result, elapse = engine(img, **call_options)
+        total += time.perf_counter() - start
+        if elapse and len(elapse) == 3:
+            stage += elapse
+        results.append([line[1] for line in result] if result else [])
+    return stage * 1000 / len(images), total * 1000 / len(images), results
+
+
+def same_texts(results, reference):
+    matched = sum(len(set(r) & set(ref)) for r, ref in zip(results, reference))
+    total = sum(len(ref) for ref in reference)
+    return matched / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default='')
+    parser.add_argument('--count', type=int, default=3)
+    parser.add_argument('--profiles', default=','.join(PROFILES))
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.count) if args.corpus else generated_corpus(args.count)
+    names = [name for name in args.profiles.split(',') if name in PROFILES]
+    if 'default' not in names:
+        names.insert(0, 'default')
+
+    references = {}
+    print(f"{'category':<14}{'profile':<16}{'det ms':>9}{'cls ms':>9}{'rec ms':>9}{'total ms':>10}{'lines':>8}{'texts':>8}")
+    for name in names:
+        init_options, call_options = PROFILES[name]
+        engine = RapidOCR(**init_options)
+        for category, images in corpus.items():
+            stage, total, results = run_profile(engine, call_options, images)
+            if name == 'default':
+                references[category] = results
+            lines = sum(len(r) for r in results) / len(images)
+            agreement = same_texts(results, references[category])
+            print(f"{category:<14}{name:<16}{stage[0]:>9.1f}{stage[1]:>9.1f}{stage[2]:>9.1f}{total:>10.1f}{lines:>8.1f}{agreement:>8.1%}")
+
+
+if __name__ == '__main__':
+    main()
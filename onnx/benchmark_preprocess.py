@@ -0,0 +1,80 @@
+"""
+对比 image_processor 与原先逐步转换的 single_image_transform 的耗时和精度
+
+python benchmark_preprocess.py                  # 使用随机生成的图片
+python benchmark_preprocess.py --images /photos  # 使用目录下的图片
+
+utils 目录下存在图片模型时，会同时对比两种预处理得到的图片特征的余弦相似度
+"""
+import argparse
+import os
+import time
+import numpy as np
+import cv2
+import clip
+
+
+def legacy_image_processor(image_batch, image_size):
+    transformed_batch = np.array([clip.single_image_transform(img, image_size) for img in image_batch], dtype=np.float32)
+    return np.transpose(transformed_batch, (0, 3, 1, 2))
+
+
+def load_images(folder, count):
+    if not folder:
+        rng = np.random.default_rng(0)
+        return [cv2.GaussianBlur(rng.integers(0, 256, (3000, 4000, 3), dtype=np.uint8), (9, 9), 0) for _ in range(count)]
+    images = []
+    for name in sorted(os.listdir(folder)):
+        img = cv2.imread(os.path.join(folder, name), cv2.IMREAD_COLOR)
+        if img is not None:
+            images.append(img)
+        if len(images) >= count:
+            break
+    return images
+
+
+def timeit(func, repeat):
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def cosine(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    return np.sum(a * b, axis=-1) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default='')
+    parser.add_argument('--count', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.count)
+    print(f"images: {len(images)}, first shape: {images[0].shape}")
+
+    legacy = legacy_image_processor(images, clip.IMG_SIZE)
+    legacy_ms = timeit(lambda: legacy_image_processor(images, clip.IMG_SIZE), args.repeat)
+    print(f"{'legacy':<8}{legacy_ms:>10.1f} ms/batch")
+
+    model = clip.load_img_model(use_dml=False) if os.path.exists(clip.img_onnx_model_path) else None
+    legacy_features = model.run(["unnorm_image_features"], {"image": legacy})[0] if model else None
+
+    for backend in ("pil", "cv2"):
+        clip.env_resize_backend = backend
+        fused = clip.image_processor(images, clip.IMG_SIZE)
+        fused_ms = timeit(lambda: clip.image_processor(images, clip.IMG_SIZE), args.repeat)
+        line = f"{backend:<8}{fused_ms:>10.1f} ms/batch  speedup {legacy_ms / fused_ms:.2f}x  max abs diff {np.abs(fused - legacy).max():.6f}"
+        if model is not None:
+            features = model.run(["unnorm_image_features"], {"image": fused})[0]
+            cos = cosine(features, legacy_features)
+            line += f"  cosine min {cos.min():.6f} mean {cos.mean():.6f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
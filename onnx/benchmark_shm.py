@@ -0,0 +1,70 @@
+"""
+对比向推理进程传递图片数据的耗时：共享内存槽位(shm) 与 通过管道pickle传输(pickle)
+
+python benchmark_shm.py
+python benchmark_shm.py --processes 2 --rounds 50
+
+upload 为上传的JPEG原始字节，decoded 为解码后的1200万像素BGR图片，tensor 为预处理后的CLIP输入batch
+推理进程只读取数据的首尾字节后立即返回，结果只包含传输和调度的开销
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+import cv2
+from inference_pool import InferencePool
+
+
+def payloads():
+    rng = np.random.default_rng(0)
+    decoded = cv2.GaussianBlur(rng.integers(0, 256, (3000, 4000, 3), dtype=np.uint8), (9, 9), 0)
+    upload = cv2.imencode('.jpg', decoded, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+    tensor = rng.random((8, 3, 224, 224), dtype=np.float32)
+    return {'upload': upload, 'decoded': decoded, 'tensor': tensor}
+
+
+def touch(kind, data, options):
+    view = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data.reshape(-1).view(np.uint8)
+    return int(view[0]) + int(view[-1])
+
+
+async def measure(pool, data, rounds, concurrency):
+    await pool.submit('touch', data)
+    start = time.perf_counter()
+    for _ in range(rounds // concurrency):
+        await asyncio.gather(*(pool.submit('touch', data) for _ in range(concurrency)))
+    return (time.perf_counter() - start) * 1000 / (rounds // concurrency * concurrency)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=40)
+    args = parser.parse_args()
+
+    data = payloads()
+    slot_size = max(getattr(value, 'nbytes', len(value)) for value in data.values())
+    pools = {
+        'pickle': InferencePool(args.processes, touch),
+        'shm': InferencePool(args.processes, touch, slots=args.processes * 2, slot_size=slot_size),
+    }
+    if pools['shm'].ring is None:
+        print("/dev/shm is too small for the payloads, only pickle is measured")
+        del pools['shm']
+    for pool in pools.values():
+        pool.start()
+
+    print(f"{'payload':<10}{'MB':>8}{'transport':>11}{'ms':>9}{'MB/s':>9}")
+    try:
+        for name, value in data.items():
+            size = getattr(value, 'nbytes', len(value)) / 1024 / 1024
+            for transport, pool in pools.items():
+                ms = await measure(pool, value, args.rounds, args.processes)
+                print(f"{name:<10}{size:>8.2f}{transport:>11}{ms:>9.3f}{size * 1000 / ms:>9.0f}")
+    finally:
+        for pool in pools.values():
+            pool.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
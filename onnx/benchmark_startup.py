@@ -0,0 +1,62 @@
+"""
+测试进程启动时加载词表、创建分词器的耗时
+
+python benchmark_startup.py
+python benchmark_startup.py --rounds 50
+
+readline 为原先逐行读取 vocab.txt 的方式，text 为一次读取整个文件，map 为打开 __pycache__ 下编译好的词表文件，
+import clip 在新进程中执行，包含导入依赖包、创建分词器的全部耗时
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import bert_tokenizer as bert
+
+
+def readline_vocab(vocab_file):
+    vocab = {}
+    index = 0
+    with open(vocab_file, "r", encoding="utf-8") as reader:
+        while True:
+            token = reader.readline()
+            if not token:
+                break
+            vocab[token.strip()] = index
+            index += 1
+    return vocab
+
+
+def measure(func, rounds):
+    func()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def import_time(statement):
+    code = f"import time; start = time.perf_counter(); {statement}; print((time.perf_counter() - start) * 1000)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    vocab_file = bert.default_vocab()
+    vocab = bert.load_vocab(vocab_file)
+    assert vocab == readline_vocab(vocab_file) == bert.read_vocab_file(vocab_file)
+    print(f"vocab {len(vocab)} tokens, cache {bert.vocab_cache_path(vocab_file)}")
+    print(f"{'readline':<20}{measure(lambda: readline_vocab(vocab_file), args.rounds):>9.2f} ms")
+    print(f"{'text':<20}{measure(lambda: bert.read_vocab_file(vocab_file), args.rounds):>9.2f} ms")
+    print(f"{'map':<20}{measure(lambda: bert.load_vocab(vocab_file), args.rounds):>9.2f} ms")
+    print(f"{'FullTokenizer()':<20}{measure(bert.FullTokenizer, args.rounds):>9.2f} ms")
+    print(f"{'import clip':<20}{import_time('import clip'):>9.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
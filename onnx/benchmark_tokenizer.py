@@ -0,0 +1,58 @@
+"""
+测试搜索词分词速度：中文搜索词、英文搜索词、批量标签提示词
+
+python benchmark_tokenizer.py
+python benchmark_tokenizer.py --texts queries.txt --rounds 20   # 使用自己的搜索词，每行一个
+
+first 为首次分词（字符分类表、WordPiece缓存尚未命中）的耗时，warm 为重复分词的平均耗时
+"""
+import argparse
+import time
+import bert_tokenizer as bert
+import clip
+
+CHINESE = ["一只在草地上奔跑的狗", "海边的日落", "生日蛋糕和蜡烛", "穿红色衣服的小女孩", "雪山下的湖泊", "猫咪睡觉",
+           "2024年春节全家福", "办公室里的电脑屏幕"]
+ENGLISH = ["a dog running on the grass", "sunset at the beach", "Birthday cake with candles!",
+           "little girl in a red dress", "lake under the snowy mountains", "Screenshot of a chat, 12:30 PM"]
+LABELS = [f"a photo of a {name}." for name in
+          ["cat", "dog", "car", "bicycle", "flower", "mountain", "beach", "building", "food", "document",
+           "screenshot", "receipt", "baby", "bird", "tree", "river", "snow", "night sky", "fireworks", "street"]] * 10
+
+
+def read_texts(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def measure(func, texts, rounds):
+    start = time.perf_counter()
+    func(texts)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(texts)
+    warm = (time.perf_counter() - start) / rounds
+    return first * 1000, warm * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--texts', default='')
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    groups = {'custom': read_texts(args.texts)} if args.texts else {'chinese': CHINESE, 'english': ENGLISH, 'labels': LABELS}
+    tokenizer = bert.FullTokenizer()
+    tokenize_each = lambda texts: [tokenizer.tokenize(text) for text in texts]
+
+    print(f"{'group':<10}{'texts':>7}{'step':>16}{'first ms':>11}{'warm ms':>10}{'us/text':>10}")
+    for name, texts in groups.items():
+        for step, func in (('tokenize', tokenize_each), ('tokenize_numpy', clip.tokenize_numpy)):
+            first, warm = measure(func, texts, args.rounds)
+            print(f"{name:<10}{len(texts):>7}{step:>16}{first:>11.3f}{warm:>10.3f}{warm * 1000 / len(texts):>10.1f}")
+    print(f"wordpiece cache: {tokenizer.wordpiece_tokenizer.tokenize_word.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 import os
 import sys
+import hashlib
+import itertools
 import numpy as np
+import cv2
 from PIL import Image, ImageFile
 from typing import Union, List
 import onnxruntime
@@ -17,12 +20,54 @@ def join_path(folder_path, file_name):
 model_folder_path = join_path(current_folder, "utils")
 img_onnx_model_path = join_path(model_folder_path, "vit-b-16.img.fp32.onnx")
 txt_onnx_model_path = join_path(model_folder_path, "vit-b-16.txt.fp32.onnx")
+# quantize_clip.py 生成的INT8模型
+img_int8_model_path = join_path(model_folder_path, "vit-b-16.img.int8.onnx")
+txt_int8_model_path = join_path(model_folder_path, "vit-b-16.txt.int8.onnx")
+env_clip_quantized = os.getenv("CLIP_QUANTIZED", "off") == "on" # 使用INT8模型，加载时先与fp32模型对比特征，相似度不达标则继续使用fp32模型
+env_clip_int8_min_cosine = float(os.getenv("CLIP_INT8_MIN_COSINE", "0.99")) # INT8模型与fp32模型特征的平均余弦相似度下限
+env_clip_int8_sample_dir = os.getenv("CLIP_INT8_SAMPLE_DIR", "") # 精度检查使用的图片目录，留空则使用随机生成的样本图片
+
+# onnxruntime SessionOptions
+env_ort_intra_threads = int(os.getenv("ORT_INTRA_OP_THREADS", "0")) # CLIP模型算子内并行的线程数，0为onnxruntime默认值(开启 THREAD_SPLIT 时自动分配)
+env_ort_inter_threads = int(os.getenv("ORT_INTER_OP_THREADS", "0")) # 算子间并行的线程数，仅 ORT_EXECUTION_MODE=parallel 时生效
+env_ort_execution_mode = os.getenv("ORT_EXECUTION_MODE", "sequential") # sequential 或 parallel
+env_ort_graph_optimization = os.getenv("ORT_GRAPH_OPTIMIZATION", "all") # 图优化级别：disable、basic、extended、all
+env_ort_optimized_model_dir = os.getenv("ORT_OPTIMIZED_MODEL_DIR", "") # 保存优化后模型的目录，下次启动直接加载，跳过图优化，留空则不保存
+env_ort_mem_arena = os.getenv("ORT_MEM_ARENA", "on") == "on" # CPU内存池，关闭后推理间隙占用的内存更少，速度略慢
+env_ort_mem_pattern = os.getenv("ORT_MEM_PATTERN", "on") == "on" # 按上一次推理的内存分配规律预先分配内存，输入尺寸变化较多时可关闭
+env_ort_cpu_affinity = os.getenv("ORT_CPU_AFFINITY", "") # 原样传给 session.intra_op_thread_affinities，例如 4个线程时 "1;2;3"，需同时设置 ORT_INTRA_OP_THREADS
+
+graph_optimization_levels = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+run_options = onnxruntime.RunOptions()
+run_options.log_severity_level = 2
 
 IMG_SIZE = 224
 
+
+def model_identity(model_path):
+    # 模型文件名+大小+修改时间，用于缓存key，替换模型文件后旧缓存自动失效
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return os.path.basename(model_path)
+    return f"{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
 _tokenizer = bert.FullTokenizer()
 mean = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
 std = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+# uint8像素值到归一化float32的查表，与 (x / 255.0 - mean) / std 的计算结果完全一致
+normalize_lut = ((np.arange(256, dtype=np.float32)[None, :] / 255.0 - mean[:, None]) / std[:, None]).astype(np.float32)
+env_resize_backend = os.getenv("CLIP_RESIZE_BACKEND", "pil") # 图片缩放方式：pil 与原先结果完全一致；cv2 速度更快，结果有细微差异
+env_jpeg_reduced = os.getenv("CLIP_JPEG_REDUCED", "off") == "on" # JPEG图片按目标尺寸使用1/2、1/4、1/8缩小解码，大图解码更快、占用内存更少，结果有细微差异
+env_txt_dynamic_length = os.getenv("CLIP_TXT_DYNAMIC_LENGTH", "off") == "on" # 文本模型的序列长度可变时，按batch内最长的文本补齐，不再固定补齐到52，短搜索词推理更快，结果有细微差异
+env_txt_length_bucket = int(os.getenv("CLIP_TXT_LENGTH_BUCKET", "8")) # 可变序列长度时按该值的倍数向上取整，减少输入形状的种类
+env_txt_batch_size = int(os.getenv("CLIP_TXT_BATCH_SIZE", "64")) # 批量计算文本特征时每次推理的文本数量
 
 
 def single_image_transform(image, image_size):
@@ -33,17 +78,92 @@ def single_image_transform(image, image_size):
     return image.astype(np.float32)
 
 
-def image_processor(image_batch, image_size=224):
-    transformed_batch = [single_image_transform(img, image_size) for img in image_batch]
-    transformed_batch = np.array(transformed_batch, dtype=np.float32)  # Shape would be (N, H, W, C)
+def resize_image(image, image_size):
+    """Resizes a decoded HxWx3 uint8 image to image_size x image_size in one step."""
+    if env_resize_backend == "cv2":
+        # INTER_AREA 缩小时会做抗锯齿，结果接近PIL的BICUBIC；放大时使用INTER_CUBIC
+        h, w = image.shape[:2]
+        interpolation = cv2.INTER_AREA if h >= image_size and w >= image_size else cv2.INTER_CUBIC
+        return cv2.resize(image, (image_size, image_size), interpolation=interpolation)
+    return np.asarray(Image.fromarray(image).resize((image_size, image_size), Image.BICUBIC))
+
+
+def preprocess_identity():
+    # 会影响特征结果的预处理选项，拼接到缓存key的模型标识后；默认设置返回空字符串，已有缓存保持有效
+    options = []
+    if env_resize_backend != "pil":
+        options.append(f"resize={env_resize_backend}")
+    if env_jpeg_reduced:
+        options.append("jpeg_reduced")
+    return ":" + ",".join(options) if options else ""
+
+
+def jpeg_size(data):
+    """Reads (width, height) from the SOF marker of a JPEG, or returns None for other formats."""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        # SOF0-SOF15，排除 DHT(C4)、JPG(C8)、DAC(CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
 
-    # Reorder dimensions to (N, C, H, W)
-    transformed_batch = np.transpose(transformed_batch, (0, 3, 1, 2))
 
-    return transformed_batch
+reduced_decode_flags = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
 
 
-def tokenize_numpy(texts: Union[str, List[str]], context_length: int = 52) -> np.ndarray:
+def decode_image(image_bytes, image_size=224, reduced=None):
+    """Decodes uploaded image bytes for CLIP, returns None when decoding fails.
+
+    With reduced decoding on, JPEGs are decoded through libjpeg DCT scaling at
+    the largest 1/2, 1/4 or 1/8 reduction whose short side still stays at or
+    above image_size; other formats are decoded at full size.
+    """
+    flags = cv2.IMREAD_COLOR
+    if env_jpeg_reduced if reduced is None else reduced:
+        size = jpeg_size(image_bytes)
+        if size is not None:
+            short_side = min(size)
+            for factor, reduced_flags in reduced_decode_flags:
+                if short_side // factor >= image_size:
+                    flags = reduced_flags
+                    break
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+
+def image_processor(image_batch, image_size=224, out=None):
+    """Preprocesses images into a normalized float32 (N, 3, H, W) batch.
+
+    Each image is resized once and written channel by channel into the batch
+    buffer through a uint8 -> float32 lookup table, which gives the same values
+    as single_image_transform without the intermediate full-size copies.
+    """
+    if out is None:
+        out = np.empty((len(image_batch), 3, image_size, image_size), dtype=np.float32)
+    for i, img in enumerate(image_batch):
+        img = np.asarray(img, dtype=np.uint8)
+        if img.ndim != 3 or img.shape[2] != 3:
+            img = np.array(Image.fromarray(img).convert('RGB'))
+        resized = resize_image(img, image_size)
+        # 通道顺序与原先一致：cv2解码得到的通道顺序直接按mean/std的顺序归一化，保证与已有图片特征兼容
+        for c in range(3):
+            np.take(normalize_lut[c], resized[:, :, c], out=out[i, c])
+    return out
+
+
+def tokenize_numpy(texts: Union[str, List[str]], context_length: int = 52, dtype=np.int64) -> np.ndarray:
     """
     Returns the tokenized representation of given input string(s)
     Parameters
@@ -52,60 +172,274 @@ def tokenize_numpy(texts: Union[str, List[str]], context_length: int = 52) -> np
         An input string or a list of input strings to tokenize
     context_length : int
         The context length to use; all baseline models use 52 as the context length
+    dtype : numpy integer type of the result
     Returns
     -------
     A two-dimensional numpy array containing the resulting tokens, shape = [number of input strings, context_length]
     """
     if isinstance(texts, str):
         texts = [texts]
+    return pack_token_ids([token_ids(text, context_length) for text in texts], context_length, dtype=dtype)
+
 
-    all_tokens = []
-    for text in texts:
-        all_tokens.append([_tokenizer.vocab['[CLS]']] + _tokenizer.convert_tokens_to_ids(_tokenizer.tokenize(text))[
-                                                        :context_length - 2] + [_tokenizer.vocab['[SEP]']])
+def token_ids(text, context_length=52):
+    """Token ids of one text wrapped in [CLS] ... [SEP], truncated to context_length."""
+    ids = _tokenizer.convert_tokens_to_ids(_tokenizer.tokenize(text))[:context_length - 2]
+    return [_tokenizer.token_id('[CLS]')] + ids + [_tokenizer.token_id('[SEP]')]
 
-    result = np.zeros((len(all_tokens), context_length), dtype=np.int64)
 
-    for i, tokens in enumerate(all_tokens):
-        assert len(tokens) <= context_length
-        result[i, :len(tokens)] = np.array(tokens)
+def pack_token_ids(rows, context_length=52, dynamic=False, dtype=np.int64):
+    """Writes rows of token ids into one preallocated, zero padded (N, L) array.
 
+    L is context_length, or with dynamic the longest row rounded up to a
+    multiple of CLIP_TXT_LENGTH_BUCKET, capped at context_length.
+    """
+    lengths = np.fromiter((len(row) for row in rows), dtype=np.intp, count=len(rows))
+    width = context_length
+    if dynamic and len(rows):
+        bucket = max(1, env_txt_length_bucket)
+        width = min(context_length, -(-int(lengths.max()) // bucket) * bucket)
+    assert not len(rows) or lengths.max() <= width
+    result = np.zeros((len(rows), width), dtype=dtype)
+    if len(rows) <= 8:
+        # 行数很少时逐行写入更快，单个搜索词走这里
+        for i, row in enumerate(rows):
+            result[i, :len(row)] = row
+        return result
+    # 掩码按行优先顺序选中每行的前len个位置，与所有token依次拼接的顺序一致，一次写入
+    result[np.arange(width) < lengths[:, None]] = np.fromiter(itertools.chain.from_iterable(rows), dtype=dtype,
+                                                                count=int(lengths.sum()))
     return result
 
 
-def load_img_model(use_dml):
-    img_sess_options = onnxruntime.SessionOptions()
-    img_run_options = onnxruntime.RunOptions()
-    img_run_options.log_severity_level = 2
+def txt_identity():
+    # 开启可变序列长度后特征有细微差异，拼接到缓存key的模型标识后；默认设置返回空字符串
+    return f":dynamic_length={env_txt_length_bucket}" if env_txt_dynamic_length else ""
+
+
+def configured_model_path(fp32_path, int8_path):
+    # 开启 CLIP_QUANTIZED 且INT8模型文件存在时使用INT8模型，否则使用fp32模型
+    if env_clip_quantized and os.path.exists(int8_path):
+        return int8_path
+    return fp32_path
+
+
+SAMPLE_TEXTS = ["一只猫", "海边的日落", "生日蛋糕和蜡烛", "雪山下的湖泊", "城市夜景", "穿着红色衣服的小孩",
+                "餐桌上的火锅", "下雨天的街道", "身份证", "草地上奔跑的狗", "婚礼合影", "书桌上的笔记本电脑",
+                "樱花", "地铁站", "海底的鱼群", "截图"]
+
+
+def sample_images(folder="", count=16):
+    """Loads up to count images from folder, or generates fixed random smooth images when folder is empty."""
+    images = []
+    if folder:
+        for name in sorted(os.listdir(folder)):
+            img = cv2.imread(join_path(folder, name), cv2.IMREAD_COLOR)
+            if img is not None:
+                images.append(img)
+            if len(images) >= count:
+                break
+    if not images:
+        rng = np.random.default_rng(0)
+        for _ in range(count):
+            small = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+            images.append(cv2.resize(small, (IMG_SIZE * 2, IMG_SIZE * 2), interpolation=cv2.INTER_CUBIC))
+    return images
+
+
+def sample_inputs(kind, folder="", texts=None, count=16):
+    if kind == "img":
+        return image_processor(sample_images(folder, count), image_size=IMG_SIZE)
+    return tokenize_numpy(texts or SAMPLE_TEXTS, 52)
+
+
+def compare_models(kind, reference_model, model, inputs):
+    """Cosine similarity between the features of two models on the same inputs."""
+    run = run_img_model if kind == "img" else run_txt_model
+    a = np.asarray(run(model, inputs), dtype=np.float64)
+    b = np.asarray(run(reference_model, inputs), dtype=np.float64)
+    cosine = np.sum(a * b, axis=-1) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1))
+    return {
+        'samples': len(cosine),
+        'mean_cosine': round(float(cosine.mean()), 6),
+        'min_cosine': round(float(cosine.min()), 6),
+        'passed': bool(cosine.mean() >= env_clip_int8_min_cosine),
+    }
+
+
+quantized_checks = {}
+
+
+def quantized_check_key(fp32_path, int8_path):
+    return f"{model_identity(int8_path)}|{model_identity(fp32_path)}"
+
+
+def loaded_model_path(fp32_path, int8_path):
+    """The model file load_quantized uses for this pair, or None until the INT8 check has run."""
+    if configured_model_path(fp32_path, int8_path) == fp32_path:
+        return fp32_path
+    report = quantized_checks.get(quantized_check_key(fp32_path, int8_path))
+    if report is None:
+        return None
+    return int8_path if report['passed'] else fp32_path
+
+
+def load_quantized(kind, fp32_path, int8_path, create_func):
+    """Loads the INT8 model if enabled and close enough to fp32 on the sample set, else the fp32 model.
+
+    The check result is kept per model file pair, so reloading after an idle
+    unload does not run it again.
+    """
+    if configured_model_path(fp32_path, int8_path) == fp32_path:
+        return create_func(fp32_path)
+    key = quantized_check_key(fp32_path, int8_path)
+    report = quantized_checks.get(key)
+    if report is None:
+        fp32_model = create_func(fp32_path)
+        int8_model = create_func(int8_path)
+        report = compare_models(kind, fp32_model, int8_model, sample_inputs(kind, env_clip_int8_sample_dir))
+        report['model'] = os.path.basename(int8_path)
+        quantized_checks[key] = report
+        print(f"clip {kind} int8 check: {report}")
+        if report['passed']:
+            del fp32_model
+            return int8_model
+        del int8_model
+        print(f"clip {kind} int8 mean cosine below {env_clip_int8_min_cosine}, use {os.path.basename(fp32_path)}")
+        return fp32_model
+    return create_func(int8_path if report['passed'] else fp32_path)
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def thread_split(ocr_threads=0, cpus=None):
+    """Splits the available cores between OCR and CLIP, returns (ocr_threads, clip_threads).
+
+    OCR and CLIP requests run at the same time, so giving each session all
+    cores oversubscribes the CPU; the two sessions get disjoint shares instead.
+    """
+    cpus = cpus or available_cpus()
+    ocr_threads = ocr_threads or max(1, cpus // 2)
+    clip_threads = env_ort_intra_threads or max(1, cpus - ocr_threads)
+    return ocr_threads, clip_threads
+
+
+def optimized_model_path(model_path):
+    # 文件名包含模型标识、onnxruntime版本和优化级别，任意一项变化都会重新生成
+    if not env_ort_optimized_model_dir:
+        return None
+    identity = f"{model_identity(model_path)}|{onnxruntime.__version__}|{env_ort_graph_optimization}"
+    digest = hashlib.md5(identity.encode('utf-8')).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return join_path(env_ort_optimized_model_dir, f"{name}.{digest}.optimized.onnx")
+
+
+def create_session(model_path, use_dml, intra_threads=0):
+    sess_options = onnxruntime.SessionOptions()
+    intra_threads = env_ort_intra_threads or intra_threads
+    if intra_threads > 0:
+        sess_options.intra_op_num_threads = intra_threads
+    if env_ort_inter_threads > 0:
+        sess_options.inter_op_num_threads = env_ort_inter_threads
+    if env_ort_execution_mode == "parallel":
+        sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+    else:
+        sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    sess_options.graph_optimization_level = graph_optimization_levels.get(
+        env_ort_graph_optimization, onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL)
+    sess_options.enable_cpu_mem_arena = env_ort_mem_arena
+    sess_options.enable_mem_pattern = env_ort_mem_pattern
+    if env_ort_cpu_affinity:
+        sess_options.add_session_config_entry("session.intra_op_thread_affinities", env_ort_cpu_affinity)
     providers = ["CPUExecutionProvider"]
     if use_dml:
         providers = ["DmlExecutionProvider", "CPUExecutionProvider"]
 
-    return onnxruntime.InferenceSession(img_onnx_model_path,
-                                        sess_options=img_sess_options,
-                                        providers=providers)
+    # 优化后的模型与执行设备相关，只缓存CPU推理的模型
+    cache_path = None if use_dml else optimized_model_path(model_path)
+    if cache_path and os.path.exists(cache_path):
+        sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return onnxruntime.InferenceSession(cache_path, sess_options=sess_options, providers=providers)
+    if cache_path:
+        os.makedirs(env_ort_optimized_model_dir, exist_ok=True)
+        # 先写到临时文件再改名，避免多个进程同时启动时读到写了一半的文件
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        sess_options.optimized_model_filepath = tmp_path
+        session = onnxruntime.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, cache_path)
+        return session
+    return onnxruntime.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+
+
+def load_img_model(use_dml, intra_threads=0):
+    return load_quantized("img", img_onnx_model_path, img_int8_model_path,
+                          lambda model_path: create_session(model_path, use_dml, intra_threads))
 
 
 def process_image(img, img_model):
-    inputs = image_processor([img], image_size=IMG_SIZE)
-    input = inputs[0:1, :, :, :]
-    image_feature = img_model.run(["unnorm_image_features"], {"image": input})[0].tolist()[0]
-    return image_feature
+    return process_images([img], img_model)[0]
 
 
-def load_txt_model(use_dml):
-    txt_sess_options = onnxruntime.SessionOptions()
-    txt_run_options = onnxruntime.RunOptions()
-    txt_run_options.log_severity_level = 2
-    providers = ["CPUExecutionProvider"]
-    if use_dml:
-        providers = ["DmlExecutionProvider", "CPUExecutionProvider"]
-    return onnxruntime.InferenceSession(txt_onnx_model_path,
-                                        sess_options=txt_sess_options,
-                                        providers=providers)
+def process_images(imgs, img_model):
+    return run_img_model(img_model, image_processor(imgs, image_size=IMG_SIZE))
+
+
+def run_img_model(img_model, inputs):
+    if img_model.get_inputs()[0].shape[0] == 1:
+        # 模型导出时batch维度固定为1，只能逐张推理
+        return [img_model.run(["unnorm_image_features"], {"image": inputs[i:i + 1]}, run_options)[0].tolist()[0]
+                for i in range(len(inputs))]
+    return img_model.run(["unnorm_image_features"], {"image": inputs}, run_options)[0].tolist()
+
+
+def load_txt_model(use_dml, intra_threads=0):
+    return load_quantized("txt", txt_onnx_model_path, txt_int8_model_path,
+                          lambda model_path: create_session(model_path, use_dml, intra_threads))
+
+
+def txt_input_spec(text_model):
+    """Returns (dynamic, dtype): whether to pad to a variable sequence length, which needs CLIP_TXT_DYNAMIC_LENGTH
+    and a text graph that allows it, and the integer type of the text input.
+    """
+    text_input = text_model.get_inputs()[0]
+    # 导出时固定序列长度的模型，shape[1] 为整数52
+    dynamic = env_txt_dynamic_length and not isinstance(text_input.shape[1], int)
+    return dynamic, np.int32 if text_input.type == "tensor(int32)" else np.int64
 
 
 def process_txt(txt, text_model):
-    input = tokenize_numpy([txt], 52)
-    embeddings = text_model.run(["unnorm_text_features"], {"text": input})[0].tolist()[0]
+    dynamic, dtype = txt_input_spec(text_model)
+    input = pack_token_ids([token_ids(txt)], 52, dynamic, dtype)
+    embeddings = run_txt_model(text_model, input)[0]
+    return embeddings
+
+
+def process_txts(txts, text_model):
+    """Embeds a list of texts in batches of CLIP_TXT_BATCH_SIZE, returns the features in input order."""
+    dynamic, dtype = txt_input_spec(text_model)
+    rows = [token_ids(txt) for txt in txts]
+    order = list(range(len(rows)))
+    if dynamic:
+        # 按token数排序后分批，同一批内的文本长度接近，补齐更少
+        order.sort(key=lambda i: len(rows[i]))
+    embeddings = [None] * len(rows)
+    batch_size = max(1, env_txt_batch_size)
+    for start in range(0, len(order), batch_size):
+        indexes = order[start:start + batch_size]
+        inputs = pack_token_ids([rows[i] for i in indexes], 52, dynamic, dtype)
+        for i, embedding in zip(indexes, run_txt_model(text_model, inputs)):
+            embeddings[i] = embedding
     return embeddings
+
+
+def run_txt_model(text_model, inputs):
+    if text_model.get_inputs()[0].shape[0] == 1:
+        return [text_model.run(["unnorm_text_features"], {"text": inputs[i:i + 1]}, run_options)[0].tolist()[0]
+                for i in range(len(inputs))]
+    return text_model.run(["unnorm_text_features"], {"text": inputs}, run_options)[0].tolist()
@@ -0,0 +1,329 @@
+import asyncio
+import collections
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from multiprocessing import reduction
+from multiprocessing.connection import Connection, wait
+from shm_ring import ShmRing
+
+
+def worker_main(conn, ring, handler, initializer, index, collect_stats=None):
+    # 由主进程负责退出，Ctrl+C 不中断正在执行的推理；主进程退出后 recv 读到 EOF 结束
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if initializer is not None:
+        initializer(index)
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        kind, transport, payload, options = message
+        if transport == 'notify':
+            # 发给所有推理进程的通知，例如空闲时卸载模型，不回复
+            try:
+                handler(kind, None, options)
+            except Exception:
+                traceback.print_exc()
+            continue
+        data = ring.read(payload) if transport == 'shm' else payload
+        try:
+            reply = (True, handler(kind, data, options))
+        except Exception as e:
+            traceback.print_exc()
+            reply = (False, str(e))
+        # 回复前释放对槽位的引用，主进程收到回复后会复用这个槽位
+        del data
+        # 推理进程内累计的统计随回复一起交给主进程汇总
+        conn.send(reply + (collect_stats() if collect_stats is not None else None,))
+
+
+def wait_child(pid, timeout):
+    """Reaps a child process, returns its exit code, or None if it is still running after timeout."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            done, status = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            return None
+        if done:
+            return os.waitstatus_to_exitcode(status)
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(0.01)
+
+
+def spawner_main(control, ring, handler, initializer, collect_stats):
+    # 服务进程在启动其他线程之前fork出这个进程，它只有一个线程，推理进程都由它fork；
+    # 服务进程有了线程池、读取线程之后再fork，子进程可能继承其他线程持有的锁而卡死
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    children = set()
+    while True:
+        try:
+            message = control.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        index, exited = message
+        exitcode = None
+        if exited is not None:
+            # 推理进程关闭连接后很快退出，回收它并取得退出码
+            exitcode = wait_child(exited, 1.0)
+            children.discard(exited)
+        parent_conn, child_conn = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            parent_conn.close()
+            status = 0
+            try:
+                worker_main(child_conn, ring, handler, initializer, index, collect_stats)
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        child_conn.close()
+        children.add(pid)
+        control.send((pid, exitcode))
+        reduction.send_handle(control, parent_conn.fileno(), os.getppid())
+        parent_conn.close()
+    # 服务进程已通知推理进程退出，等待它们结束，超时后强制结束
+    deadline = time.monotonic() + 5
+    for pid in children:
+        if wait_child(pid, max(0.0, deadline - time.monotonic())) is None:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            wait_child(pid, 1.0)
+
+
+class InferencePool(object):
+    """Runs ``handler(kind, data, options)`` in forked processes, one task per process at a time.
+
+    Payloads go through a shared memory ``ShmRing`` when they fit in a slot and
+    are pickled through the pipe otherwise (or when ``slots`` is 0). A slot is
+    recycled only after the process that read it replies or dies, so a request
+    cancelled mid-inference never frees a slot that is still being read. Dead
+    processes are replaced and their in-flight task fails with RuntimeError.
+
+    All processes are forked by a single-threaded spawner process that is
+    itself forked in ``start``, so a replacement started while the server has
+    other threads running does not inherit their locks.
+
+    ``collect_stats()`` runs in the process after every task and its result is
+    passed to ``merge_stats(stats)`` on the event loop thread, so counters kept
+    by the handler can be added up in the server process. ``notify`` runs a
+    handler call in every process without waiting for a reply.
+    """
+
+    def __init__(self, processes, handler, initializer=None, slots=0, slot_size=16 * 1024 * 1024,
+                 collect_stats=None, merge_stats=None):
+        self.processes = max(1, int(processes))
+        self.handler = handler
+        self.initializer = initializer
+        self.collect_stats = collect_stats
+        self.merge_stats = merge_stats
+        self.ring = ShmRing.fit(slots, slot_size) if slots > 0 else None
+        self.context = multiprocessing.get_context("fork")
+        self.spawner = None
+        self.control = None # 与spawner进程通信的连接，只在事件循环线程内使用
+        self.workers = [None] * self.processes # index -> (pid, conn)，进程退出后原位替换
+        self.tasks = {} # index -> (future, slot, start)
+        self.idle = None
+        self.slot_waiters = collections.deque()
+        self.loop = None
+        self.reader = None
+        self.closed = False
+        self.submitted = collections.Counter()
+        self.notified = collections.Counter()
+        self.failed = 0
+        self.restarts = 0
+        self.busy_ms = 0.0
+        self.transport = {'shm': 0, 'pickle': 0}
+
+    def start(self):
+        """Forks the spawner and the processes; call on the event loop thread before other threads start."""
+        self.loop = asyncio.get_running_loop()
+        self.idle = asyncio.Queue()
+        self.control, spawner_conn = self.context.Pipe()
+        self.spawner = self.context.Process(target=spawner_main, name="inference-spawner", daemon=True,
+                                            args=(spawner_conn, self.ring, self.handler, self.initializer, self.collect_stats))
+        self.spawner.start()
+        spawner_conn.close()
+        for index in range(self.processes):
+            self._spawn(index)
+            self.idle.put_nowait(index)
+        self.reader = threading.Thread(target=self._read_replies, name="inference-pool", daemon=True)
+        self.reader.start()
+
+    def _spawn(self, index, exited=None):
+        """Has the spawner fork a process for ``index``, returns the exit code of the ``exited`` pid it replaces."""
+        self.control.send((index, exited))
+        pid, exitcode = self.control.recv()
+        # 管道由spawner创建，服务进程这一端的文件描述符通过unix socket传过来
+        self.workers[index] = (pid, Connection(reduction.recv_handle(self.control)))
+        return exitcode
+
+    def _read_replies(self):
+        # 唯一的读取线程，收到的回复和进程退出事件都转交给事件循环线程处理
+        # 推理进程不是服务进程的子进程，没有sentinel，进程退出时它持有的管道关闭，读到EOF
+        dead = []
+        while not self.closed:
+            workers = list(enumerate(self.workers))
+            # 已替换的连接不再保留，由垃圾回收关闭
+            dead = [conn for conn in dead if any(conn is worker[1] for _, worker in workers)]
+            waiting = {conn: index for index, (_, conn) in workers if not any(conn is d for d in dead)}
+            for ready in wait(list(waiting), timeout=0.5):
+                index = waiting[ready]
+                try:
+                    reply = ready.recv()
+                except (EOFError, OSError):
+                    dead.append(ready)
+                    self.loop.call_soon_threadsafe(self._worker_died, index, ready)
+                    continue
+                self.loop.call_soon_threadsafe(self._complete, index, reply)
+
+    def _finish(self, index):
+        future, slot, start = self.tasks.pop(index)
+        self.busy_ms += (time.perf_counter() - start) * 1000
+        if slot is not None:
+            self.ring.release(slot)
+            self._wake_slot_waiter()
+        return future
+
+    def _complete(self, index, reply):
+        if index not in self.tasks:
+            return
+        future = self._finish(index)
+        self.idle.put_nowait(index)
+        ok, value, stats = reply
+        if stats is not None and self.merge_stats is not None:
+            self.merge_stats(stats)
+        if not ok:
+            self.failed += 1
+        if future.done():
+            return # 请求已取消
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(RuntimeError(value))
+
+    def _worker_died(self, index, conn):
+        if self.closed or self.workers[index][1] is not conn:
+            return
+        self.restarts += 1
+        busy = index in self.tasks
+        if busy:
+            future = self._finish(index)
+            self.failed += 1
+            if not future.done():
+                future.set_exception(RuntimeError("inference process exited"))
+        try:
+            exitcode = self._spawn(index, self.workers[index][0])
+        except (EOFError, OSError) as e:
+            # spawner进程已退出，不再替换，这个序号不再接收任务
+            print(f"inference process {index} exited, starting a new one failed: {e}")
+            return
+        print(f"inference process {index} exited with {exitcode}, started a new one")
+        if busy:
+            # 空闲时退出的进程序号仍在空闲队列中，不重复加入
+            self.idle.put_nowait(index)
+
+    def _wake_slot_waiter(self):
+        while self.slot_waiters:
+            waiter = self.slot_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def _acquire_slot(self):
+        while True:
+            slot = self.ring.acquire()
+            if slot is not None:
+                return slot
+            waiter = self.loop.create_future()
+            self.slot_waiters.append(waiter)
+            await waiter
+
+    async def submit(self, kind, data, **options):
+        """Runs one task in a free process and returns the handler result."""
+        slot = None
+        try:
+            if self.ring is not None and self.ring.fits(data.nbytes if hasattr(data, 'nbytes') else len(data)):
+                slot = await self._acquire_slot()
+                payload = ('shm', self.ring.write(slot, data))
+            else:
+                # 内存映射的上传文件等缓冲区视图不能直接pickle
+                payload = ('pickle', data.tobytes() if isinstance(data, memoryview) else data)
+            index = await self.idle.get()
+        except BaseException:
+            if slot is not None:
+                self.ring.release(slot)
+                self._wake_slot_waiter()
+            raise
+        future = self.loop.create_future()
+        self.tasks[index] = (future, slot, time.perf_counter())
+        self.transport[payload[0]] += 1
+        self.submitted[kind] += 1
+        try:
+            self.workers[index][1].send((kind, payload[0], payload[1], options))
+        except OSError:
+            pass # 进程已退出，由 _worker_died 结束这个任务
+        return await future
+
+    def notify(self, kind, **options):
+        """Sends ``handler(kind, None, options)`` to every process; a busy process runs it after its current task."""
+        for worker in self.workers:
+            try:
+                worker[1].send((kind, 'notify', None, options))
+            except OSError:
+                pass # 进程已退出，新进程不会继承它的状态
+        self.notified[kind] += 1
+
+    def stats(self):
+        tasks = sum(self.submitted.values())
+        return {
+            'processes': self.processes,
+            'pids': [worker[0] if worker else None for worker in self.workers],
+            'busy': len(self.tasks),
+            'tasks': dict(self.submitted),
+            'notified': dict(self.notified),
+            'failed': self.failed,
+            'restarts': self.restarts,
+            'avg_ms': round(self.busy_ms / tasks, 2) if tasks else 0.0,
+            'transport': dict(self.transport),
+            'ring': self.ring.stats() if self.ring is not None else None,
+        }
+
+    def close(self):
+        self.closed = True
+        for _, conn in self.workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        # spawner 等待推理进程退出，超时后结束它们
+        if self.control is not None:
+            try:
+                self.control.send(None)
+            except OSError:
+                pass
+        if self.spawner is not None:
+            self.spawner.join(timeout=10)
+            if self.spawner.is_alive():
+                self.spawner.terminate()
+        if self.ring is not None:
+            self.ring.close()
@@ -0,0 +1,112 @@
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+import uvicorn
+
+RESTART_EXIT_CODE = 75 # worker 以该退出码退出时，主进程结束全部worker并重启整个服务
+
+
+def worker_count(workers, cpus):
+    """Resolves the WORKERS setting; 0 starts one worker per available core."""
+    return workers if workers > 0 else max(1, cpus)
+
+
+def bind_socket(host, port):
+    # 未指定host时与 uvicorn.run(host=None) 一致监听所有地址，系统不支持IPv6时只监听IPv4
+    if not host:
+        try:
+            sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(("::", port))
+            return sock
+        except OSError:
+            host = "0.0.0.0"
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def run_worker(app, sock, index, on_worker_start):
+    code = 0
+    try:
+        # 恢复默认信号处理，uvicorn启动时会重新注册自己的处理函数
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if on_worker_start is not None:
+            on_worker_start(index)
+        uvicorn.Server(uvicorn.Config(app)).run(sockets=[sock])
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def serve(app, host, port, workers, on_worker_start=None):
+    """Runs ``app`` in ``workers`` forked uvicorn processes sharing one listening socket.
+
+    Everything loaded before the call (models, vocab, caches) is shared with the
+    workers copy-on-write. ``on_worker_start(index)`` runs in each worker right
+    after fork. A worker that dies is started again; when one exits with
+    ``RESTART_EXIT_CODE`` all workers are stopped and True is returned so the
+    caller can restart the whole service.
+    """
+    sock = bind_socket(host, port)
+    sock.listen(2048)
+    # 冻结启动阶段创建的对象，GC不再扫描和修改它们，避免共享的内存页在worker中被复制
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    state = {'stopping': False, 'restart': False}
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(app, sock, index, on_worker_start)
+        children[pid] = index
+
+    def stop_children(signum=None, frame=None):
+        state['stopping'] = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop_children)
+    signal.signal(signal.SIGINT, stop_children)
+    for index in range(workers):
+        spawn(index)
+    print(f"prefork: {workers} workers started, pids {', '.join(map(str, children))}")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or state['stopping']:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        if code == RESTART_EXIT_CODE:
+            state['restart'] = True
+            stop_children()
+            continue
+        print(f"prefork: worker {index} (pid {pid}) exited with {code}, starting a new one")
+        time.sleep(1)
+        spawn(index)
+
+    sock.close()
+    return state['restart']
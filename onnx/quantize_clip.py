@@ -0,0 +1,102 @@
+"""
+从 utils 目录下的fp32 CLIP模型生成INT8模型，生成后输出与fp32模型的特征余弦相似度
+
+python quantize_clip.py                                   # 动态量化图片和文本模型
+python quantize_clip.py --model img --mode static --calib-images /photos
+python quantize_clip.py --mode static --calib-texts queries.txt --per-channel
+python quantize_clip.py --output-dir ../openvino/utils     # OpenVINO版本可直接使用生成的模型，推荐 static 模式
+
+生成 vit-b-16.img.int8.onnx、vit-b-16.txt.int8.onnx 后，设置环境变量 CLIP_QUANTIZED=on 启用
+"""
+import argparse
+import os
+import tempfile
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                      quantize_dynamic, quantize_static)
+import clip
+
+calibration_methods = {
+    'minmax': CalibrationMethod.MinMax,
+    'entropy': CalibrationMethod.Entropy,
+    'percentile': CalibrationMethod.Percentile,
+}
+
+
+class ClipCalibrationReader(CalibrationDataReader):
+    """Feeds the calibration samples to the quantizer one row at a time."""
+
+    def __init__(self, input_name, inputs):
+        self.input_name = input_name
+        self.inputs = inputs
+        self.index = 0
+
+    def get_next(self):
+        if self.index >= len(self.inputs):
+            return None
+        row = self.inputs[self.index:self.index + 1]
+        self.index += 1
+        return {self.input_name: row}
+
+
+def read_texts(path):
+    if not path:
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def preprocess_model(model_path, folder):
+    # 量化前做形状推断和图优化，失败时直接使用原模型
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        output_path = os.path.join(folder, os.path.basename(model_path))
+        quant_pre_process(model_path, output_path)
+        return output_path
+    except Exception as e:
+        print(f"quant_pre_process skipped: {e}")
+        return model_path
+
+
+def quantize(kind, args):
+    fp32_path = clip.img_onnx_model_path if kind == "img" else clip.txt_onnx_model_path
+    int8_path = os.path.join(args.output_dir, os.path.basename(clip.img_int8_model_path if kind == "img" else clip.txt_int8_model_path))
+    input_name = "image" if kind == "img" else "text"
+    print(f"quantize {fp32_path} -> {int8_path}, mode {args.mode}")
+
+    with tempfile.TemporaryDirectory() as folder:
+        model_path = preprocess_model(fp32_path, folder) if args.mode == "static" else fp32_path
+        if args.mode == "static" and kind == "img":
+            reader = ClipCalibrationReader(input_name, clip.sample_inputs(kind, args.calib_images, count=args.calib_count))
+            quantize_static(model_path, int8_path, reader, quant_format=QuantFormat.QDQ, per_channel=args.per_channel,
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                            calibrate_method=calibration_methods[args.calib_method])
+        else:
+            # 文本模型的输入是token id，没有可校准的浮点输入，始终使用动态量化
+            quantize_dynamic(model_path, int8_path, per_channel=args.per_channel, weight_type=QuantType.QInt8)
+
+    fp32_model = clip.create_session(fp32_path, False)
+    int8_model = clip.create_session(int8_path, False)
+    inputs = clip.sample_inputs(kind, args.calib_images, read_texts(args.calib_texts))
+    report = clip.compare_models(kind, fp32_model, int8_model, inputs)
+    size_ratio = os.path.getsize(fp32_path) / os.path.getsize(int8_path)
+    print(f"{kind}: {report}, size {size_ratio:.2f}x smaller")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=('img', 'txt', 'all'), default='all')
+    parser.add_argument('--mode', choices=('dynamic', 'static'), default='dynamic')
+    parser.add_argument('--calib-images', default='', help='校准和对比使用的图片目录，留空则使用随机生成的样本图片')
+    parser.add_argument('--calib-texts', default='', help='对比使用的搜索词文件，每行一个')
+    parser.add_argument('--calib-count', type=int, default=16)
+    parser.add_argument('--calib-method', choices=tuple(calibration_methods), default='minmax')
+    parser.add_argument('--per-channel', action='store_true')
+    parser.add_argument('--output-dir', default=clip.model_folder_path)
+    args = parser.parse_args()
+
+    for kind in (('img', 'txt') if args.model == 'all' else (args.model,)):
+        quantize(kind, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,18 @@
 from dotenv import load_dotenv
 import os
 import sys
+import gc
+import json
+import time
+import ctypes
 import threading
-from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Header
-from fastapi.responses import HTMLResponse
+import copy
+import importlib.metadata
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Header, Query
+from fastapi.responses import HTMLResponse, JSONResponse
 import uvicorn
 import numpy as np
 import cv2
@@ -11,6 +20,13 @@ import asyncio
 from pydantic import BaseModel
 from rapidocr_onnxruntime import RapidOCR
 import clip as clip
+from batcher import MicroBatcher
+from result_cache import LRUCache, SqliteStore, content_hash
+from embedding_format import JSON_FORMATS, negotiate_format, embedding_response
+from ocr_format import LAYOUTS, compact_result, ocr_layout
+from upload import ArchiveLimitError, upload_size, upload_buffer, image_dimensions, is_archive, read_archive
+import prefork
+from inference_pool import InferencePool
 
 
 # import onnxruntime as ort
@@ -24,52 +40,535 @@ app = FastAPI()
 api_auth_key = os.getenv("API_AUTH_KEY", "mt_photos_ai_extra")
 http_port = int(os.getenv("HTTP_PORT", "8060"))
 server_restart_time = int(os.getenv("SERVER_RESTART_TIME", "300"))
+env_idle_action = os.getenv("IDLE_ACTION", "restart") # 空闲 SERVER_RESTART_TIME 秒后的处理方式：restart 重启进程释放内存；unload 在进程内按各模型的空闲时间卸载模型
 # env_use_dml = os.getenv("MT_USE_DML", "on") == "on" # 是否启用dml加速，当使用onnxruntime-directml加速时，使用这行
 env_use_dml = False
 env_auto_load_txt_modal = os.getenv("AUTO_LOAD_TXT_MODAL", "off") == "on" # 是否自动加载CLIP文本模型，开启可以优化第一次搜索时的响应速度,文本模型占用700多m内存
+env_clip_batch_size = int(os.getenv("CLIP_BATCH_SIZE", "8")) # 并发的/clip/img请求合并推理的最大batch，设为1则逐张推理
+env_clip_batch_wait_ms = float(os.getenv("CLIP_BATCH_WAIT_MS", "5")) # 合并batch时等待后续请求的最长时间(毫秒)
+env_clip_batch_max_files = int(os.getenv("CLIP_BATCH_MAX_FILES", "64")) # /clip/img/batch 单次请求最多处理的图片数
+env_clip_txt_batch_max_texts = int(os.getenv("CLIP_TXT_BATCH_MAX_TEXTS", "1000")) # /clip/txt/batch 单次请求最多处理的文本数
+env_ocr_workers = int(os.getenv("OCR_WORKERS", "1")) # OCR推理线程数，OCR在独立线程池内执行，不阻塞CLIP等其他请求
+env_ocr_queue_size = int(os.getenv("OCR_QUEUE_SIZE", "8")) # 排队等待OCR的最大请求数，超出后直接返回503
+env_ocr_retry_after = int(os.getenv("OCR_RETRY_AFTER", "5")) # 返回503时建议客户端重试的等待秒数
+env_ocr_rec_batch_num = int(os.getenv("OCR_REC_BATCH_NUM", "6")) # 文字识别每批处理的文本行数，文本行很多的截图、文档可适当调大
+env_ocr_det_limit_side_len = int(os.getenv("OCR_DET_LIMIT_SIDE_LEN", "736")) # 文字检测时图片短边缩放到的尺寸，调小更快，小字可能漏检
+env_ocr_max_side_len = int(os.getenv("OCR_MAX_SIDE_LEN", "2000")) # 图片长边超过该值时先缩小再识别
+env_ocr_use_cls = os.getenv("OCR_USE_CLS", "on") == "on" # 是否使用文字方向分类模型，图片中很少有倒置文字时关闭可加快识别
+env_ocr_prefilter = os.getenv("OCR_PREFILTER", "off") == "on" # 先用低分辨率跑一次文字检测，检测不到文字的图片直接返回空结果，跳过完整OCR
+env_ocr_prefilter_size = int(os.getenv("OCR_PREFILTER_SIZE", "480")) # 预检测时图片长边缩小到的尺寸，调大可减少小字漏检，但预检测更慢
+env_ocr_prefilter_min_boxes = int(os.getenv("OCR_PREFILTER_MIN_BOXES", "1")) # 预检测到的文本框少于该数量时跳过OCR
+env_ocr_prefilter_box_thresh = float(os.getenv("OCR_PREFILTER_BOX_THRESH", "0.4")) # 预检测文本框的最低置信度，低分辨率下文字得分偏低，默认比完整检测的0.5略低
+env_ocr_threads = int(os.getenv("OCR_THREADS", "0")) # OCR模型的onnxruntime线程数，0为onnxruntime默认值(开启 THREAD_SPLIT 时自动分配)
+env_thread_split = os.getenv("THREAD_SPLIT", "off") == "on" # 按CPU核数给OCR和CLIP分配互不重叠的线程数，适合OCR和CLIP请求同时进行的场景
+env_txt_cache_mb = float(os.getenv("TXT_CACHE_MB", "16")) # /clip/txt 搜索词特征缓存的内存上限(MB)，设为0关闭缓存
+env_txt_cache_ttl = int(os.getenv("TXT_CACHE_TTL", "0")) # 搜索词特征缓存的过期时间(秒)，0为不过期
+env_txt_cache_disk = os.getenv("TXT_CACHE_DISK", "") # 搜索词特征缓存持久化的sqlite文件路径，设置后进程重启缓存不丢失，留空则只缓存在内存
+env_txt_cache_disk_mb = float(os.getenv("TXT_CACHE_DISK_MB", "64")) # 磁盘缓存的容量上限(MB)
+env_result_cache_mb = float(os.getenv("RESULT_CACHE_MB", "32")) # 按图片内容哈希缓存 /clip/img、/ocr 结果的内存上限(MB)，两类结果各占一半，重复图片直接返回缓存，设为0关闭
+env_result_cache_disk = os.getenv("RESULT_CACHE_DISK", "") # 图片结果缓存持久化的sqlite文件路径，留空则只缓存在内存
+env_result_cache_disk_mb = float(os.getenv("RESULT_CACHE_DISK_MB", "1024")) # 图片结果磁盘缓存的容量上限(MB)
+env_max_upload_mb = float(os.getenv("MAX_UPLOAD_MB", "100")) # 单个上传文件的大小上限(MB)，超过时在接收或解码前返回413，0为不限制
+env_workers = int(os.getenv("WORKERS", "1")) # 服务进程数，0为按CPU核数；大于1时(仅Linux)先加载模型再fork出多个进程，各进程共用模型内存，每个进程内推理只用1个线程
+env_worker_preload = os.getenv("WORKER_PRELOAD", "ocr,clip_img,clip_txt") # 多进程时在fork前加载、各进程共用的模型，未列出的模型由每个进程按需各自加载
+env_inference_processes = int(os.getenv("INFERENCE_PROCESSES", "0")) # /ocr、/clip/img 放到几个独立的推理进程中执行(仅Linux，WORKERS=1时)，0为在服务进程内推理
+env_shm_slots = int(os.getenv("SHM_SLOTS", "0")) # 向推理进程传递图片的共享内存槽位数，0为推理进程数的2倍
+env_shm_slot_mb = float(os.getenv("SHM_SLOT_MB", "16")) # 每个共享内存槽位的大小(MB)，更大的图片通过pickle传输，设为0则全部通过pickle传输
 
 rapid_ocr = None
+ocr_prefilter = None
 clip_img_model = None
 clip_txt_model = None
-restart_timer = None
+clip_load_locks = {'clip_img': threading.Lock(), 'clip_txt': threading.Lock()} # 模型在线程池内加载，并发请求只加载一次
+
+last_activity = time.monotonic() # 最后一次请求的时间，使用单调时钟
+active_requests = 0
+idle_handled = True # 启动后没有请求时不触发空闲处理，与原先收到请求才开始计时一致
+activity_event = asyncio.Event() # 请求开始和结束时设置，空闲检查在没有可处理的事情时等待它，不再周期性唤醒
+idle_watchdog_task = None
+
+# IDLE_ACTION=unload 时各模型独立的空闲卸载时间(秒)，设为0则不卸载该模型
+model_idle_time = {
+    'ocr': int(os.getenv("OCR_IDLE_TIME", str(server_restart_time))),
+    'clip_img': int(os.getenv("CLIP_IMG_IDLE_TIME", str(server_restart_time))),
+    'clip_txt': int(os.getenv("CLIP_TXT_IDLE_TIME", "0" if env_auto_load_txt_modal else str(server_restart_time))),
+}
+model_last_used = {name: time.monotonic() for name in model_idle_time}
+model_in_use = {name: 0 for name in model_idle_time}
+last_reclaim = None
+
+if env_workers != 1 and not on_linux:
+    print("WORKERS is only supported on Linux, running a single process")
+workers = prefork.worker_count(env_workers, clip.available_cpus()) if on_linux else 1
+worker_index = None # 多进程时当前worker的序号，主进程和单进程时为None
+
+if workers > 1:
+    # 由多个进程并行处理请求，每个onnxruntime会话只用1个线程，总推理线程数与进程数相当；单线程的会话没有线程池，fork后可以直接使用
+    ocr_threads, clip_threads = 1, 1
+    clip.env_ort_intra_threads = 1
+elif env_thread_split:
+    ocr_threads, clip_threads = clip.thread_split(env_ocr_threads)
+    print(f"thread split: ocr {ocr_threads}, clip {clip_threads}, cpus {clip.available_cpus()}")
+else:
+    ocr_threads, clip_threads = env_ocr_threads, 0
+
+if env_inference_processes > 0 and (workers > 1 or not on_linux):
+    print("INFERENCE_PROCESSES needs Linux and WORKERS=1, running inference in the server process")
+inference_processes = env_inference_processes if on_linux and workers == 1 else 0
+inference_threads = max(1, clip.available_cpus() // inference_processes) if inference_processes else 0 # 每个推理进程内的推理线程数
+inference_pool = None
+inference_pool_models = set() # 推理进程中使用过、可能已加载的模型，空闲卸载时通知推理进程释放
+
+ocr_executor = ThreadPoolExecutor(max_workers=env_ocr_workers, thread_name_prefix="ocr")
+ocr_pending = 0 # 正在执行和排队中的OCR请求数
+ocr_rejected = 0
+
+def process_image_batch(images):
+    return clip.process_images(images, clip_img_model)
+
+async def submit_inference(kind, data, **options):
+    with use_model(kind):
+        inference_pool_models.add(kind)
+        return await inference_pool.submit(kind, data, **options)
+
+async def pool_image_batch(images):
+    # 推理进程模式：在线程池内预处理为 (N,3,H,W) 的float32输入，经共享内存交给推理进程，推理进程只运行模型
+    loop = asyncio.get_running_loop()
+
+    async def run_chunk(chunk):
+        inputs = await loop.run_in_executor(None, clip.image_processor, chunk, clip.IMG_SIZE)
+        return await submit_inference('clip_img', inputs)
+
+    # /clip/img/batch 一次提交的大batch按 CLIP_BATCH_SIZE 拆分，由多个推理进程并行处理
+    size = env_clip_batch_size
+    chunks = await asyncio.gather(*(run_chunk(images[i:i + size]) for i in range(0, len(images), size)))
+    return [feature for chunk in chunks for feature in chunk]
+
+clip_img_batcher = MicroBatcher(process_image_batch, max_batch_size=env_clip_batch_size, max_wait_ms=env_clip_batch_wait_ms)
+
+def package_identity(name):
+    try:
+        return f"{name}-{importlib.metadata.version(name)}"
+    except importlib.metadata.PackageNotFoundError:
+        return name
+
+def embedding_to_bytes(vec):
+    return np.asarray(vec, dtype='<f4').tobytes()
+
+def embedding_from_bytes(raw):
+    return np.frombuffer(raw, dtype='<f4')
+
+def create_txt_cache():
+    if env_txt_cache_mb <= 0:
+        return None
+    disk = None
+    if env_txt_cache_disk:
+        disk = SqliteStore(env_txt_cache_disk, int(env_txt_cache_disk_mb * 1024 * 1024))
+    return LRUCache(int(env_txt_cache_mb * 1024 * 1024), embedding_to_bytes, embedding_from_bytes,
+                    ttl=env_txt_cache_ttl, disk=disk)
+
+txt_cache = create_txt_cache()
+
+def ocr_result_to_bytes(result):
+    return json.dumps(result, ensure_ascii=False).encode('utf-8')
+
+def ocr_result_from_bytes(raw):
+    return json.loads(raw)
+
+def create_result_caches():
+    if env_result_cache_mb <= 0:
+        return None, None
+    disk = None
+    if env_result_cache_disk:
+        disk = SqliteStore(env_result_cache_disk, int(env_result_cache_disk_mb * 1024 * 1024))
+    # 两类结果平分内存上限，共用一个sqlite文件，key带有各自的前缀
+    max_bytes = int(env_result_cache_mb * 1024 * 1024 / 2)
+    return (LRUCache(max_bytes, embedding_to_bytes, embedding_from_bytes, disk=disk),
+            LRUCache(max_bytes, ocr_result_to_bytes, ocr_result_from_bytes, disk=disk))
+
+img_cache, ocr_cache = create_result_caches()
+ocr_options = {
+    'rec_batch_num': env_ocr_rec_batch_num,
+    'det_limit_side_len': env_ocr_det_limit_side_len,
+    'max_side_len': env_ocr_max_side_len,
+    'use_cls': env_ocr_use_cls,
+}
+# 与RapidOCR默认值不同的参数会影响识别结果，拼接到缓存key中；rec_batch_num也会影响同一批文本行的补齐宽度
+ocr_default_options = {'rec_batch_num': 6, 'det_limit_side_len': 736, 'max_side_len': 2000, 'use_cls': True}
+ocr_model_id = package_identity("rapidocr_onnxruntime") + "".join(f":{k}={v}" for k, v in ocr_options.items() if v != ocr_default_options[k])
+if env_ocr_prefilter:
+    # 预检测跳过的图片返回空结果，参数不同时缓存不能共用
+    ocr_model_id += f":prefilter={env_ocr_prefilter_size},{env_ocr_prefilter_min_boxes},{env_ocr_prefilter_box_thresh}"
+ocr_stage_ms = {'det': 0.0, 'cls': 0.0, 'rec': 0.0} # OCR各阶段的累计耗时
+ocr_processed = 0
+ocr_prefilter_skipped = 0 # 预检测判定没有文字而跳过的图片数
+ocr_prefilter_passed = 0 # 预检测通过、继续完整OCR的图片数
+ocr_prefilter_ms = 0.0 # 预检测的累计耗时
+
+async def image_cache_key(prefix, model_id, image_bytes):
+    if model_id is None:
+        return None
+    if len(image_bytes) > 1024 * 1024:
+        # 大文件的哈希放到线程池计算，避免阻塞事件循环
+        digest = await asyncio.get_running_loop().run_in_executor(None, content_hash, image_bytes)
+    else:
+        digest = content_hash(image_bytes)
+    return f"{prefix}|{model_id}|{digest}"
+
+def txt_cache_key(text, model_id):
+    # 分词时会统一转小写并按空白切分，这里做同样的归一化，不影响特征结果
+    return f"{model_id}|{' '.join(text.split()).lower()}"
 
 class ClipTxtRequest(BaseModel):
     text: str
 
+class ClipTxtBatchRequest(BaseModel):
+    texts: List[str]
+
+def create_ocr_prefilter(engine):
+    # 复制一份文字检测器，共用推理会话，只修改缩放方式和文本框阈值，不影响完整OCR使用的检测器
+    try:
+        detector = copy.copy(engine.text_det)
+        detector.postprocess_op = copy.copy(detector.postprocess_op)
+        detector.postprocess_op.box_thresh = env_ocr_prefilter_box_thresh
+        # 图片已提前缩小到 OCR_PREFILTER_SIZE，这里只保证短边不小于32，不再放大
+        detector.limit_type = 'min'
+        detector.limit_side_len = 32
+        return detector
+    except Exception as e:
+        print(f"ocr prefilter disabled: {e}")
+        return None
+
 def load_ocr_model():
-    global rapid_ocr
+    global rapid_ocr, ocr_prefilter
     if rapid_ocr is None:
-        rapid_ocr = RapidOCR(rec_use_dml=env_use_dml , det_use_dml=env_use_dml)
+        options = dict(ocr_options)
+        if ocr_threads > 0:
+            options['intra_op_num_threads'] = ocr_threads
+        rapid_ocr = RapidOCR(rec_use_dml=env_use_dml , det_use_dml=env_use_dml, **options)
+        if env_ocr_prefilter:
+            ocr_prefilter = create_ocr_prefilter(rapid_ocr)
 
 def load_clip_img_model():
     global clip_img_model
     if clip_img_model is None:
-        clip_img_model = clip.load_img_model(use_dml=env_use_dml)
+        with clip_load_locks['clip_img']:
+            if clip_img_model is None:
+                clip_img_model = clip.load_img_model(use_dml=env_use_dml, intra_threads=clip_threads)
 
 def load_clip_txt_model():
     global clip_txt_model
     if clip_txt_model is None:
-        clip_txt_model = clip.load_txt_model(use_dml=env_use_dml)
+        with clip_load_locks['clip_txt']:
+            if clip_txt_model is None:
+                clip_txt_model = clip.load_txt_model(use_dml=env_use_dml, intra_threads=clip_threads)
+
+async def ensure_clip_model(name):
+    # 首次加载（开启INT8时包括与fp32的对比检查）耗时较长，放到线程池执行，不阻塞事件循环
+    if name == 'clip_img' and clip_img_model is None:
+        await asyncio.get_running_loop().run_in_executor(None, load_clip_img_model)
+    elif name == 'clip_txt' and clip_txt_model is None:
+        await asyncio.get_running_loop().run_in_executor(None, load_clip_txt_model)
+
+async def clip_txt_model_id():
+    # 开启INT8时，与fp32对比检查后才能确定实际使用的模型，缓存key按实际加载的模型文件生成；
+    # 加载和检查在线程池内执行，完成前事件循环继续处理其他请求
+    path = clip.loaded_model_path(clip.txt_onnx_model_path, clip.txt_int8_model_path)
+    if path is None:
+        with use_model('clip_txt'):
+            await ensure_clip_model('clip_txt')
+        path = clip.loaded_model_path(clip.txt_onnx_model_path, clip.txt_int8_model_path)
+    return clip.model_identity(path) + clip.txt_identity()
+
+async def clip_img_model_id():
+    path = clip.loaded_model_path(clip.img_onnx_model_path, clip.img_int8_model_path)
+    if path is None:
+        if inference_pool is not None:
+            # 推理进程内加载模型时才做检查，检查结果返回前不使用缓存
+            return None
+        with use_model('clip_img'):
+            await ensure_clip_model('clip_img')
+        path = clip.loaded_model_path(clip.img_onnx_model_path, clip.img_int8_model_path)
+    return clip.model_identity(path) + clip.preprocess_identity()
+
+def preload_models():
+    loaders = {'ocr': load_ocr_model, 'clip_img': load_clip_img_model, 'clip_txt': load_clip_txt_model}
+    for name in env_worker_preload.split(','):
+        if name.strip() in loaders:
+            loaders[name.strip()]()
+
+def start_inference_process(index):
+    # 在推理进程内执行：不使用fork前服务进程中创建的会话，按需重新加载，线程数按推理进程数平分CPU
+    global ocr_threads, clip_threads
+    for name in model_idle_time:
+        unload_model(name)
+    take_inference_stats() # 丢弃从服务进程继承的统计，避免重复计数
+    ocr_threads, clip_threads = inference_threads, inference_threads
+    cv2.setNumThreads(inference_threads)
+
+def run_inference_task(kind, data, options):
+    # data 为共享内存槽位的视图，返回前不能保留对它的引用
+    # ocr 传入上传图片的原始字节，解码后的原图约为JPEG的10倍大小，在推理进程内解码；clip_img 传入预处理好的batch
+    if kind == 'unload':
+        # 服务进程空闲卸载模型时通知所有推理进程，data 为None
+        for name in options['names']:
+            unload_model(name)
+        gc.collect()
+        malloc_trim()
+        return None
+    if kind == 'ocr':
+        load_ocr_model()
+        return ocr_image(data, options['use_cls'], options['max_side_len'])
+    load_clip_img_model()
+    return clip.run_img_model(clip_img_model, data)
+
+def take_inference_stats():
+    # 在推理进程内执行：取出上次回复以来的OCR统计并清零，INT8检查结果一起返回，由服务进程汇总到 /status
+    global ocr_processed, ocr_prefilter_skipped, ocr_prefilter_passed, ocr_prefilter_ms
+    stats = {
+        'ocr_processed': ocr_processed,
+        'ocr_stage_ms': dict(ocr_stage_ms),
+        'ocr_prefilter_skipped': ocr_prefilter_skipped,
+        'ocr_prefilter_passed': ocr_prefilter_passed,
+        'ocr_prefilter_ms': ocr_prefilter_ms,
+        'clip_quantized': clip.quantized_checks,
+    }
+    ocr_processed = ocr_prefilter_skipped = ocr_prefilter_passed = 0
+    ocr_prefilter_ms = 0.0
+    for stage in ocr_stage_ms:
+        ocr_stage_ms[stage] = 0.0
+    return stats
+
+def add_inference_stats(stats):
+    global ocr_processed, ocr_prefilter_skipped, ocr_prefilter_passed, ocr_prefilter_ms
+    ocr_processed += stats['ocr_processed']
+    for stage, ms in stats['ocr_stage_ms'].items():
+        ocr_stage_ms[stage] += ms
+    ocr_prefilter_skipped += stats['ocr_prefilter_skipped']
+    ocr_prefilter_passed += stats['ocr_prefilter_passed']
+    ocr_prefilter_ms += stats['ocr_prefilter_ms']
+    clip.quantized_checks.update(stats['clip_quantized'])
+
+def start_worker(index):
+    # fork后在worker进程内执行：sqlite连接不能跨进程使用，需要重新打开
+    global worker_index
+    worker_index = index
+    cv2.setNumThreads(1)
+    for cache in (txt_cache, img_cache, ocr_cache):
+        if cache is not None:
+            cache.after_fork()
 
 
 @app.on_event("startup")
 async def startup_event():
+    global idle_watchdog_task, inference_pool, clip_img_batcher
+    if inference_processes > 0:
+        # 在其他线程启动前fork推理进程
+        slots = env_shm_slots or inference_processes * 2
+        inference_pool = InferencePool(inference_processes, run_inference_task, start_inference_process,
+                                       slots=slots if env_shm_slot_mb > 0 else 0, slot_size=int(env_shm_slot_mb * 1024 * 1024),
+                                       collect_stats=take_inference_stats, merge_stats=add_inference_stats)
+        inference_pool.start()
+        print(f"inference processes: {inference_processes}, threads {inference_threads}, shm {inference_pool.ring.stats() if inference_pool.ring else None}")
+        # 每个推理进程同时执行一个batch，推理进程都在忙时到达的请求合并到下一个batch
+        clip_img_batcher = MicroBatcher(pool_image_batch, max_batch_size=env_clip_batch_size,
+                                        max_wait_ms=env_clip_batch_wait_ms, concurrency=inference_processes)
     if env_auto_load_txt_modal:
         load_clip_txt_model()
+    if workers > 1:
+        # 多进程时模型由主进程加载、各进程共用，卸载或重启单个worker不能释放内存，不做空闲处理
+        return
+    idle_watchdog_task = asyncio.create_task(idle_watchdog())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if idle_watchdog_task and not idle_watchdog_task.done():
+        idle_watchdog_task.cancel()
+    if inference_pool is not None:
+        inference_pool.close()
+
+
+# 单文件上传的接口，按请求头的Content-Length提前拒绝过大的上传
+upload_paths = ("/ocr", "/clip/img", "/analyze")
+upload_form_overhead = 64 * 1024 # multipart表单中文件以外的部分(边界、字段头、其他参数)的大小余量
+
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    # 此时请求体还未接收，直接返回413，不再解析表单和写入临时文件
+    if env_max_upload_mb > 0 and request.url.path in upload_paths:
+        length = request.headers.get("content-length", "")
+        if length.isdigit() and int(length) > env_max_upload_mb * 1024 * 1024 + upload_form_overhead:
+            return JSONResponse(status_code=413, content={'detail': f"File too large, max {env_max_upload_mb:g}MB"})
+    return await call_next(request)
+
+
+# 这些接口用于探活和监控，不计入活动时间，避免监控轮询导致模型一直无法释放
+idle_exempt_paths = ("/", "/status")
 
 
 @app.middleware("http")
 async def check_activity(request, call_next):
-    global restart_timer
+    global last_activity, active_requests, idle_handled
+    if request.url.path in idle_exempt_paths:
+        return await call_next(request)
+
+    last_activity = time.monotonic()
+    idle_handled = False
+    active_requests += 1
+    activity_event.set()
+    try:
+        return await call_next(request)
+    finally:
+        active_requests -= 1
+        last_activity = time.monotonic()
+        activity_event.set()
+
 
-    if restart_timer:
-        restart_timer.cancel()
+@contextmanager
+def use_model(name):
+    # 标记模型正在使用，使用中的模型不会被卸载
+    model_in_use[name] += 1
+    model_last_used[name] = time.monotonic()
+    try:
+        yield
+    finally:
+        model_in_use[name] -= 1
+        model_last_used[name] = time.monotonic()
 
-    restart_timer = threading.Timer(server_restart_time, restart_program)
-    restart_timer.start()
 
-    response = await call_next(request)
-    return response
+async def wait_for_activity(timeout=None):
+    # 状态检查与 clear 之间没有await，不会漏掉检查之后到达的请求
+    activity_event.clear()
+    try:
+        await asyncio.wait_for(activity_event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def idle_watchdog():
+    # 单个常驻任务检查空闲时间，取代每个请求重新创建 threading.Timer
+    while True:
+        if env_idle_action == "unload":
+            # 没有等待卸载的模型时一直等到下一个请求
+            await wait_for_activity(reclaim_idle_models())
+            continue
+        if idle_handled or active_requests > 0:
+            # 已处理过空闲或请求进行中，等请求开始或结束后再计时
+            await wait_for_activity()
+            continue
+        remaining = server_restart_time - (time.monotonic() - last_activity)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+            continue
+        on_idle()
+
+
+def on_idle():
+    global idle_handled
+    idle_handled = True
+    restart_program()
+
+
+def loaded_models():
+    models = {'ocr': rapid_ocr, 'clip_img': clip_img_model, 'clip_txt': clip_txt_model}
+    # 推理进程模式下模型加载在推理进程中，服务进程内为None，用过的模型同样按空闲时间卸载
+    for name in inference_pool_models:
+        if models[name] is None:
+            models[name] = inference_pool
+    return models
+
+
+def reclaim_idle_models():
+    """卸载空闲超时的模型，返回距离下次检查的秒数，没有等待卸载的模型时返回None"""
+    now = time.monotonic()
+    idle_models = []
+    next_check = None
+    for name, model in loaded_models().items():
+        # 使用中的模型在请求结束时会重新检查
+        if model is None or model_idle_time[name] <= 0 or model_in_use[name] > 0:
+            continue
+        remaining = model_idle_time[name] - (now - model_last_used[name])
+        if remaining <= 0:
+            idle_models.append(name)
+        else:
+            next_check = remaining if next_check is None else min(next_check, remaining)
+    if idle_models:
+        reclaim_memory(idle_models)
+    return None if next_check is None else max(1.0, next_check)
+
+
+def unload_model(name):
+    global rapid_ocr, ocr_prefilter, clip_img_model, clip_txt_model
+    if name == 'ocr':
+        rapid_ocr = None
+        ocr_prefilter = None
+    elif name == 'clip_img':
+        clip_img_model = None
+    elif name == 'clip_txt':
+        clip_txt_model = None
+
+
+def get_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def malloc_trim():
+    # 把glibc中已释放的内存归还给系统，否则卸载模型后RSS不会明显下降
+    if not on_linux:
+        return
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def reclaim_memory(names):
+    global last_reclaim
+    rss_before = get_rss_mb()
+    for name in names:
+        unload_model(name)
+    pool_names = [name for name in names if name in inference_pool_models]
+    if pool_names:
+        inference_pool.notify('unload', names=pool_names)
+        inference_pool_models.difference_update(pool_names)
+    gc.collect()
+    malloc_trim()
+    rss_after = get_rss_mb()
+    print(f"reclaim_memory: {', '.join(names)} rss {rss_before}MB -> {rss_after}MB")
+    last_reclaim = {
+        'models': names,
+        'rss_before_mb': rss_before,
+        'rss_after_mb': rss_after,
+        'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def idle_status():
+    now = time.monotonic()
+    idle_seconds = now - last_activity
+    return {
+        'action': env_idle_action,
+        'timeout': server_restart_time,
+        'active_requests': active_requests,
+        'idle_seconds': round(idle_seconds, 3),
+        'last_activity': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() - idle_seconds)),
+        'rss_mb': get_rss_mb(),
+        'models': {
+            name: {
+                'loaded': model is not None,
+                'in_use': model_in_use[name],
+                'idle_seconds': round(now - model_last_used[name], 3),
+                'idle_time': model_idle_time[name],
+            } for name, model in loaded_models().items()
+        },
+        'last_reclaim': last_reclaim,
+    }
 
 
 async def verify_header(api_key: str = Header(...)):
@@ -79,29 +578,27 @@ async def verify_header(api_key: str = Header(...)):
     return api_key
 
 
-def to_fixed(num):
-    return str(round(num, 2))
+def trans_result(result, scale=1.0):
+    # 识别结果先统一转换为 compact 格式，缓存也保存该格式，返回前再按请求的 layout 转换
+    if not result:
+        return compact_result(None, None, None)
+    boxes, texts, scores = zip(*result)
+    return compact_result(boxes, texts, scores, scale)
 
+def check_layout(layout):
+    if layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported layout, available: {', '.join(LAYOUTS)}")
 
-def trans_result(result):
-    texts = []
-    scores = []
-    boxes = []
-    if result is None:
-        return {'texts': texts, 'scores': scores, 'boxes': boxes}
-    for res_i in result:
-        dt_box = res_i[0]
-        box = {
-            'x': to_fixed(dt_box[0][0]),
-            'y': to_fixed(dt_box[0][1]),
-            'width': to_fixed(dt_box[1][0] - dt_box[0][0]),
-            'height': to_fixed(dt_box[2][1] - dt_box[0][1])
-        }
-        boxes.append(box)
-        texts.append(res_i[1])
-        scores.append(f"{res_i[2]:.2f}")
-    return {'texts': texts, 'scores': scores, 'boxes': boxes}
 
+def check_upload(file):
+    # 表单解析后、读取和解码前检查文件大小，覆盖没有Content-Length的分块上传
+    if env_max_upload_mb > 0 and upload_size(file) > env_max_upload_mb * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"File too large, max {env_max_upload_mb:g}MB")
+
+def ocr_size_out_of_range(file):
+    # 只解析图片头部的宽高，超出范围的图片不再解码；无法识别的格式交给解码后的检查
+    size = image_dimensions(file)
+    return size is not None and max(size) > 10000
 
 @app.get("/", response_class=HTMLResponse)
 async def top_info():
@@ -131,6 +628,40 @@ async def check_req(api_key: str = Depends(verify_header)):
     }
 
 
+@app.post("/status")
+async def status_req(api_key: str = Depends(verify_header)):
+    return {
+        'result': 'pass',
+        'idle': idle_status(),
+        'worker': {'workers': workers, 'index': worker_index, 'pid': os.getpid(), 'preload': env_worker_preload if workers > 1 else ''},
+        'clip_img_batcher': clip_img_batcher.stats(),
+        'inference_pool': inference_pool.stats() if inference_pool is not None else None,
+        'txt_cache': txt_cache.stats() if txt_cache is not None else None,
+        'img_cache': img_cache.stats() if img_cache is not None else None,
+        'ocr_cache': ocr_cache.stats() if ocr_cache is not None else None,
+        'ocr': {
+            'workers': env_ocr_workers,
+            'queue_size': env_ocr_queue_size,
+            'pending': ocr_pending,
+            'rejected': ocr_rejected,
+            'options': ocr_options,
+            'processed': ocr_processed,
+            'stage_ms': {k: round(v, 1) for k, v in ocr_stage_ms.items()},
+            'avg_stage_ms': {k: round(v / ocr_processed, 2) if ocr_processed else 0.0 for k, v in ocr_stage_ms.items()},
+            'prefilter': {
+                'enabled': env_ocr_prefilter,
+                'size': env_ocr_prefilter_size,
+                'min_boxes': env_ocr_prefilter_min_boxes,
+                'box_thresh': env_ocr_prefilter_box_thresh,
+                'skipped': ocr_prefilter_skipped,
+                'passed': ocr_prefilter_passed,
+                'avg_ms': round(ocr_prefilter_ms / (ocr_prefilter_skipped + ocr_prefilter_passed), 2) if ocr_prefilter_skipped + ocr_prefilter_passed else 0.0,
+            },
+        },
+        'clip_quantized': list(clip.quantized_checks.values()),
+    }
+
+
 @app.post("/restart")
 async def check_req(api_key: str = Depends(verify_header)):
     # 客户端可调用，触发重启进程来释放内存，OCR过程中会触发这个请求；新版本OCR内存增长正常了，此方法不执行
@@ -143,53 +674,370 @@ async def check_req(api_key: str = Depends(verify_header)):
     restart_program()
     return {'result': 'pass'}
 
+def record_ocr_elapse(elapse):
+    global ocr_processed
+    ocr_processed += 1
+    if elapse and len(elapse) == 3:
+        for stage, seconds in zip(('det', 'cls', 'rec'), elapse):
+            ocr_stage_ms[stage] += seconds * 1000
+
+def has_text(img):
+    """在缩小后的图片上运行文字检测，检测到的文本框少于 OCR_PREFILTER_MIN_BOXES 时返回False"""
+    global ocr_prefilter_skipped, ocr_prefilter_passed, ocr_prefilter_ms
+    start = time.perf_counter()
+    height, width = img.shape[:2]
+    scale = env_ocr_prefilter_size / max(height, width)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    boxes, _ = ocr_prefilter(img)
+    found = boxes is not None and len(boxes) >= env_ocr_prefilter_min_boxes
+    ocr_prefilter_ms += (time.perf_counter() - start) * 1000
+    if found:
+        ocr_prefilter_passed += 1
+    else:
+        ocr_prefilter_skipped += 1
+    return found
+
+def ocr_image(image_bytes, use_cls=None, max_side_len=0):
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    return ocr_decoded_image(img, use_cls, max_side_len)
+
+def ocr_decoded_image(img, use_cls=None, max_side_len=0):
+    height, width, _ = img.shape
+    if width > 10000 or height > 10000:
+        return {'result': [], 'msg': 'height or width out of range'}
+    if ocr_prefilter is not None and not has_text(img):
+        return {'result': trans_result(None)}
+    scale = 1.0
+    if max_side_len and max(height, width) > max_side_len:
+        # 按请求参数先缩小图片，识别结果的坐标再换算回原图
+        scale = max(height, width) / max_side_len
+        img = cv2.resize(img, (max(1, round(width / scale)), max(1, round(height / scale))), interpolation=cv2.INTER_AREA)
+    _result = rapid_ocr(img, use_cls=use_cls)
+    record_ocr_elapse(_result[1])
+    result = trans_result(_result[0], scale)
+    del img
+    del _result
+    return {'result': result}
+
+def normalize_ocr_params(use_cls, max_side_len):
+    # 与全局设置相同的请求参数按默认处理，共用同一份缓存
+    if max_side_len is not None and max_side_len >= env_ocr_max_side_len:
+        max_side_len = None # 不小于全局设置时与默认处理一致
+    if use_cls == env_ocr_use_cls:
+        use_cls = None
+    return use_cls, max_side_len
+
+async def ocr_cache_key(image_bytes, use_cls, max_side_len):
+    model_id = ocr_model_id
+    if use_cls is not None or max_side_len is not None:
+        model_id += f"|use_cls={use_cls},max_side_len={max_side_len}"
+    return await image_cache_key('ocr', model_id, image_bytes)
+
+@contextmanager
+def ocr_slot():
+    # 占用一个OCR排队名额，排队已满时直接返回503
+    global ocr_pending, ocr_rejected
+    if ocr_pending >= (inference_processes or env_ocr_workers) + env_ocr_queue_size:
+        ocr_rejected += 1
+        raise HTTPException(status_code=503, detail="OCR queue is full", headers={"Retry-After": str(env_ocr_retry_after)})
+    ocr_pending += 1
+    try:
+        yield
+    finally:
+        ocr_pending -= 1
+
 @app.post("/ocr")
-async def process_image(file: UploadFile = File(...), api_key: str = Depends(verify_header)):
-    load_ocr_model()
-    image_bytes = await file.read()
+async def process_image(file: UploadFile = File(...), use_cls: Optional[bool] = Query(None),
+                        max_side_len: Optional[int] = Query(None, gt=0), layout: str = Query(LAYOUTS[0]),
+                        api_key: str = Depends(verify_header)):
+    check_layout(layout)
+    check_upload(file)
+    if ocr_size_out_of_range(file):
+        return {'result': [], 'msg': 'height or width out of range'}
+    # 直接使用表单解析时保存的内容(内存缓冲区或临时文件的内存映射)，不再读取复制一份
+    image_bytes = upload_buffer(file)
+    use_cls, max_side_len = normalize_ocr_params(use_cls, max_side_len)
+    cache_key = None
+    if ocr_cache is not None:
+        cache_key = await ocr_cache_key(image_bytes, use_cls, max_side_len)
+        cached = await ocr_cache.aget(cache_key)
+        if cached is not None:
+            return {'result': ocr_layout(cached, layout)}
+    with ocr_slot():
+        try:
+            if inference_pool is not None:
+                response = await submit_inference('ocr', image_bytes, use_cls=use_cls, max_side_len=max_side_len)
+            else:
+                with use_model('ocr'):
+                    load_ocr_model()
+                    # 解码和识别都放到OCR线程池，避免大图阻塞事件循环
+                    response = await asyncio.get_running_loop().run_in_executor(ocr_executor, ocr_image, image_bytes, use_cls, max_side_len)
+            if cache_key is not None and 'msg' not in response:
+                ocr_cache.put(cache_key, response['result'])
+            response['result'] = ocr_layout(response['result'], layout)
+            return response
+        except Exception as e:
+            print(e)
+            return {'result': [], 'msg': str(e)}
+
+@app.post("/clip/img")
+async def clip_process_image(file: UploadFile = File(...), fmt: Optional[str] = Query(None, alias="format"),
+                             accept: Optional[str] = Header(None), api_key: str = Depends(verify_header)):
+    response_format = negotiate_format(fmt, accept)
+    check_upload(file)
+    image_bytes = upload_buffer(file)
+    cache_key = None
+    if img_cache is not None:
+        cache_key = await image_cache_key('clip_img', await clip_img_model_id(), image_bytes)
+        cached = await img_cache.aget(cache_key) if cache_key is not None else None
+        if cached is not None:
+            return embedding_response(cached, response_format)
+    with use_model('clip_img'):
+        try:
+            if inference_pool is None:
+                await ensure_clip_model('clip_img')
+            # 解码放到线程池，并发请求同时解码后进入batcher合并，不阻塞事件循环
+            img = await asyncio.get_running_loop().run_in_executor(None, clip.decode_image, image_bytes, clip.IMG_SIZE)
+            if img is None:
+                # 解码失败的图片不进入batch，避免影响同一batch内的其他请求
+                return {'result': [], 'msg': 'image decode failed'}
+            result = await clip_img_batcher.submit(img)
+        except Exception as e:
+            print(e)
+            return {'result': [], 'msg': str(e)}
+    if cache_key is not None:
+        img_cache.put(cache_key, np.asarray(result, dtype=np.float32))
+    return embedding_response(result, response_format)
+
+@app.post("/clip/img/batch")
+async def clip_process_image_batch(files: List[UploadFile] = File(...), fmt: Optional[str] = Query(None, alias="format"),
+                                   api_key: str = Depends(verify_header)):
+    # 每张图片的结果与单独调用 /clip/img 相同，共用图片结果缓存；多个特征放在一个json里返回，只支持 JSON_FORMATS
+    response_format = negotiate_format(fmt)
+    if response_format not in JSON_FORMATS:
+        raise HTTPException(status_code=406, detail=f"Unsupported format, available: {', '.join(JSON_FORMATS)}")
+    loop = asyncio.get_running_loop()
+    items = []
+    for file in files:
+        check_upload(file)
+        if is_archive(file.filename):
+            try:
+                # 先检查包内的文件数和声明的大小，解压后的总大小不超过 MAX_UPLOAD_MB
+                items.extend(await loop.run_in_executor(None, read_archive, file.file, env_clip_batch_max_files - len(items),
+                                                        int(env_max_upload_mb * 1024 * 1024)))
+            except ArchiveLimitError as e:
+                return {'result': [], 'msg': str(e)}
+            except Exception as e:
+                print(e)
+                items.append((file.filename, None))
+        else:
+            items.append((file.filename, upload_buffer(file)))
+        if len(items) > env_clip_batch_max_files:
+            return {'result': [], 'msg': f'too many files, max {env_clip_batch_max_files}'}
+
+    results = [{'name': name, 'result': [], 'msg': 'image decode failed'} for name, _ in items]
+    cache_keys = [None] * len(items)
+    pending = []
+    model_id = await clip_img_model_id() if img_cache is not None else None
+    for i, (name, data) in enumerate(items):
+        if not data:
+            continue
+        if img_cache is not None:
+            cache_keys[i] = await image_cache_key('clip_img', model_id, data)
+            cached = await img_cache.aget(cache_keys[i]) if cache_keys[i] is not None else None
+            if cached is not None:
+                results[i] = {'name': name, **embedding_response(cached, response_format)}
+                continue
+        pending.append(i)
+    if not pending:
+        return {'result': results}
+    with use_model('clip_img'):
+        if inference_pool is None:
+            await ensure_clip_model('clip_img')
+        # 解码放到线程池，避免多张大图阻塞事件循环
+        decoded = await loop.run_in_executor(None, decode_images, [items[i][1] for i in pending])
+        indexes = [i for i, img in zip(pending, decoded) if img is not None]
+        images = [img for img in decoded if img is not None]
+        del decoded
+        if images:
+            try:
+                features = await clip_img_batcher.run(images)
+            except Exception as e:
+                print(e)
+                for i in indexes:
+                    results[i] = {'name': items[i][0], 'result': [], 'msg': str(e)}
+                return {'result': results}
+            for i, feature in zip(indexes, features):
+                results[i] = {'name': items[i][0], **embedding_response(feature, response_format)}
+                if cache_keys[i] is not None:
+                    img_cache.put(cache_keys[i], np.asarray(feature, dtype=np.float32))
+    return {'result': results}
+
+@app.post("/clip/txt")
+async def clip_process_txt(request:ClipTxtRequest, fmt: Optional[str] = Query(None, alias="format"),
+                           accept: Optional[str] = Header(None), api_key: str = Depends(verify_header)):
+    response_format = negotiate_format(fmt, accept)
+    cache_key = txt_cache_key(request.text, await clip_txt_model_id())
+    result = await txt_cache.aget(cache_key) if txt_cache is not None else None
+    if result is None:
+        with use_model('clip_txt'):
+            await ensure_clip_model('clip_txt')
+            text = request.text
+            result = await predict(clip.process_txt, text, clip_txt_model)
+        if txt_cache is not None:
+            txt_cache.put(cache_key, np.asarray(result, dtype=np.float32))
+    return embedding_response(result, response_format)
+
+@app.post("/clip/txt/batch")
+async def clip_process_txt_batch(request: ClipTxtBatchRequest, api_key: str = Depends(verify_header)):
+    texts = request.texts
+    if len(texts) > env_clip_txt_batch_max_texts:
+        return {'result': [], 'msg': f'too many texts, max {env_clip_txt_batch_max_texts}'}
+    results = [None] * len(texts)
+    # 相同的文本只计算一次，已缓存的文本直接使用缓存
+    pending = {}
+    model_id = await clip_txt_model_id()
+    for i, text in enumerate(texts):
+        cache_key = txt_cache_key(text, model_id)
+        cached = await txt_cache.aget(cache_key) if txt_cache is not None else None
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.setdefault(cache_key, []).append(i)
+    if pending:
+        with use_model('clip_txt'):
+            await ensure_clip_model('clip_txt')
+            try:
+                features = await predict(clip.process_txts, [texts[indexes[0]] for indexes in pending.values()], clip_txt_model)
+            except Exception as e:
+                print(e)
+                return {'result': [], 'msg': str(e)}
+        for (cache_key, indexes), feature in zip(pending.items(), features):
+            for i in indexes:
+                results[i] = feature
+            if txt_cache is not None:
+                txt_cache.put(cache_key, np.asarray(feature, dtype=np.float32))
+    return {'result': [["{:.16f}".format(vec) for vec in feature] for feature in results]}
+
+ANALYZE_TASKS = ('ocr', 'clip')
+ANALYZE_FORMATS = ('json', 'b64', 'b64_f16') # 特征与OCR结果一起放在json里返回，不支持原始字节格式
+
+async def analyze_ocr(img, use_cls, max_side_len, cache_key, layout):
     try:
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        height, width, _ = img.shape
-        if width > 10000 or height > 10000:
-            return {'result': [], 'msg': 'height or width out of range'}
-        _result = rapid_ocr(img)
-        result = trans_result(_result[0])
-        del img
-        del _result
-        return {'result': result}
+        with use_model('ocr'):
+            load_ocr_model()
+            response = await asyncio.get_running_loop().run_in_executor(ocr_executor, ocr_decoded_image, img, use_cls, max_side_len)
     except Exception as e:
         print(e)
         return {'result': [], 'msg': str(e)}
+    if cache_key is not None and 'msg' not in response:
+        ocr_cache.put(cache_key, response['result'])
+    response['result'] = ocr_layout(response['result'], layout)
+    return response
 
-@app.post("/clip/img")
-async def clip_process_image(file: UploadFile = File(...), api_key: str = Depends(verify_header)):
-    load_clip_img_model()
-    image_bytes = await file.read()
+async def analyze_clip(img, cache_key, response_format):
     try:
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        result = await predict(clip.process_image, img, clip_img_model)
-        return {'result': ["{:.16f}".format(vec) for vec in result]}
+        with use_model('clip_img'):
+            if inference_pool is None:
+                await ensure_clip_model('clip_img')
+            result = await clip_img_batcher.submit(img)
     except Exception as e:
         print(e)
         return {'result': [], 'msg': str(e)}
+    if cache_key is not None:
+        img_cache.put(cache_key, np.asarray(result, dtype=np.float32))
+    return embedding_response(result, response_format)
 
-@app.post("/clip/txt")
-async def clip_process_txt(request:ClipTxtRequest, api_key: str = Depends(verify_header)):
-    load_clip_txt_model()
-    text = request.text
-    result = await predict(clip.process_txt, text, clip_txt_model)
-    return {'result': ["{:.16f}".format(vec) for vec in result]}
+def decode_images(items):
+    # 解码失败的图片返回None
+    return [clip.decode_image(data, clip.IMG_SIZE) for data in items]
+
+def decode_analyze_image(image_bytes, full_size):
+    if full_size:
+        return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    return clip.decode_image(image_bytes, clip.IMG_SIZE)
+
+@app.post("/analyze")
+async def analyze_image(file: UploadFile = File(...), tasks: str = Query(",".join(ANALYZE_TASKS)),
+                        use_cls: Optional[bool] = Query(None), max_side_len: Optional[int] = Query(None, gt=0),
+                        layout: str = Query(LAYOUTS[0]), fmt: Optional[str] = Query(None, alias="format"),
+                        api_key: str = Depends(verify_header)):
+    # 一次上传同时完成OCR和CLIP图片特征，图片只解码一次，两个模型并发推理；每项结果与单独调用 /ocr、/clip/img 时相同
+    task_list = [task for task in dict.fromkeys(t.strip() for t in tasks.split(',')) if task]
+    if not task_list or any(task not in ANALYZE_TASKS for task in task_list):
+        raise HTTPException(status_code=400, detail=f"Unsupported tasks, available: {', '.join(ANALYZE_TASKS)}")
+    response_format = negotiate_format(fmt)
+    if response_format not in ANALYZE_FORMATS:
+        raise HTTPException(status_code=406, detail=f"Unsupported format, available: {', '.join(ANALYZE_FORMATS)}")
+    check_layout(layout)
+    check_upload(file)
+    image_bytes = upload_buffer(file)
+    use_cls, max_side_len = normalize_ocr_params(use_cls, max_side_len)
+
+    results = {}
+    ocr_key = clip_key = None
+    if 'ocr' in task_list and ocr_cache is not None:
+        ocr_key = await ocr_cache_key(image_bytes, use_cls, max_side_len)
+        cached = await ocr_cache.aget(ocr_key)
+        if cached is not None:
+            results['ocr'] = {'result': ocr_layout(cached, layout)}
+    # OCR需要原图尺寸解码，此时CLIP也使用原图，开启 CLIP_JPEG_REDUCED 时结果与缩小解码略有差异，单独缓存
+    full_size = 'ocr' in task_list and 'ocr' not in results
+    if 'clip' in task_list and img_cache is not None:
+        model_id = await clip_img_model_id()
+        if model_id is not None and full_size and clip.env_jpeg_reduced:
+            model_id += "|full_decode"
+        clip_key = await image_cache_key('clip_img', model_id, image_bytes)
+        cached = await img_cache.aget(clip_key) if clip_key is not None else None
+        if cached is not None:
+            results['clip'] = embedding_response(cached, response_format)
+
+    pending = [task for task in task_list if task not in results]
+    if pending:
+        with ExitStack() as stack:
+            if 'ocr' in pending:
+                stack.enter_context(ocr_slot())
+            img = await asyncio.get_running_loop().run_in_executor(None, decode_analyze_image, image_bytes, full_size)
+            if img is None:
+                for task in pending:
+                    results[task] = {'result': [], 'msg': 'image decode failed'}
+            else:
+                jobs = {'ocr': lambda: analyze_ocr(img, use_cls, max_side_len, ocr_key, layout),
+                        'clip': lambda: analyze_clip(img, clip_key, response_format)}
+                responses = await asyncio.gather(*(jobs[task]() for task in pending))
+                results.update(zip(pending, responses))
+            del img
+    return {task: results[task] for task in task_list}
 
 async def predict(predict_func, inputs,model):
     return await asyncio.get_running_loop().run_in_executor(None, predict_func, inputs,model)
 
+def flush_cache_writes():
+    # exec和 os._exit 不会等待缓存的磁盘线程，先写完排队中的缓存
+    for cache in (txt_cache, img_cache, ocr_cache):
+        if cache is not None and cache.disk is not None:
+            cache.disk.flush()
+
 def restart_program():
     print("restart_program")
+    flush_cache_writes()
+    if worker_index is not None:
+        # 多进程时由主进程结束全部worker后重启
+        sys.stdout.flush()
+        os._exit(prefork.RESTART_EXIT_CODE)
+    if inference_pool is not None:
+        # exec不会执行退出清理，先结束推理进程并删除共享内存
+        inference_pool.close()
     python = sys.executable
     os.execl(python, python, *sys.argv)
 
 
 if __name__ == "__main__":
-    uvicorn.run("server:app", host=None, port=http_port)
+    if workers > 1:
+        preload_models()
+        if prefork.serve(app, None, http_port, workers, on_worker_start=start_worker):
+            restart_program()
+    else:
+        uvicorn.run("server:app", host=None, port=http_port)
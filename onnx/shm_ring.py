@@ -0,0 +1,123 @@
+import collections
+import os
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def shm_free_bytes(path="/dev/shm"):
+    """Free space of the tmpfs backing POSIX shared memory, or None when unknown."""
+    try:
+        st = os.statvfs(path)
+    except (OSError, AttributeError):
+        return None
+    return st.f_bavail * st.f_frsize
+
+
+def _destroy(shm, pid):
+    # fork出的子进程继承了这个对象，只有创建的进程可以删除共享内存
+    if os.getpid() != pid:
+        return
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        shm.close()
+    except BufferError:
+        pass # 仍有视图引用时，映射在进程退出时释放
+
+
+class ShmRing(object):
+    """Fixed-size slots in one shared memory block for handing payloads to forked processes.
+
+    Only the creating process hands out and recycles slots, in ring order. A
+    payload is written once into a slot and described by a small tuple that is
+    sent to the reading process instead of the data; the reader maps the slot
+    without copying. Processes forked after creation inherit the mapping, so
+    they never attach by name and never unlink it.
+    """
+
+    def __init__(self, slots, slot_size):
+        self.slot_size = int(slot_size)
+        self.slots = int(slots)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_size)
+        self.free = collections.deque(range(self.slots))
+        self.owners = {} # slot -> 占用者
+        self.writes = 0
+        self.bytes_written = 0
+        # 进程异常退出时也能由 resource_tracker 清理，正常退出时由 finalize 删除
+        self._finalizer = weakref.finalize(self, _destroy, self.shm, os.getpid())
+
+    @classmethod
+    def fit(cls, slots, slot_size):
+        """Creates a ring with as many of ``slots`` as /dev/shm can hold, or returns None.
+
+        Writing past the size of /dev/shm (64MB by default in Docker) kills the
+        process with SIGBUS instead of raising, so the ring is sized up front.
+        """
+        free = shm_free_bytes()
+        if free is not None:
+            # 留出一半空间给其他程序
+            slots = min(slots, int(free // 2 // slot_size))
+        if slots < 1:
+            return None
+        return cls(slots, slot_size)
+
+    def fits(self, nbytes):
+        return nbytes <= self.slot_size
+
+    def acquire(self, owner=None):
+        """Takes the next free slot, or returns None when all are in use."""
+        if not self.free:
+            return None
+        slot = self.free.popleft()
+        self.owners[slot] = owner
+        return slot
+
+    def release(self, slot):
+        if slot in self.owners:
+            del self.owners[slot]
+            self.free.append(slot)
+
+    def write(self, slot, data):
+        """Copies bytes or a contiguous array into ``slot``, returns the descriptor for ``read``."""
+        if isinstance(data, np.ndarray):
+            array = np.ascontiguousarray(data)
+            shape, dtype = array.shape, array.dtype.str
+            src = array.reshape(-1).view(np.uint8)
+        else:
+            shape, dtype = None, None
+            src = np.frombuffer(data, dtype=np.uint8)
+        nbytes = src.nbytes
+        if nbytes > self.slot_size:
+            raise ValueError(f"payload of {nbytes} bytes does not fit in a {self.slot_size} byte slot")
+        offset = slot * self.slot_size
+        np.frombuffer(self.shm.buf, dtype=np.uint8, count=nbytes, offset=offset)[:] = src
+        self.writes += 1
+        self.bytes_written += nbytes
+        return slot, nbytes, shape, dtype
+
+    def read(self, descriptor):
+        """Zero-copy view of a written slot: a memoryview for bytes, an ndarray for arrays.
+
+        The view must be dropped before the slot is released.
+        """
+        slot, nbytes, shape, dtype = descriptor
+        offset = slot * self.slot_size
+        if shape is None:
+            return self.shm.buf[offset:offset + nbytes]
+        return np.frombuffer(self.shm.buf, dtype=np.dtype(dtype), count=int(np.prod(shape, dtype=np.int64)),
+                             offset=offset).reshape(shape)
+
+    def stats(self):
+        return {
+            'slots': self.slots,
+            'slot_size': self.slot_size,
+            'in_use': len(self.owners),
+            'writes': self.writes,
+            'bytes_written': self.bytes_written,
+        }
+
+    def close(self):
+        self._finalizer()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 服务代码按脚本方式运行，模块直接位于 onnx 目录下
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import pytest
+from batcher import MicroBatcher
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_submit_returns_own_row_in_order():
+    calls = []
+
+    def double(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(double, max_batch_size=4, max_wait_ms=50)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(10))), batcher
+
+    results, batcher = run(main())
+    assert results == [i * 2 for i in range(10)]
+    # 并发提交的请求按提交顺序合并，每批不超过 max_batch_size
+    assert [item for batch in calls for item in batch] == list(range(10))
+    assert all(len(batch) <= 4 for batch in calls)
+    assert batcher.stats()['total_items'] == 10
+
+
+def test_items_queued_while_busy_are_coalesced():
+    release = threading.Event()
+    calls = []
+
+    def slow(items):
+        calls.append(list(items))
+        release.wait(5)
+        return items
+
+    async def main():
+        batcher = MicroBatcher(slow, max_batch_size=8, max_wait_ms=0)
+        first = asyncio.ensure_future(batcher.submit('a'))
+        await asyncio.sleep(0.05)
+        rest = [asyncio.ensure_future(batcher.submit(x)) for x in 'bcd']
+        await asyncio.sleep(0.05)
+        release.set()
+        return [await first] + [await f for f in rest]
+
+    assert run(main()) == ['a', 'b', 'c', 'd']
+    assert calls == [['a'], ['b', 'c', 'd']]
+
+
+def test_batch_error_fails_every_item_of_the_batch():
+    def fail(items):
+        raise ValueError("boom")
+
+    async def main():
+        batcher = MicroBatcher(fail, max_batch_size=4, max_wait_ms=20)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+
+    results = run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_short_batch_result_fails_every_item_instead_of_hanging():
+    async def main():
+        batcher = MicroBatcher(lambda items: items[:-1], max_batch_size=4, max_wait_ms=20)
+        submitted = asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+        results = await asyncio.wait_for(submitted, 5)
+        with pytest.raises(RuntimeError, match="2 results for 3 items"):
+            await batcher.run([1, 2, 3])
+        return results
+
+    results = run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_run_bypasses_the_queue():
+    async def main():
+        batcher = MicroBatcher(lambda items: [x + 1 for x in items])
+        return await batcher.run([1, 2, 3]), batcher.stats()
+
+    result, stats = run(main())
+    assert result == [2, 3, 4]
+    assert stats['batch_size_histogram'] == {'3': 1}
+    assert stats['queue_depth'] == 0
+
+
+def test_async_batches_run_concurrently_and_merge_while_busy():
+    running = []
+    peak = [0]
+    batches = []
+
+    async def double(items):
+        running.append(1)
+        peak[0] = max(peak[0], len(running))
+        batches.append(list(items))
+        await asyncio.sleep(0.05)
+        running.pop()
+        return [item * 2 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(double, max_batch_size=4, max_wait_ms=0, concurrency=2)
+        first = await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+        whole = await batcher.run([1, 2, 3])
+        return first, whole, batcher.stats()
+
+    first, whole, stats = run(main())
+    assert first == [i * 2 for i in range(10)] and whole == [2, 4, 6]
+    assert peak[0] == 2
+    # 两个batch执行时第三个batch等待空闲名额，不会逐个提交
+    assert [len(batch) for batch in batches[:-1]] == [4, 4, 2]
+    assert stats['concurrency'] == 2 and stats['running'] == 0
+
+
+def test_async_batch_error_fails_only_that_batch():
+    async def fail_odd(items):
+        if any(item % 2 for item in items):
+            raise ValueError("odd")
+        return items
+
+    async def main():
+        batcher = MicroBatcher(fail_odd, max_batch_size=1, max_wait_ms=0, concurrency=2)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(4)), return_exceptions=True)
+
+    results = run(main())
+    assert results[0] == 0 and results[2] == 2
+    assert isinstance(results[1], ValueError) and isinstance(results[3], ValueError)
@@ -0,0 +1,78 @@
+import os
+import pytest
+import bert_tokenizer
+from bert_tokenizer import FullTokenizer, MappedVocab, load_vocab, read_vocab_file, read_vocab_tokens
+
+
+@pytest.fixture
+def vocab_file(tmp_path):
+    path = tmp_path / "vocab.txt"
+    path.write_text("[PAD]\n[UNK]\n[CLS]\n[SEP]\n的\n猫\n##猫\nhello\n##lo\n😀\n\n", encoding="utf-8")
+    return str(path)
+
+
+def test_round_trip_real_vocab(tmp_path):
+    tokens = read_vocab_tokens(bert_tokenizer.default_vocab())
+    path = str(tmp_path / "vocab.map")
+    MappedVocab.build(path, tokens, 1, 2)
+    vocab = MappedVocab(path)
+    assert (len(vocab), vocab.source_size, vocab.source_mtime) == (len(tokens), 1, 2)
+    assert list(vocab) == tokens
+    assert all(vocab[token] == index for index, token in enumerate(tokens))
+    assert dict(vocab.items()) == read_vocab_file(bert_tokenizer.default_vocab())
+
+
+def test_missing_tokens(tmp_path):
+    path = str(tmp_path / "vocab.map")
+    MappedVocab.build(path, ["[PAD]", "猫", ""], 0, 0)
+    vocab = MappedVocab(path)
+    assert vocab[""] == 2
+    for token in ("狗", "猫猫", "\ud800", 1, None):
+        assert token not in vocab
+    with pytest.raises(KeyError):
+        vocab["狗"]
+    assert vocab.get("狗", -1) == -1
+
+
+def test_not_a_map_file(tmp_path):
+    path = tmp_path / "vocab.map"
+    path.write_bytes(b"x" * 64)
+    with pytest.raises(ValueError):
+        MappedVocab(str(path))
+
+
+def test_load_vocab_builds_and_rebuilds_the_map(vocab_file):
+    vocab = load_vocab(vocab_file)
+    assert isinstance(vocab, MappedVocab)
+    assert dict(vocab.items()) == read_vocab_file(vocab_file)
+    cache_path = bert_tokenizer.vocab_cache_path(vocab_file)
+    assert os.path.exists(cache_path)
+    assert load_vocab(vocab_file).source_mtime == vocab.source_mtime
+
+    with open(vocab_file, "a", encoding="utf-8") as f:
+        f.write("狗\n")
+    rebuilt = load_vocab(vocab_file)
+    assert rebuilt["狗"] == len(rebuilt) - 1
+    assert list(rebuilt) == read_vocab_tokens(vocab_file)
+
+
+def test_duplicate_tokens_fall_back_to_dict(vocab_file):
+    with open(vocab_file, "a", encoding="utf-8") as f:
+        f.write("猫\n")
+    vocab = load_vocab(vocab_file)
+    assert vocab == read_vocab_file(vocab_file)
+    assert vocab["猫"] == len(read_vocab_tokens(vocab_file)) - 1
+
+
+def test_tokenizer_matches_dict_vocab():
+    texts = ["海边的日落", "Hello World 2024", "生日蛋糕和蜡烛🎂", "unaffable ＡＢＣ"]
+    mapped = FullTokenizer()
+    assert isinstance(mapped.vocab, MappedVocab)
+    plain = FullTokenizer()
+    plain.vocab = read_vocab_file(bert_tokenizer.default_vocab())
+    plain.wordpiece_tokenizer.vocab = plain.vocab
+    for text in texts:
+        tokens = mapped.tokenize(text)
+        assert tokens == plain.tokenize(text)
+        assert mapped.convert_tokens_to_ids(tokens) == plain.convert_tokens_to_ids(tokens)
+        assert mapped.convert_ids_to_tokens(mapped.convert_tokens_to_ids(tokens)) == tokens
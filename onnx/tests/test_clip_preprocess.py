@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+import pytest
+import clip
+
+
+def baseline_image_processor(image_batch, image_size=224):
+    # 改为查表之前的实现
+    return np.transpose(np.array([clip.single_image_transform(img, image_size) for img in image_batch],
+                                 dtype=np.float32), (0, 3, 1, 2))
+
+
+def random_images():
+    rng = np.random.default_rng(1)
+    return [rng.integers(0, 256, shape, dtype=np.uint8) for shape in ((480, 640, 3), (224, 224, 3), (100, 60, 3), (300, 200))]
+
+
+def test_normalize_lut_matches_the_arithmetic():
+    pixels = np.arange(256, dtype=np.float32)
+    for c in range(3):
+        expected = ((pixels / 255.0 - clip.mean[c]) / clip.std[c]).astype(np.float32)
+        np.testing.assert_array_equal(clip.normalize_lut[c], expected)
+
+
+def test_image_processor_is_identical_to_the_per_image_transform(monkeypatch):
+    monkeypatch.setattr(clip, 'env_resize_backend', 'pil')
+    images = random_images()
+    np.testing.assert_array_equal(clip.image_processor(images, 224), baseline_image_processor(images, 224))
+
+
+def test_image_processor_writes_into_the_given_buffer(monkeypatch):
+    monkeypatch.setattr(clip, 'env_resize_backend', 'pil')
+    images = random_images()[:2]
+    out = np.full((2, 3, 224, 224), np.nan, dtype=np.float32)
+    assert clip.image_processor(images, 224, out=out) is out
+    np.testing.assert_array_equal(out, baseline_image_processor(images, 224))
+
+
+def test_cv2_resize_backend_stays_close(monkeypatch):
+    monkeypatch.setattr(clip, 'env_resize_backend', 'cv2')
+    images = [cv2.GaussianBlur(img, (9, 9), 0) for img in random_images()[:3]]
+    diff = np.abs(clip.image_processor(images, 224) - baseline_image_processor(images, 224))
+    assert diff.mean() < 0.05
+
+
+@pytest.mark.parametrize('width,height', [(640, 480), (2000, 300)])
+def test_jpeg_size_reads_the_sof_marker(width, height):
+    data = cv2.imencode('.jpg', np.zeros((height, width, 3), dtype=np.uint8))[1].tobytes()
+    assert clip.jpeg_size(data) == (width, height)
+    assert clip.jpeg_size(cv2.imencode('.png', np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes()) is None
+
+
+def test_reduced_decode_keeps_the_short_side_above_the_model_input():
+    img = np.zeros((1000, 1600, 3), dtype=np.uint8)
+    data = cv2.imencode('.jpg', img)[1].tobytes()
+    assert clip.decode_image(data, 224, reduced=True).shape == (250, 400, 3)
+    assert clip.decode_image(data, 224, reduced=False).shape == (1000, 1600, 3)
+    assert clip.decode_image(b'not an image', 224) is None
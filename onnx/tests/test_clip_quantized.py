@@ -0,0 +1,46 @@
+import pytest
+import clip
+
+
+@pytest.fixture
+def model_files(tmp_path, monkeypatch):
+    fp32_path = tmp_path / "vit-b-16.img.fp32.onnx"
+    int8_path = tmp_path / "vit-b-16.img.int8.onnx"
+    fp32_path.write_bytes(b"fp32")
+    int8_path.write_bytes(b"int8")
+    monkeypatch.setattr(clip, "env_clip_quantized", True)
+    monkeypatch.setattr(clip, "quantized_checks", {})
+    return str(fp32_path), str(int8_path)
+
+
+def load(fp32_path, int8_path, passed, monkeypatch):
+    monkeypatch.setattr(clip, "sample_inputs", lambda kind, folder: None)
+    monkeypatch.setattr(clip, "compare_models", lambda kind, a, b, inputs: {'passed': passed})
+    return clip.load_quantized("img", fp32_path, int8_path, lambda path: path)
+
+
+def test_unknown_until_checked(model_files):
+    assert clip.loaded_model_path(*model_files) is None
+
+
+@pytest.mark.parametrize("passed", [True, False])
+def test_matches_the_loaded_model(model_files, monkeypatch, passed):
+    fp32_path, int8_path = model_files
+    loaded = load(fp32_path, int8_path, passed, monkeypatch)
+    assert loaded == (int8_path if passed else fp32_path)
+    assert clip.loaded_model_path(fp32_path, int8_path) == loaded
+    # 卸载后重新加载使用同一个检查结果
+    assert clip.load_quantized("img", fp32_path, int8_path, lambda path: path) == loaded
+
+
+def test_fp32_without_quantized(model_files, monkeypatch):
+    monkeypatch.setattr(clip, "env_clip_quantized", False)
+    assert clip.loaded_model_path(*model_files) == model_files[0]
+
+
+def test_replaced_int8_model_is_checked_again(model_files, monkeypatch):
+    fp32_path, int8_path = model_files
+    load(fp32_path, int8_path, True, monkeypatch)
+    with open(int8_path, "ab") as f:
+        f.write(b"new")
+    assert clip.loaded_model_path(fp32_path, int8_path) is None
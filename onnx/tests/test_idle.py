@@ -0,0 +1,90 @@
+import asyncio
+import time
+import pytest
+import server
+
+
+class FakeRequest(object):
+    def __init__(self, path):
+        self.url = type('URL', (), {'path': path})()
+
+
+async def fake_request(path="/clip/txt"):
+    async def call_next(request):
+        return 'ok'
+    return await server.check_activity(FakeRequest(path), call_next)
+
+
+@pytest.fixture
+def watchdog(monkeypatch):
+    wakeups = []
+    idle = []
+    wait_for_activity = server.wait_for_activity
+
+    async def counting_wait(timeout=None):
+        wakeups.append(timeout)
+        await wait_for_activity(timeout)
+
+    def on_idle():
+        server.idle_handled = True
+        idle.append(time.monotonic())
+
+    monkeypatch.setattr(server, 'wait_for_activity', counting_wait)
+    monkeypatch.setattr(server, 'on_idle', on_idle)
+    monkeypatch.setattr(server, 'server_restart_time', 0.2)
+    monkeypatch.setattr(server, 'idle_handled', True)
+    return wakeups, idle
+
+
+def test_restart_watchdog_only_wakes_for_requests(monkeypatch, watchdog):
+    wakeups, idle = watchdog
+    monkeypatch.setattr(server, 'env_idle_action', 'restart')
+
+    async def main():
+        monkeypatch.setattr(server, 'activity_event', asyncio.Event())
+        task = asyncio.create_task(server.idle_watchdog())
+        await asyncio.sleep(0.5)
+        # 启动后没有请求，一直等待，不触发空闲处理
+        assert wakeups == [None] and idle == []
+        await fake_request()
+        await asyncio.sleep(0.5)
+        assert len(idle) == 1
+        after_idle = len(wakeups)
+        await asyncio.sleep(0.5)
+        # 空闲处理后等待下一个请求，不再周期性唤醒
+        assert len(wakeups) == after_idle and len(idle) == 1
+        await fake_request("/status")
+        await asyncio.sleep(0.1)
+        assert len(wakeups) == after_idle
+        task.cancel()
+
+    asyncio.run(main())
+
+
+def test_unload_watchdog_waits_when_nothing_is_loaded(monkeypatch, watchdog):
+    wakeups, idle = watchdog
+    monkeypatch.setattr(server, 'env_idle_action', 'unload')
+    monkeypatch.setattr(server, 'clip_txt_model', None)
+    monkeypatch.setattr(server, 'clip_img_model', None)
+    monkeypatch.setattr(server, 'rapid_ocr', None)
+    monkeypatch.setitem(server.model_idle_time, 'clip_txt', 0.2)
+    reclaimed = []
+    monkeypatch.setattr(server, 'reclaim_memory', lambda names: [reclaimed.extend(names), server.unload_model(names[0])])
+
+    async def main():
+        monkeypatch.setattr(server, 'activity_event', asyncio.Event())
+        task = asyncio.create_task(server.idle_watchdog())
+        await asyncio.sleep(0.3)
+        assert wakeups == [None]
+        with server.use_model('clip_txt'):
+            server.clip_txt_model = object()
+            await fake_request()
+        # 检查间隔最短1秒
+        await asyncio.sleep(1.3)
+        assert reclaimed == ['clip_txt']
+        settled = len(wakeups)
+        await asyncio.sleep(0.4)
+        assert len(wakeups) == settled and wakeups[-1] is None
+        task.cancel()
+
+    asyncio.run(main())
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import threading
+import time
+import numpy as np
+import pytest
+from inference_pool import InferencePool
+
+
+handled = [0]
+marks = [None]
+
+
+def handler(kind, data, options):
+    handled[0] += 1
+    if kind == 'sum':
+        return int(np.frombuffer(data, dtype=np.uint8).sum()) if not isinstance(data, np.ndarray) else float(data.sum())
+    if kind == 'sleep':
+        time.sleep(options['seconds'])
+        return os.getpid()
+    if kind == 'exit':
+        os._exit(3)
+    if kind == 'ppid':
+        return os.getpid(), os.getppid()
+    if kind == 'mark':
+        marks[0] = options['value']
+        return None
+    if kind == 'marked':
+        time.sleep(options['seconds'])
+        return os.getpid(), marks[0]
+    raise ValueError(kind)
+
+
+def take_handled():
+    count, handled[0] = handled[0], 0
+    return {'handled': count, 'pid': os.getpid()}
+
+
+def run_pool(main, processes=2, slots=4, slot_size=64 * 1024, **kwargs):
+    async def runner():
+        pool = InferencePool(processes, handler, slots=slots, slot_size=slot_size, **kwargs)
+        pool.start()
+        try:
+            return await main(pool)
+        finally:
+            pool.close()
+    return asyncio.run(runner())
+
+
+def test_results_and_transport():
+    async def main(pool):
+        payloads = [bytes([i]) * 1000 for i in range(8)] + [np.ones((4, 8), dtype=np.float32), b"\x01" * 100000]
+        results = await asyncio.gather(*(pool.submit('sum', data) for data in payloads))
+        return results, pool.stats()
+
+    results, stats = run_pool(main)
+    assert results == [i * 1000 for i in range(8)] + [32.0, 100000]
+    assert stats['transport'] == {'shm': 9, 'pickle': 1}
+    assert stats['ring']['in_use'] == 0
+    assert stats['tasks'] == {'sum': 10} and stats['failed'] == 0
+
+
+def test_stats_are_merged_in_the_server_process():
+    merged = []
+
+    async def main(pool):
+        await asyncio.gather(*(pool.submit('sum', b"x") for _ in range(6)))
+        with pytest.raises(RuntimeError):
+            await pool.submit('unknown', b"x")
+
+    run_pool(main, collect_stats=take_handled, merge_stats=merged.append)
+    assert sum(stats['handled'] for stats in merged) == 7
+    assert all(stats['pid'] != os.getpid() for stats in merged)
+    assert handled[0] == 0
+
+
+def test_notify_reaches_every_process():
+    async def main(pool):
+        # 一个推理进程正在执行任务，通知在任务完成后处理
+        busy = asyncio.ensure_future(pool.submit('marked', b"x", seconds=0.3))
+        await asyncio.sleep(0.1)
+        pool.notify('mark', value=5)
+        first = await busy
+        results = await asyncio.gather(*(pool.submit('marked', b"x", seconds=0.2) for _ in range(2)))
+        return first, results, pool.stats()
+
+    first, results, stats = run_pool(main)
+    assert first[1] is None
+    assert sorted(pid for pid, _ in results) == sorted(stats['pids'])
+    assert [mark for _, mark in results] == [5, 5]
+    assert stats['notified'] == {'mark': 1} and stats['tasks'] == {'marked': 3}
+    assert marks[0] is None
+
+
+def test_handler_error():
+    async def main(pool):
+        with pytest.raises(RuntimeError, match="unknown"):
+            await pool.submit('unknown', b"x")
+        return await pool.submit('sum', b"\x02"), pool.stats()
+
+    result, stats = run_pool(main, processes=1)
+    assert result == 2 and stats['failed'] == 1 and stats['restarts'] == 0
+
+
+def test_dead_process_is_replaced_by_the_spawner():
+    async def main(pool):
+        # 服务进程中已有其他线程时替换推理进程，新进程仍由spawner fork
+        threading.Thread(target=time.sleep, args=(1,), daemon=True).start()
+        first, parent = await pool.submit('ppid', b"x")
+        with pytest.raises(RuntimeError, match="exited"):
+            await pool.submit('exit', b"x")
+        second, new_parent = await pool.submit('ppid', b"x")
+        return first, second, parent, new_parent, pool.spawner.pid, pool.stats()
+
+    first, second, parent, new_parent, spawner, stats = run_pool(main, processes=1)
+    assert first != second
+    assert parent == new_parent == spawner != os.getpid()
+    assert stats['restarts'] == 1 and stats['pids'] == [second]
+    assert stats['ring']['in_use'] == 0
+
+
+def test_cancelled_request_keeps_its_slot_until_the_reply():
+    async def main(pool):
+        task = asyncio.ensure_future(pool.submit('sleep', b"x" * 100, seconds=0.3))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        in_use = pool.ring.stats()['in_use']
+        # 推理进程仍在读取槽位，回复后才回收
+        result = await pool.submit('sum', b"\x03")
+        return in_use, result, pool.ring.stats()['in_use']
+
+    assert run_pool(main, processes=1, slots=1) == (1, 3, 0)
+
+
+def test_close_stops_processes_and_unlinks_the_ring():
+    async def main(pool):
+        await pool.submit('sum', b"x")
+        return pool
+
+    pool = run_pool(main)
+    assert not pool.spawner.is_alive()
+    for pid, _ in pool.workers:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+    assert not os.path.exists("/dev/shm/" + pool.ring.shm.name)
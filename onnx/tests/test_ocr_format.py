@@ -0,0 +1,80 @@
+import cv2
+import numpy as np
+import pytest
+from ocr_format import box_columns, compact_result, ocr_layout, round2
+
+
+def to_fixed(num):
+    # 改为向量化之前的实现
+    return str(round(num, 2))
+
+
+def legacy_trans_result(result, scale=1.0):
+    boxes = []
+    for dt_box, _, _ in result:
+        boxes.append({
+            'x': to_fixed(dt_box[0][0] * scale),
+            'y': to_fixed(dt_box[0][1] * scale),
+            'width': to_fixed((dt_box[1][0] - dt_box[0][0]) * scale),
+            'height': to_fixed((dt_box[2][1] - dt_box[0][1]) * scale)
+        })
+    return {'texts': [r[1] for r in result], 'scores': [f"{r[2]:.2f}" for r in result], 'boxes': boxes}
+
+
+def legacy_bounds_result(boxes_coords, texts, scores):
+    # cuda 版本的旧实现，RapidOCR 3.x 输出float32的文本框
+    boxes = []
+    for box in boxes_coords:
+        xs = [point[0] for point in box]
+        ys = [point[1] for point in box]
+        x_min, x_max = min(xs), max(xs)
+        y_min, y_max = min(ys), max(ys)
+        boxes.append({'x': to_fixed(x_min), 'y': to_fixed(y_min),
+                      'width': to_fixed(x_max - x_min), 'height': to_fixed(y_max - y_min)})
+    return {'texts': list(texts), 'scores': [f"{score:.2f}" for score in scores], 'boxes': boxes}
+
+
+def random_quads(dtype, count=2000):
+    rng = np.random.default_rng(3)
+    corner = rng.uniform(0, 4000, (count, 1, 2))
+    offsets = np.array([[0, 0], [1, 0], [1, 1], [0, 1]]) * rng.uniform(1, 600, (count, 1, 2))
+    return (corner + offsets + rng.normal(0, 2, (count, 4, 2))).astype(dtype)
+
+
+def test_round2_float64_matches_builtin_round():
+    values = np.concatenate([random_quads(np.float64).reshape(-1), np.arange(-1000, 1000) / 1000 + 0.005])
+    assert round2(values).tolist() == [round(v, 2) for v in values.tolist()]
+
+
+def test_round2_float32_matches_numpy_scalar_round():
+    values = np.concatenate([random_quads(np.float32).reshape(-1), (np.arange(-1000, 1000) / 1000 + 0.005).astype(np.float32)])
+    assert [str(v) for v in round2(values).tolist()] == [str(round(v, 2)) for v in values]
+
+
+def test_float32_boxes_stay_float32():
+    assert box_columns(random_quads(np.float32, 4))[2].dtype == np.float32
+    assert box_columns(random_quads(np.float32, 4).tolist())[2].dtype == np.float64
+
+
+def test_bounds_matches_legacy_float32_output():
+    boxes = random_quads(np.float32)
+    texts = [str(i) for i in range(len(boxes))]
+    scores = np.random.default_rng(4).uniform(0.5, 1, len(boxes)).astype(np.float32)
+    result = ocr_layout(compact_result(boxes, texts, scores, bounds=True))
+    assert result == legacy_bounds_result(boxes, texts, scores)
+
+
+def text_image():
+    img = np.full((360, 900, 3), 255, dtype=np.uint8)
+    for i, line in enumerate(("MT Photos 2024", "Hello OCR world", "0123456789")):
+        cv2.putText(img, line, (20 + 13 * i, 90 + 110 * i), cv2.FONT_HERSHEY_SIMPLEX, 1.6 + 0.2 * i, (0, 0, 0), 3)
+    return img
+
+
+@pytest.mark.parametrize("scale", [1.0, 1.37])
+def test_matches_legacy_output_on_rapidocr_boxes(scale):
+    rapidocr = pytest.importorskip("rapidocr_onnxruntime")
+    result, _ = rapidocr.RapidOCR()(text_image())
+    assert result
+    boxes, texts, scores = zip(*result)
+    assert ocr_layout(compact_result(boxes, texts, scores, scale)) == legacy_trans_result(result, scale)
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+from result_cache import LRUCache, SqliteStore, content_hash
+
+
+def to_bytes(value):
+    return value.encode('utf-8')
+
+
+def from_bytes(raw):
+    return bytes(raw).decode('utf-8')
+
+
+def test_lru_evicts_least_recently_used_by_size():
+    # 每个条目的大小为 key 长度 + 值的字节数，这里都是 1 + 9 = 10
+    cache = LRUCache(30, to_bytes, from_bytes)
+    for key in 'abc':
+        cache.put(key, key * 9)
+    assert cache.get('a') == 'a' * 9
+    cache.put('d', 'd' * 9)
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['a' * 9, 'c' * 9, 'd' * 9]
+    stats = cache.stats()
+    assert stats['entries'] == 3 and stats['bytes'] == 30
+    assert stats['hits'] == 4 and stats['misses'] == 1
+
+
+def test_entry_larger_than_the_cache_is_not_kept():
+    cache = LRUCache(10, to_bytes, from_bytes)
+    cache.put('a', 'x' * 100)
+    assert cache.get('a') is None and cache.stats()['bytes'] == 0
+
+
+def test_ttl_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = LRUCache(1000, to_bytes, from_bytes, ttl=5)
+    cache.put('a', 'value')
+    now[0] += 4
+    assert cache.get('a') == 'value'
+    now[0] += 2
+    assert cache.get('a') is None
+
+
+def test_disk_tier_survives_a_new_memory_cache(tmp_path):
+    store = SqliteStore(str(tmp_path / 'cache.db'), 1024 * 1024)
+    cache = LRUCache(1000, to_bytes, from_bytes, disk=store)
+    cache.put('a', 'value')
+    store.flush()
+    fresh = LRUCache(1000, to_bytes, from_bytes, disk=SqliteStore(str(tmp_path / 'cache.db'), 1024 * 1024))
+    assert fresh.get('a') == 'value'
+    stats = fresh.stats()
+    assert stats['disk_hits'] == 1 and stats['entries'] == 1
+
+
+def test_aget_reads_the_disk_tier_on_the_disk_thread(tmp_path):
+    store = SqliteStore(str(tmp_path / 'cache.db'), 1024 * 1024)
+    LRUCache(1000, to_bytes, from_bytes, disk=store).put('a', 'value')
+    store.flush()
+    cache = LRUCache(1000, to_bytes, from_bytes, disk=store)
+    threads = []
+    get = store.get
+
+    def recording_get(key, ttl=0):
+        threads.append(threading.current_thread().name)
+        return get(key, ttl)
+
+    store.get = recording_get
+
+    async def main():
+        return await cache.aget('a'), await cache.aget('a'), await cache.aget('missing')
+
+    assert asyncio.run(main()) == ('value', 'value', None)
+    # 第二次从内存命中，不再读磁盘
+    assert len(threads) == 2 and all(name.startswith('cache-disk') for name in threads)
+
+
+def test_sqlite_store_evicts_to_90_percent(tmp_path):
+    store = SqliteStore(str(tmp_path / 'cache.db'), 1000)
+    for i in range(20):
+        store.put(f'k{i:02d}', b'x' * 97)
+    assert store.total_bytes <= 1000 and store.stats()["entries"] == store.total_bytes // 100
+    assert store.get('k19') is not None and store.get('k00') is None
+
+
+def test_content_hash_is_prefixed_and_stable():
+    assert content_hash(b'abc') == content_hash(memoryview(b'abc'))
+    assert content_hash(b'abc').split(':')[0] in ('xxh3', 'b2b')
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import shm_ring
+from shm_ring import ShmRing
+
+
+@pytest.fixture
+def ring():
+    ring = ShmRing(3, 1024)
+    yield ring
+    ring.close()
+
+
+def test_slots_are_recycled_in_ring_order(ring):
+    assert [ring.acquire() for _ in range(3)] == [0, 1, 2]
+    assert ring.acquire() is None
+    ring.release(1)
+    ring.release(0)
+    assert ring.stats()['in_use'] == 1
+    assert [ring.acquire(), ring.acquire(), ring.acquire()] == [1, 0, None]
+
+
+def test_release_is_idempotent(ring):
+    slot = ring.acquire()
+    ring.release(slot)
+    ring.release(slot)
+    ring.release(2) # 未被占用的槽位
+    assert sorted(ring.acquire() for _ in range(3)) == [0, 1, 2]
+    assert ring.acquire() is None
+
+
+def test_write_read_round_trip(ring):
+    data = bytes(range(200))
+    view = ring.read(ring.write(1, data))
+    assert bytes(view) == data
+    view.release()
+
+    array = np.arange(60, dtype=np.float32).reshape(3, 4, 5)[:, ::2]
+    read = ring.read(ring.write(2, array))
+    np.testing.assert_array_equal(read, array)
+    assert read.dtype == np.float32 and read.shape == (3, 2, 5)
+    assert ring.stats()['writes'] == 2
+
+
+def test_slot_contents_are_independent(ring):
+    first = ring.write(0, b"a" * 1024)
+    ring.write(1, b"b" * 1024)
+    assert bytes(ring.read(first)) == b"a" * 1024
+
+
+def test_oversized_payload(ring):
+    assert ring.fits(1024) and not ring.fits(1025)
+    with pytest.raises(ValueError):
+        ring.write(0, b"x" * 1025)
+
+
+def test_fit_respects_free_space(monkeypatch):
+    monkeypatch.setattr(shm_ring, "shm_free_bytes", lambda path="/dev/shm": 10 * 1024)
+    assert ShmRing.fit(2, 8 * 1024) is None
+    ring = ShmRing.fit(8, 1024)
+    assert ring.slots == 5
+    ring.close()
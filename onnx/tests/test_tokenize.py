@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import clip
+
+
+def baseline_pack(rows, width, dtype=np.int64):
+    # 改为预分配数组之前逐行补齐的实现
+    result = np.zeros((len(rows), width), dtype=dtype)
+    for i, row in enumerate(rows):
+        result[i, :len(row)] = row
+    return result
+
+
+def random_rows(count, context_length=52):
+    rng = np.random.default_rng(count)
+    return [rng.integers(1, 21128, rng.integers(2, context_length + 1)).tolist() for _ in range(count)]
+
+
+@pytest.mark.parametrize("count", [1, 3, 8, 9, 64])
+@pytest.mark.parametrize("dtype", [np.int64, np.int32])
+def test_pack_matches_row_by_row(count, dtype):
+    rows = random_rows(count)
+    packed = clip.pack_token_ids(rows, 52, dtype=dtype)
+    assert packed.dtype == dtype
+    np.testing.assert_array_equal(packed, baseline_pack(rows, 52, dtype))
+
+
+def test_pack_empty():
+    assert clip.pack_token_ids([], 52).shape == (0, 52)
+    assert clip.pack_token_ids([], 52, dynamic=True).shape == (0, 52)
+
+
+@pytest.mark.parametrize("count", [2, 20])
+def test_dynamic_width_is_bucketed(count, monkeypatch):
+    monkeypatch.setattr(clip, "env_txt_length_bucket", 8)
+    rows = [row[:11] for row in random_rows(count)]
+    longest = max(len(row) for row in rows)
+    packed = clip.pack_token_ids(rows, 52, dynamic=True)
+    assert packed.shape == (count, -(-longest // 8) * 8)
+    np.testing.assert_array_equal(packed, baseline_pack(rows, 52)[:, :packed.shape[1]])
+
+
+def test_dynamic_width_is_capped(monkeypatch):
+    monkeypatch.setattr(clip, "env_txt_length_bucket", 16)
+    rows = [list(range(1, 53))] * 10
+    assert clip.pack_token_ids(rows, 52, dynamic=True).shape == (10, 52)
+
+
+def test_tokenize_numpy():
+    texts = ["一只猫", "海边的日落" * 20, "", "Hello World"] * 3
+    tokens = clip.tokenize_numpy(texts, 52)
+    cls_id, sep_id = clip._tokenizer.token_id('[CLS]'), clip._tokenizer.token_id('[SEP]')
+    assert tokens.shape == (len(texts), 52)
+    for text, row in zip(texts, tokens):
+        ids = clip._tokenizer.convert_tokens_to_ids(clip._tokenizer.tokenize(text))[:50]
+        expected = [cls_id] + ids + [sep_id]
+        assert row[:len(expected)].tolist() == expected
+        assert not row[len(expected):].any()
+    np.testing.assert_array_equal(clip.tokenize_numpy(texts[0]), tokens[:1])
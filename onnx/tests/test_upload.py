@@ -0,0 +1,60 @@
+import io
+import tarfile
+import zipfile
+import pytest
+from upload import ArchiveLimitError, is_archive, read_archive
+
+
+def make_zip(files, compression=zipfile.ZIP_STORED):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', compression) as zf:
+        zf.writestr('folder/', b'')
+        for name, data in files:
+            zf.writestr(name, data)
+    buf.seek(0)
+    return buf
+
+
+def make_tar(files, mode='w:gz'):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tf:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    buf.seek(0)
+    return buf
+
+
+FILES = [('a.jpg', b'aaa'), ('folder/b.png', b'bbbb'), ('c.jpg', b'c')]
+
+
+@pytest.mark.parametrize('make', [make_zip, make_tar, lambda files: make_tar(files, 'w')])
+def test_read_archive_keeps_archive_order(make):
+    assert read_archive(make(FILES), max_files=3) == FILES
+
+
+@pytest.mark.parametrize('make', [make_zip, make_tar])
+def test_too_many_files_is_rejected(make):
+    with pytest.raises(ArchiveLimitError, match='too many files, max 2'):
+        read_archive(make(FILES), max_files=2)
+
+
+def test_zip_bomb_is_rejected_before_decompressing():
+    archive = make_zip([('bomb.bin', b'\0' * (8 * 1024 * 1024))], zipfile.ZIP_DEFLATED)
+    assert len(archive.getvalue()) < 64 * 1024
+    with pytest.raises(ArchiveLimitError, match='archive too large'):
+        read_archive(archive, max_files=10, max_bytes=1024 * 1024)
+
+
+def test_tar_stops_at_the_size_limit():
+    archive = make_tar([(f'{i}.bin', b'\0' * 400 * 1024) for i in range(8)])
+    with pytest.raises(ArchiveLimitError, match='archive too large'):
+        read_archive(archive, max_files=10, max_bytes=1024 * 1024)
+    # 0 为不限制大小
+    assert len(read_archive(archive, max_files=10, max_bytes=0)) == 8
+
+
+def test_is_archive():
+    assert is_archive('photos.ZIP') and is_archive('a.tar.gz') and is_archive('a.tgz')
+    assert not is_archive('a.jpg') and not is_archive(None)
@@ -0,0 +1,93 @@
+"""
+测试OCR和CLIP同时推理时不同线程分配的吞吐量，输出推荐的 OCR_THREADS、ORT_INTRA_OP_THREADS
+
+python tune_threads.py
+python tune_threads.py --seconds 10 --batch 8
+
+先分别测出OCR、CLIP单独使用全部核心时的吞吐量，再测试每种分配下两者同时运行的吞吐量，
+得分为两者吞吐量相对单独运行时的比例之和，得分最高的分配即为推荐值（大于1说明同时运行有收益）
+"""
+import argparse
+import threading
+import time
+import numpy as np
+import cv2
+from rapidocr_onnxruntime import RapidOCR
+import clip
+
+
+def ocr_sample():
+    img = np.full((720, 1280, 3), 255, dtype=np.uint8)
+    for i, line in enumerate(["MT Photos AI", "Hello World 123", "2024-11-29 12:00", "OCR thread tuning"]):
+        cv2.putText(img, line, (40, 120 + i * 150), cv2.FONT_HERSHEY_SIMPLEX, 2.5, (0, 0, 0), 5)
+    return img
+
+
+def measure(jobs, seconds):
+    """Runs every job in its own thread for the given seconds, returns the calls per second of each."""
+    counts = [0] * len(jobs)
+    stop = threading.Event()
+
+    def loop(index, job):
+        while not stop.is_set():
+            job()
+            counts[index] += 1
+
+    threads = [threading.Thread(target=loop, args=(i, job)) for i, job in enumerate(jobs)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return [count / elapsed for count in counts]
+
+
+def create_jobs(ocr_threads, clip_threads, image, batch):
+    ocr = RapidOCR(intra_op_num_threads=ocr_threads) if ocr_threads else RapidOCR()
+    session = clip.create_session(clip.img_onnx_model_path, False, clip_threads)
+    inputs = clip.sample_inputs("img", count=batch)
+    ocr_job = lambda: ocr(image)
+    clip_job = lambda: clip.run_img_model(session, inputs)
+    ocr_job()
+    clip_job()
+    return ocr_job, clip_job
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--batch', type=int, default=8)
+    args = parser.parse_args()
+
+    cpus = clip.available_cpus()
+    image = ocr_sample()
+    ocr_job, clip_job = create_jobs(0, 0, image, args.batch)
+    ocr_solo = measure([ocr_job], args.seconds)[0]
+    clip_solo = measure([clip_job], args.seconds)[0]
+    print(f"cpus {cpus}, solo: ocr {ocr_solo:.2f}/s, clip {clip_solo * args.batch:.2f} img/s")
+    ocr_rate, clip_rate = measure([ocr_job, clip_job], args.seconds)
+    default_score = ocr_rate / ocr_solo + clip_rate / clip_solo
+    print(f"{'default':<12}ocr {ocr_rate:>7.2f}/s  clip {clip_rate * args.batch:>7.2f} img/s  score {default_score:.3f}")
+
+    best = None
+    for ocr_threads in sorted({max(1, cpus * k // 8) for k in range(1, 8)}):
+        clip_threads = max(1, cpus - ocr_threads)
+        ocr_job, clip_job = create_jobs(ocr_threads, clip_threads, image, args.batch)
+        ocr_rate, clip_rate = measure([ocr_job, clip_job], args.seconds)
+        score = ocr_rate / ocr_solo + clip_rate / clip_solo
+        print(f"{ocr_threads:>3} + {clip_threads:<6}ocr {ocr_rate:>7.2f}/s  clip {clip_rate * args.batch:>7.2f} img/s  score {score:.3f}")
+        if best is None or score > best[0]:
+            best = (score, ocr_threads, clip_threads)
+
+    score, ocr_threads, clip_threads = best
+    if score <= default_score:
+        print("onnxruntime default threads perform best, keep THREAD_SPLIT=off")
+    else:
+        print(f"recommended: THREAD_SPLIT=on OCR_THREADS={ocr_threads} ORT_INTRA_OP_THREADS={clip_threads}")
+
+
+if __name__ == '__main__':
+    main()
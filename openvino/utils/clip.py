@@ -1,9 +1,13 @@
 import os
 import sys
+import math
+import threading
+import itertools
 import numpy as np
+import cv2
 from PIL import Image, ImageFile
 from typing import Union, List
-from openvino.runtime import Core
+from openvino.runtime import AsyncInferQueue, Core, Type
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 current_folder = os.path.dirname(os.path.abspath(__file__))
@@ -18,12 +22,42 @@ def join_path(folder_path, file_name):
 model_folder_path = current_folder
 img_onnx_model_path = join_path(model_folder_path, "vit-b-16.img.fp32.onnx")
 txt_onnx_model_path = join_path(model_folder_path, "vit-b-16.txt.fp32.onnx")
+# quantize_clip.py 生成的INT8模型
+img_int8_model_path = join_path(model_folder_path, "vit-b-16.img.int8.onnx")
+txt_int8_model_path = join_path(model_folder_path, "vit-b-16.txt.int8.onnx")
+env_clip_quantized = os.getenv("CLIP_QUANTIZED", "off") == "on" # 使用INT8模型，加载时先与fp32模型对比特征，相似度不达标则继续使用fp32模型
+env_clip_int8_min_cosine = float(os.getenv("CLIP_INT8_MIN_COSINE", "0.99")) # INT8模型与fp32模型特征的平均余弦相似度下限
+env_clip_int8_sample_dir = os.getenv("CLIP_INT8_SAMPLE_DIR", "") # 精度检查使用的图片目录，留空则使用随机生成的样本图片
+
+env_ov_device = os.getenv("OV_DEVICE", "AUTO") # OpenVINO推理设备：AUTO、CPU、GPU
+env_ov_cache_dir = os.getenv("OV_CACHE_DIR", join_path(model_folder_path, "ov_cache")) # 编译后模型的缓存目录，重启后直接加载，留空则不缓存
+env_ov_img_hint = os.getenv("OV_IMG_PERFORMANCE_HINT", "THROUGHPUT") # 图片模型的PERFORMANCE_HINT，建立索引时以吞吐量优先
+env_ov_txt_hint = os.getenv("OV_TXT_PERFORMANCE_HINT", "LATENCY") # 文本模型的PERFORMANCE_HINT，搜索时以延迟优先
+env_ov_num_streams = os.getenv("OV_NUM_STREAMS", "") # NUM_STREAMS，留空则由PERFORMANCE_HINT决定
+env_ov_precision = os.getenv("OV_INFERENCE_PRECISION", "") # INFERENCE_PRECISION_HINT：f32、bf16、f16，留空则使用设备默认值
+env_ov_infer_requests = int(os.getenv("OV_INFER_REQUESTS", "0")) # 每个模型并行的infer request数量，0为使用编译后模型推荐的数量
 
 IMG_SIZE = 224
 
+
+def model_identity(model_path):
+    # 模型文件名+大小+修改时间，用于缓存key，替换模型文件后旧缓存自动失效
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return os.path.basename(model_path)
+    return f"{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
 _tokenizer = bert.FullTokenizer()
 mean = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
 std = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+# uint8像素值到归一化float32的查表，与 (x / 255.0 - mean) / std 的计算结果完全一致
+normalize_lut = ((np.arange(256, dtype=np.float32)[None, :] / 255.0 - mean[:, None]) / std[:, None]).astype(np.float32)
+env_resize_backend = os.getenv("CLIP_RESIZE_BACKEND", "pil") # 图片缩放方式：pil 与原先结果完全一致；cv2 速度更快，结果有细微差异
+env_jpeg_reduced = os.getenv("CLIP_JPEG_REDUCED", "off") == "on" # JPEG图片按目标尺寸使用1/2、1/4、1/8缩小解码，大图解码更快、占用内存更少，结果有细微差异
+env_txt_dynamic_length = os.getenv("CLIP_TXT_DYNAMIC_LENGTH", "off") == "on" # 文本模型的序列长度可变时，按batch内最长的文本补齐，不再固定补齐到52，短搜索词推理更快，结果有细微差异
+env_txt_length_bucket = int(os.getenv("CLIP_TXT_LENGTH_BUCKET", "8")) # 可变序列长度时按该值的倍数向上取整，减少输入形状的种类
+env_txt_batch_size = int(os.getenv("CLIP_TXT_BATCH_SIZE", "64")) # 批量计算文本特征时每次推理的文本数量
 
 
 def single_image_transform(image, image_size):
@@ -34,17 +68,92 @@ def single_image_transform(image, image_size):
     return image.astype(np.float32)
 
 
-def image_processor(image_batch, image_size=224):
-    transformed_batch = [single_image_transform(img, image_size) for img in image_batch]
-    transformed_batch = np.array(transformed_batch, dtype=np.float32)  # Shape would be (N, H, W, C)
+def resize_image(image, image_size):
+    """Resizes a decoded HxWx3 uint8 image to image_size x image_size in one step."""
+    if env_resize_backend == "cv2":
+        # INTER_AREA 缩小时会做抗锯齿，结果接近PIL的BICUBIC；放大时使用INTER_CUBIC
+        h, w = image.shape[:2]
+        interpolation = cv2.INTER_AREA if h >= image_size and w >= image_size else cv2.INTER_CUBIC
+        return cv2.resize(image, (image_size, image_size), interpolation=interpolation)
+    return np.asarray(Image.fromarray(image).resize((image_size, image_size), Image.BICUBIC))
+
+
+def preprocess_identity():
+    # 会影响特征结果的预处理选项，拼接到缓存key的模型标识后；默认设置返回空字符串，已有缓存保持有效
+    options = []
+    if env_resize_backend != "pil":
+        options.append(f"resize={env_resize_backend}")
+    if env_jpeg_reduced:
+        options.append("jpeg_reduced")
+    return ":" + ",".join(options) if options else ""
 
-    # Reorder dimensions to (N, C, H, W)
-    transformed_batch = np.transpose(transformed_batch, (0, 3, 1, 2))
 
-    return transformed_batch
+def jpeg_size(data):
+    """Reads (width, height) from the SOF marker of a JPEG, or returns None for other formats."""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        # SOF0-SOF15，排除 DHT(C4)、JPG(C8)、DAC(CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
 
 
-def tokenize_numpy(texts: Union[str, List[str]], context_length: int = 52) -> np.ndarray:
+reduced_decode_flags = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def decode_image(image_bytes, image_size=224, reduced=None):
+    """Decodes uploaded image bytes for CLIP, returns None when decoding fails.
+
+    With reduced decoding on, JPEGs are decoded through libjpeg DCT scaling at
+    the largest 1/2, 1/4 or 1/8 reduction whose short side still stays at or
+    above image_size; other formats are decoded at full size.
+    """
+    flags = cv2.IMREAD_COLOR
+    if env_jpeg_reduced if reduced is None else reduced:
+        size = jpeg_size(image_bytes)
+        if size is not None:
+            short_side = min(size)
+            for factor, reduced_flags in reduced_decode_flags:
+                if short_side // factor >= image_size:
+                    flags = reduced_flags
+                    break
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+
+def image_processor(image_batch, image_size=224, out=None):
+    """Preprocesses images into a normalized float32 (N, 3, H, W) batch.
+
+    Each image is resized once and written channel by channel into the batch
+    buffer through a uint8 -> float32 lookup table, which gives the same values
+    as single_image_transform without the intermediate full-size copies.
+    """
+    if out is None:
+        out = np.empty((len(image_batch), 3, image_size, image_size), dtype=np.float32)
+    for i, img in enumerate(image_batch):
+        img = np.asarray(img, dtype=np.uint8)
+        if img.ndim != 3 or img.shape[2] != 3:
+            img = np.array(Image.fromarray(img).convert('RGB'))
+        resized = resize_image(img, image_size)
+        # 通道顺序与原先一致：cv2解码得到的通道顺序直接按mean/std的顺序归一化，保证与已有图片特征兼容
+        for c in range(3):
+            np.take(normalize_lut[c], resized[:, :, c], out=out[i, c])
+    return out
+
+
+def tokenize_numpy(texts: Union[str, List[str]], context_length: int = 52, dtype=np.int64) -> np.ndarray:
     """
     Returns the tokenized representation of given input string(s)
     Parameters
@@ -53,44 +162,270 @@ def tokenize_numpy(texts: Union[str, List[str]], context_length: int = 52) -> np
         An input string or a list of input strings to tokenize
     context_length : int
         The context length to use; all baseline models use 52 as the context length
+    dtype : numpy integer type of the result
     Returns
     -------
     A two-dimensional numpy array containing the resulting tokens, shape = [number of input strings, context_length]
     """
     if isinstance(texts, str):
         texts = [texts]
+    return pack_token_ids([token_ids(text, context_length) for text in texts], context_length, dtype=dtype)
+
 
-    all_tokens = []
-    for text in texts:
-        all_tokens.append([_tokenizer.vocab['[CLS]']] + _tokenizer.convert_tokens_to_ids(_tokenizer.tokenize(text))[
-                                                        :context_length - 2] + [_tokenizer.vocab['[SEP]']])
+def token_ids(text, context_length=52):
+    """Token ids of one text wrapped in [CLS] ... [SEP], truncated to context_length."""
+    ids = _tokenizer.convert_tokens_to_ids(_tokenizer.tokenize(text))[:context_length - 2]
+    return [_tokenizer.token_id('[CLS]')] + ids + [_tokenizer.token_id('[SEP]')]
 
-    result = np.zeros((len(all_tokens), context_length), dtype=np.int64)
 
-    for i, tokens in enumerate(all_tokens):
-        assert len(tokens) <= context_length
-        result[i, :len(tokens)] = np.array(tokens)
+def pack_token_ids(rows, context_length=52, dynamic=False, dtype=np.int64):
+    """Writes rows of token ids into one preallocated, zero padded (N, L) array.
 
+    L is context_length, or with dynamic the longest row rounded up to a
+    multiple of CLIP_TXT_LENGTH_BUCKET, capped at context_length.
+    """
+    lengths = np.fromiter((len(row) for row in rows), dtype=np.intp, count=len(rows))
+    width = context_length
+    if dynamic and len(rows):
+        bucket = max(1, env_txt_length_bucket)
+        width = min(context_length, -(-int(lengths.max()) // bucket) * bucket)
+    assert not len(rows) or lengths.max() <= width
+    result = np.zeros((len(rows), width), dtype=dtype)
+    if len(rows) <= 8:
+        # 行数很少时逐行写入更快，单个搜索词走这里
+        for i, row in enumerate(rows):
+            result[i, :len(row)] = row
+        return result
+    # 掩码按行优先顺序选中每行的前len个位置，与所有token依次拼接的顺序一致，一次写入
+    result[np.arange(width) < lengths[:, None]] = np.fromiter(itertools.chain.from_iterable(rows), dtype=dtype,
+                                                                count=int(lengths.sum()))
     return result
 
 
+def txt_identity():
+    # 开启可变序列长度后特征有细微差异，拼接到缓存key的模型标识后；默认设置返回空字符串
+    return f":dynamic_length={env_txt_length_bucket}" if env_txt_dynamic_length else ""
+
+
+def configured_model_path(fp32_path, int8_path):
+    # 开启 CLIP_QUANTIZED 且INT8模型文件存在时使用INT8模型，否则使用fp32模型
+    if env_clip_quantized and os.path.exists(int8_path):
+        return int8_path
+    return fp32_path
+
+
+SAMPLE_TEXTS = ["一只猫", "海边的日落", "生日蛋糕和蜡烛", "雪山下的湖泊", "城市夜景", "穿着红色衣服的小孩",
+                "餐桌上的火锅", "下雨天的街道", "身份证", "草地上奔跑的狗", "婚礼合影", "书桌上的笔记本电脑",
+                "樱花", "地铁站", "海底的鱼群", "截图"]
+
+
+def sample_images(folder="", count=16):
+    """Loads up to count images from folder, or generates fixed random smooth images when folder is empty."""
+    images = []
+    if folder:
+        for name in sorted(os.listdir(folder)):
+            img = cv2.imread(join_path(folder, name), cv2.IMREAD_COLOR)
+            if img is not None:
+                images.append(img)
+            if len(images) >= count:
+                break
+    if not images:
+        rng = np.random.default_rng(0)
+        for _ in range(count):
+            small = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+            images.append(cv2.resize(small, (IMG_SIZE * 2, IMG_SIZE * 2), interpolation=cv2.INTER_CUBIC))
+    return images
+
+
+def sample_inputs(kind, folder="", texts=None, count=16):
+    if kind == "img":
+        return image_processor(sample_images(folder, count), image_size=IMG_SIZE)
+    return tokenize_numpy(texts or SAMPLE_TEXTS, 52)
+
+
+def compare_models(kind, reference_model, model, inputs):
+    """Cosine similarity between the features of two models on the same inputs."""
+    run = run_img_model if kind == "img" else run_txt_model
+    a = np.asarray(run(model, inputs), dtype=np.float64)
+    b = np.asarray(run(reference_model, inputs), dtype=np.float64)
+    cosine = np.sum(a * b, axis=-1) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1))
+    return {
+        'samples': len(cosine),
+        'mean_cosine': round(float(cosine.mean()), 6),
+        'min_cosine': round(float(cosine.min()), 6),
+        'passed': bool(cosine.mean() >= env_clip_int8_min_cosine),
+    }
+
+
+quantized_checks = {}
+
+
+def quantized_check_key(fp32_path, int8_path):
+    return f"{model_identity(int8_path)}|{model_identity(fp32_path)}"
+
+
+def loaded_model_path(fp32_path, int8_path):
+    """The model file load_quantized uses for this pair, or None until the INT8 check has run."""
+    if configured_model_path(fp32_path, int8_path) == fp32_path:
+        return fp32_path
+    report = quantized_checks.get(quantized_check_key(fp32_path, int8_path))
+    if report is None:
+        return None
+    return int8_path if report['passed'] else fp32_path
+
+
+def load_quantized(kind, fp32_path, int8_path, create_func):
+    """Loads the INT8 model if enabled and close enough to fp32 on the sample set, else the fp32 model.
+
+    The check result is kept per model file pair, so reloading after an idle
+    unload does not run it again.
+    """
+    if configured_model_path(fp32_path, int8_path) == fp32_path:
+        return create_func(fp32_path)
+    key = quantized_check_key(fp32_path, int8_path)
+    report = quantized_checks.get(key)
+    if report is None:
+        fp32_model = create_func(fp32_path)
+        int8_model = create_func(int8_path)
+        report = compare_models(kind, fp32_model, int8_model, sample_inputs(kind, env_clip_int8_sample_dir))
+        report['model'] = os.path.basename(int8_path)
+        quantized_checks[key] = report
+        print(f"clip {kind} int8 check: {report}")
+        if report['passed']:
+            del fp32_model
+            return int8_model
+        del int8_model
+        print(f"clip {kind} int8 mean cosine below {env_clip_int8_min_cosine}, use {os.path.basename(fp32_path)}")
+        return fp32_model
+    return create_func(int8_path if report['passed'] else fp32_path)
+
+
+ov_core = None
+
+
+def get_core():
+    # 所有模型共用一个Core，避免重复加载设备插件
+    global ov_core
+    if ov_core is None:
+        ov_core = Core()
+        if env_ov_cache_dir:
+            ov_core.set_property({"CACHE_DIR": env_ov_cache_dir})
+    return ov_core
+
+
+def inference_identity():
+    # 会影响特征结果的推理选项，拼接到缓存key的模型标识后；默认设置返回空字符串
+    return f":precision={env_ov_precision}" if env_ov_precision else ""
+
+
+class InferPool(object):
+    """Runs a compiled model through an AsyncInferQueue.
+
+    A batch is split into one chunk per infer request, so the chunks run on
+    parallel streams instead of serializing on the compiled model's single
+    implicit request.
+    """
+
+    def __init__(self, compiled_model, config, jobs=0):
+        self.compiled_model = compiled_model
+        self.config = config
+        if jobs <= 0:
+            try:
+                jobs = int(compiled_model.get_property("OPTIMAL_NUMBER_OF_INFER_REQUESTS"))
+            except Exception:
+                jobs = 1
+        self.jobs = max(1, jobs)
+        self.queue = AsyncInferQueue(compiled_model, self.jobs)
+        self.queue.set_callback(self._on_done)
+        self.results = {}
+        self.lock = threading.Lock()
+        batch_dim = compiled_model.input(0).get_partial_shape()[0]
+        # 模型导出时batch维度固定为1，只能逐张推理
+        self.fixed_batch = batch_dim.is_static and batch_dim.get_length() == 1
+
+    def _on_done(self, request, index):
+        # 输出tensor的内存会被下一次推理复用，需要复制
+        self.results[index] = request.get_output_tensor(0).data.copy()
+
+    def infer(self, inputs):
+        with self.lock:
+            chunk = 1 if self.fixed_batch else math.ceil(len(inputs) / self.jobs)
+            self.results = {}
+            count = 0
+            for start in range(0, len(inputs), chunk):
+                self.queue.start_async({0: inputs[start:start + chunk]}, count)
+                count += 1
+            self.queue.wait_all()
+            return np.concatenate([self.results[i] for i in range(count)])
+
+    def stats(self):
+        return dict(self.config, infer_requests=self.jobs)
+
+
+def compile_model(model_path, hint="LATENCY"):
+    config = {"PERFORMANCE_HINT": hint}
+    if env_ov_num_streams:
+        config["NUM_STREAMS"] = env_ov_num_streams
+    if env_ov_precision:
+        config["INFERENCE_PRECISION_HINT"] = env_ov_precision
+    # 直接传入模型路径，开启CACHE_DIR时可跳过读取和编译ONNX模型
+    compiled_model = get_core().compile_model(model_path, device_name=env_ov_device, config=config)
+    return InferPool(compiled_model, dict(config, model=os.path.basename(model_path)), env_ov_infer_requests)
+
+
 def load_img_model():
-    core = Core()
-    model_onnx = core.read_model(img_onnx_model_path)
-    return core.compile_model(model=model_onnx, device_name="AUTO")
+    return load_quantized("img", img_onnx_model_path, img_int8_model_path,
+                          lambda model_path: compile_model(model_path, env_ov_img_hint))
 
 def process_image(img, img_model):
-    inputs = image_processor([img], image_size=IMG_SIZE)
-    input = inputs[0:1, :, :, :]
-    return img_model(input)[img_model.output(0)][0]
+    return process_images([img], img_model)[0]
+
+
+def process_images(imgs, img_model):
+    return run_img_model(img_model, image_processor(imgs, image_size=IMG_SIZE))
+
+
+def run_img_model(img_model, inputs):
+    return list(img_model.infer(inputs))
 
 
 def load_txt_model():
-    core = Core()
-    model_onnx = core.read_model(txt_onnx_model_path)
-    return core.compile_model(model=model_onnx, device_name="AUTO")
+    return load_quantized("txt", txt_onnx_model_path, txt_int8_model_path,
+                          lambda model_path: compile_model(model_path, env_ov_txt_hint))
+
+
+def txt_input_spec(text_model):
+    """Returns (dynamic, dtype): whether to pad to a variable sequence length, which needs CLIP_TXT_DYNAMIC_LENGTH
+    and a text graph that allows it, and the integer type of the text input.
+    """
+    text_input = text_model.compiled_model.input(0)
+    dynamic = env_txt_dynamic_length and text_input.get_partial_shape()[1].is_dynamic
+    return dynamic, np.int32 if text_input.get_element_type() == Type.i32 else np.int64
 
 
 def process_txt(txt, text_model):
-    input = tokenize_numpy([txt], 52)
-    return text_model(input)[text_model.output(0)][0]
+    dynamic, dtype = txt_input_spec(text_model)
+    input = pack_token_ids([token_ids(txt)], 52, dynamic, dtype)
+    return run_txt_model(text_model, input)[0]
+
+
+def process_txts(txts, text_model):
+    """Embeds a list of texts in batches of CLIP_TXT_BATCH_SIZE, returns the features in input order."""
+    dynamic, dtype = txt_input_spec(text_model)
+    rows = [token_ids(txt) for txt in txts]
+    order = list(range(len(rows)))
+    if dynamic:
+        # 按token数排序后分批，同一批内的文本长度接近，补齐更少
+        order.sort(key=lambda i: len(rows[i]))
+    embeddings = [None] * len(rows)
+    batch_size = max(1, env_txt_batch_size)
+    for start in range(0, len(order), batch_size):
+        indexes = order[start:start + batch_size]
+        inputs = pack_token_ids([rows[i] for i in indexes], 52, dynamic, dtype)
+        for i, embedding in zip(indexes, run_txt_model(text_model, inputs)):
+            embeddings[i] = embedding
+    return embeddings
+
+
+def run_txt_model(text_model, inputs):
+    return list(text_model.infer(inputs))
@@ -0,0 +1,56 @@
+import base64
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# format 参数可选值：
+#   json     默认格式，16位小数字符串列表，兼容旧版客户端
+#   f32/f16  小端 float32/float16 原始字节
+#   b64/b64_f16  上述原始字节的base64字符串，放在json里返回
+#   msgpack  {'result': [float32, ...], 'dtype': 'float32', 'dim': n}
+FORMATS = ('json', 'f32', 'f16', 'b64', 'b64_f16', 'msgpack')
+JSON_FORMATS = ('json', 'b64', 'b64_f16') # 可以放在json结构里返回的格式，一次返回多个特征的接口只支持这些格式
+
+ACCEPT_FORMATS = {
+    'application/octet-stream': 'f32',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+}
+
+
+def negotiate_format(fmt=None, accept=None):
+    """Picks the response format from the ``format`` query flag, then the Accept header."""
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in FORMATS:
+            raise HTTPException(status_code=406, detail=f"Unsupported format, available: {', '.join(FORMATS)}")
+    elif accept:
+        for media_range in accept.split(','):
+            media_type = media_range.split(';')[0].strip().lower()
+            if media_type in ACCEPT_FORMATS:
+                fmt = ACCEPT_FORMATS[media_type]
+                break
+    fmt = fmt or 'json'
+    if fmt == 'msgpack' and msgpack is None:
+        raise HTTPException(status_code=406, detail="msgpack is not installed")
+    return fmt
+
+
+def embedding_response(vec, fmt='json'):
+    if fmt == 'json':
+        return {'result': ["{:.16f}".format(v) for v in vec]}
+
+    dtype = 'float16' if fmt.endswith('f16') else 'float32'
+    arr = np.asarray(vec, dtype=np.float32).reshape(-1).astype('<f2' if dtype == 'float16' else '<f4', copy=False)
+    if fmt in ('f32', 'f16'):
+        headers = {'X-Embedding-Dtype': dtype, 'X-Embedding-Dim': str(arr.size)}
+        return Response(content=arr.tobytes(), media_type='application/octet-stream', headers=headers)
+    if fmt in ('b64', 'b64_f16'):
+        return {'result': base64.b64encode(arr.tobytes()).decode('ascii'), 'dtype': dtype, 'dim': arr.size}
+    content = msgpack.packb({'result': arr.tolist(), 'dtype': 'float32', 'dim': arr.size}, use_single_float=True)
+    return Response(content=content, media_type='application/x-msgpack')
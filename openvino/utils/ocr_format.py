@@ -0,0 +1,93 @@
+import numpy as np
+
+# layout 参数可选值：
+#   default  默认格式，boxes 为 {'x','y','width','height'} 字符串字典的列表，scores 为2位小数字符串，兼容旧版客户端
+#   compact  boxes 为 {'x': [...], 'y': [...], 'width': [...], 'height': [...]} 并列的数值数组，scores 为数值数组
+LAYOUTS = ('default', 'compact')
+
+
+def box_columns(boxes, scale=1.0, bounds=False):
+    """Converts an (N, 4, 2) array of quadrilaterals into x, y, width, height arrays.
+
+    By default the box is taken from the top-left, top-right and bottom-right
+    corners as RapidOCR orders them; with ``bounds`` it is the axis-aligned
+    bounding box of all four points. float32 boxes stay float32, anything else
+    is computed in float64, matching the per-box arithmetic on the original values.
+    """
+    boxes = np.asarray(boxes)
+    if boxes.dtype != np.float32:
+        boxes = boxes.astype(np.float64)
+    boxes = boxes.reshape(-1, 4, 2)
+    if bounds:
+        low = boxes.min(axis=1)
+        high = boxes.max(axis=1)
+        x, y = low[:, 0], low[:, 1]
+        width, height = high[:, 0] - x, high[:, 1] - y
+    else:
+        x, y = boxes[:, 0, 0], boxes[:, 0, 1]
+        width, height = boxes[:, 1, 0] - x, boxes[:, 2, 1] - y
+    if scale != 1.0:
+        return x * scale, y * scale, width * scale, height * scale
+    return x, y, width, height
+
+
+def round2(values):
+    """Rounds to 2 decimals with exactly the same result as the builtin ``round(v, 2)``.
+
+    float32 input is rounded in float32 like ``round(np.float32(v), 2)`` and
+    returned as the float64 values with the same shortest repr, so ``str()``
+    of the result matches ``str()`` of the float32 result.
+    """
+    values = np.asarray(values)
+    if values.dtype == np.float32:
+        return np.round(values, 2).astype(str).astype(np.float64)
+    values = values.astype(np.float64)
+    scaled = values * 100
+    rounded = np.rint(scaled) / 100
+    # x*100 的舍入误差只会在接近 .5 的位置改变结果，这些值交给内置 round 处理
+    ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if ties.any():
+        rounded[ties] = [round(v, 2) for v in values[ties].tolist()]
+    return rounded
+
+
+def compact_result(boxes, texts, scores, scale=1.0, bounds=False):
+    if boxes is None or len(boxes) == 0:
+        return {'texts': [], 'scores': [], 'boxes': {'x': [], 'y': [], 'width': [], 'height': []}}
+    x, y, width, height = (round2(column).tolist() for column in box_columns(boxes, scale, bounds))
+    return {
+        'texts': list(texts),
+        'scores': round2(np.asarray(scores, dtype=np.float64)).tolist(),
+        'boxes': {'x': x, 'y': y, 'width': width, 'height': height},
+    }
+
+
+def to_default_layout(result):
+    boxes = result['boxes']
+    if not isinstance(boxes, dict):
+        return result
+    # str(round(v, 2)) 与旧版 to_fixed 的输出完全一致
+    x, y, width, height = (map(str, boxes[key]) for key in ('x', 'y', 'width', 'height'))
+    return {
+        'texts': result['texts'],
+        'scores': [f"{score:.2f}" for score in result['scores']],
+        'boxes': [{'x': a, 'y': b, 'width': c, 'height': d} for a, b, c, d in zip(x, y, width, height)],
+    }
+
+
+def to_compact_layout(result):
+    boxes = result['boxes']
+    if isinstance(boxes, dict):
+        return result
+    return {
+        'texts': result['texts'],
+        'scores': [float(score) for score in result['scores']],
+        'boxes': {key: [float(box[key]) for box in boxes] for key in ('x', 'y', 'width', 'height')},
+    }
+
+
+def ocr_layout(result, layout='default'):
+    """Returns an OCR result in the requested layout, converting from the other one when needed."""
+    if not isinstance(result, dict):
+        return result
+    return to_compact_layout(result) if layout == 'compact' else to_default_layout(result)
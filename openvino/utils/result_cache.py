@@ -0,0 +1,228 @@
+import asyncio
+import collections
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def content_hash(data):
+    """Fast hash of uploaded bytes, prefixed with the algorithm so persisted keys stay unambiguous."""
+    if xxhash is not None:
+        return "xxh3:" + xxhash.xxh3_128_hexdigest(data)
+    return "b2b:" + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _report_error(future):
+    if future.exception() is not None:
+        print(f"cache disk write failed: {future.exception()}")
+
+
+class SqliteStore(object):
+    """Size-bounded key/value store in a SQLite file, evicting least recently used rows.
+
+    Lives on disk, so cached results survive the idle restart of the server.
+    ``executor`` is a single thread that callers on an event loop use for
+    lookups and writes, so SQLite I/O never blocks the loop.
+    """
+
+    def __init__(self, path, max_bytes):
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-disk")
+        self.conn = self._connect()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache ("
+                     "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                     "created REAL NOT NULL, accessed REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        return conn
+
+    def reopen(self):
+        """Opens a new connection and disk thread; neither can be used across fork()."""
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-disk")
+        self.conn = self._connect()
+
+    def flush(self):
+        """Waits for the writes queued on the disk thread."""
+        self.executor.submit(lambda: None).result()
+
+    def get(self, key, ttl=0):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if ttl and created + ttl < now:
+                self._delete(key)
+                return None
+            self.conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            return value
+
+    def put(self, key, value):
+        now = time.time()
+        size = len(key) + len(value)
+        with self.lock:
+            self._delete(key)
+            self.conn.execute("INSERT INTO cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                              (key, sqlite3.Binary(value), size, now, now))
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _delete(self, key):
+        row = self.conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self.total_bytes -= row[0]
+
+    def _evict(self):
+        # 一次淘汰到容量的90%，避免每次写入都触发淘汰
+        target = self.max_bytes * 0.9
+        # 多个进程共用同一个文件时，各自记录的大小不包含其他进程的写入，淘汰前重新统计
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        while self.total_bytes > target:
+            rows = self.conn.execute("SELECT key, size FROM cache ORDER BY accessed LIMIT 256").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            evicted = []
+            for key, size in rows:
+                if self.total_bytes <= target:
+                    break
+                evicted.append((key,))
+                self.total_bytes -= size
+            self.conn.executemany("DELETE FROM cache WHERE key = ?", evicted)
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {'path': self.path, 'entries': entries, 'bytes': self.total_bytes, 'max_bytes': self.max_bytes}
+
+
+class LRUCache(object):
+    """Thread-safe in-memory LRU cache bounded by total size, with optional TTL and disk tier.
+
+    ``dumps``/``loads`` convert values to and from bytes; the byte length is
+    used as the entry size, and the bytes are what the disk tier stores.
+    Writes to the disk tier are queued on its thread and not waited for; on an
+    event loop use ``aget``, which reads the disk tier on that thread too.
+    """
+
+    def __init__(self, max_bytes, dumps, loads, ttl=0, disk=None):
+        self.max_bytes = max_bytes
+        self.dumps = dumps
+        self.loads = loads
+        self.ttl = ttl
+        self.disk = disk
+        self.data = collections.OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self._get_memory(key)
+        if value is None:
+            value = self._get_disk(key)
+        return value
+
+    async def aget(self, key):
+        """Same as ``get``; a memory miss is looked up on the disk thread instead of blocking the event loop."""
+        value = self._get_memory(key)
+        if value is None:
+            if self.disk is None:
+                return self._get_disk(key)
+            value = await asyncio.get_running_loop().run_in_executor(self.disk.executor, self._get_disk, key)
+        return value
+
+    def _get_memory(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            value, size, expire_at = entry
+            if expire_at and expire_at < time.monotonic():
+                self._remove(key)
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _get_disk(self, key):
+        if self.disk is not None:
+            raw = self.disk.get(key, self.ttl)
+            if raw is not None:
+                value = self.loads(raw)
+                with self.lock:
+                    self.disk_hits += 1
+                    self._put_memory(key, value, len(key) + len(raw))
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        raw = self.dumps(value)
+        with self.lock:
+            self._put_memory(key, value, len(key) + len(raw))
+        if self.disk is not None:
+            # 写入磁盘放到磁盘线程排队执行，不等待完成
+            self.disk.executor.submit(self.disk.put, key, raw).add_done_callback(_report_error)
+
+    def _put_memory(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        expire_at = time.monotonic() + self.ttl if self.ttl else 0
+        self.data[key] = (value, size, expire_at)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self.data.popitem(last=False)
+            self.current_bytes -= evicted_size
+
+    def _remove(self, key):
+        entry = self.data.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            stats = {
+                'entries': len(self.data),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+    def after_fork(self):
+        """Resets the lock and reconnects the disk tier in a forked worker process."""
+        self.lock = threading.Lock()
+        if self.disk is not None:
+            self.disk.reopen()
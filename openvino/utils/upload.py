@@ -0,0 +1,104 @@
+import mmap
+import os
+import tarfile
+import zipfile
+from PIL import Image
+
+
+def upload_size(upload):
+    """Size in bytes of an uploaded file, without reading it."""
+    if getattr(upload, 'size', None) is not None:
+        return upload.size
+    f = upload.file
+    position = f.tell()
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(position)
+    return size
+
+
+def image_dimensions(upload):
+    """Reads (width, height) from the image header, or returns None when the format is not recognized.
+
+    Only the header is parsed, so oversized images can be rejected before the
+    pixels are decoded.
+    """
+    f = upload.file
+    try:
+        f.seek(0)
+        with Image.open(f) as image:
+            return image.size
+    except Exception:
+        return None
+    finally:
+        f.seek(0)
+
+
+def upload_buffer(upload):
+    """Returns the content of an uploaded file without copying it into a new bytes object.
+
+    Small uploads that python-multipart kept in memory share the BytesIO
+    buffer; uploads spooled to a temporary file are memory-mapped, so the pages
+    come from the page cache instead of the Python heap. The mapping is
+    released once the returned memoryview is no longer referenced.
+    """
+    f = upload.file
+    inner = getattr(f, '_file', f)
+    if not getattr(f, '_rolled', True) and hasattr(inner, 'getvalue'):
+        # 未导出缓冲区时 getvalue 直接返回内部的bytes对象，不会复制
+        return inner.getvalue()
+    try:
+        f.flush()
+        size = os.fstat(f.fileno()).st_size
+        if size > 0:
+            return memoryview(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ))
+    except (AttributeError, OSError, ValueError):
+        pass
+    # 无法映射的文件对象或空文件，读取全部内容
+    f.seek(0)
+    return f.read()
+
+
+class ArchiveLimitError(ValueError):
+    """Raised when an archive holds more files or more bytes than allowed."""
+
+
+def is_archive(filename):
+    name = (filename or "").lower()
+    return name.endswith(('.zip', '.tar', '.tar.gz', '.tgz'))
+
+
+def _check_archive_limits(files, nbytes, max_files, max_bytes):
+    if files > max_files:
+        raise ArchiveLimitError(f"too many files, max {max_files}")
+    if max_bytes and nbytes > max_bytes:
+        raise ArchiveLimitError(f"archive too large, max {max_bytes / 1024 / 1024:g}MB")
+
+
+def read_archive(fileobj, max_files, max_bytes=0):
+    """Reads the files of a zip or tar archive in archive order, returns a list of (name, content).
+
+    The member count and the declared sizes are checked before anything is
+    decompressed, and at most ``max_bytes`` (0 for no limit) are extracted, so
+    a small archive cannot expand into gigabytes of memory. Raises
+    ArchiveLimitError when a limit is exceeded.
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as zf:
+            members = [info for info in zf.infolist() if not info.is_dir()]
+            _check_archive_limits(len(members), sum(info.file_size for info in members), max_files, max_bytes)
+            # 解压出的数据不会超过声明的大小，超出部分校验失败
+            return [(info.filename, zf.read(info)) for info in members]
+    fileobj.seek(0)
+    with tarfile.open(fileobj=fileobj) as tf:
+        members = []
+        scanned = 0
+        # tar包没有集中的文件列表，逐个读取文件头，超出限制时立即停止，不再解压剩余的数据
+        for member in tf:
+            scanned += tarfile.BLOCKSIZE + member.size
+            if member.isfile():
+                members.append(member)
+            _check_archive_limits(len(members), scanned, max_files, max_bytes)
+        return [(member.name, tf.extractfile(member).read()) for member in members]